@@ -1,8 +1,39 @@
 import streamlit as st
-import google.generativeai as genai
-from typing import Dict
+import os
+import csv
+import json
+import time
+import uuid
 from datetime import datetime
 
+from story2ch.batch import build_batch_params, build_batch_zip, parse_batch_rows, run_batch
+from story2ch.bible import BIBLE_PATH, BIBLE_SUMMARY_TOKENS, BibleStore
+from story2ch.budget import DOWNGRADE_MODEL_NAME, TokenEstimator, UsageLedger, USAGE_PATH, check_budget
+from story2ch.cache import CACHE_PATH, ResponseCache, make_cache_key
+from story2ch.client import BACKEND_ENV, add_usage, create_model, generate_chaptered, make_usage, partial_usage, response_usage
+from story2ch.context_cache import ContextCache, ContextCachedModel, context_cached_factory
+from story2ch.export import EXPORT_FORMATS, export_text
+from story2ch.history import HISTORY_PATH, HistoryStore
+from story2ch.jobqueue import BATCH, INTERACTIVE, JOBS_PATH, JobQueue, JobStore
+from story2ch.metrics import METRICS_PATH, InstrumentedModel, MetricsStore
+from story2ch.pipeline import FINISHED_STATUSES, PIPELINE_PATH, PipelineStore, build_pipeline, pipeline_stage_params, run_pipeline, stage_calls
+from story2ch.precheck import proofread_with_precheck, run_precheck
+from story2ch.proofread import CHUNK_SIZE, format_proofread_report, proofread_chunked, split_into_chunks
+from story2ch.prompts import (
+    SECONDARY_CHECK_LABELS, VIDEO_PROMPT_FUNCS, VIDEO_TYPE_ALIASES, create_2ch_video_prompt, create_error_check_prompt,
+    create_kaigai_hanno_prompt, create_name_prompt, create_plot_prompt, create_script_prompt, create_secondary_check_prompt,
+    create_sukatto_prompt, create_theme_generation_prompt,
+)
+from story2ch.routing import TASK_LABELS, CallLog, ModelRouter, classify_task
+from story2ch.paging import download_buffer, page_label, text_pages
+from story2ch.recheck import (
+    changed_chunks, diff_paragraphs, format_proofread_recheck_report, format_secondary_recheck_report, proofread_base, recheck_proofread,
+    recheck_secondary, secondary_base, secondary_base_from_report,
+)
+from story2ch.sampling import HEURISTIC_LABELS, run_best_of_n
+from story2ch.stats import NARRATION_CHARS_PER_MINUTE, content_hash, format_duration, text_stats
+from story2ch.storyboard import PAGES_PER_SHARD, PANEL_FIELDS, SHARDED_NAME_MIN_PAGES, generate_name_sharded, page_ranges
+
 # ===============================================================================
 # ページ設定
 # ===============================================================================
@@ -60,8 +91,8 @@ def initialize_session_state():
     """セッション状態を初期化"""
     if 'generated_content' not in st.session_state:
         st.session_state.generated_content = ""
-    if 'generation_history' not in st.session_state:
-        st.session_state.generation_history = []
+    if 'history_session_id' not in st.session_state:
+        st.session_state.history_session_id = get_history_session_id()
     if 'api_key' not in st.session_state:
         st.session_state.api_key = ""
     if 'model' not in st.session_state:
@@ -72,6 +103,216 @@ def initialize_session_state():
         st.session_state.session_token_count = 0
     if 'last_token_count' not in st.session_state:
         st.session_state.last_token_count = 0
+    if 'active_job_id' not in st.session_state:
+        st.session_state.active_job_id = None
+    if 'best_of_n' not in st.session_state:
+        st.session_state.best_of_n = None
+    if 'recheck_bases' not in st.session_state:
+        st.session_state.recheck_bases = {}
+    if 'name_pages' not in st.session_state:
+        st.session_state.name_pages = None
+    if 'bible_saved' not in st.session_state:
+        st.session_state.bible_saved = False
+    if 'download_ready' not in st.session_state:
+        st.session_state.download_ready = None
+    if 'export_ready' not in st.session_state:
+        st.session_state.export_ready = None
+    if 'stream_cancelled' not in st.session_state:
+        st.session_state.stream_cancelled = False
+    if 'cache_hits' not in st.session_state:
+        st.session_state.cache_hits = 0
+    if 'cache_misses' not in st.session_state:
+        st.session_state.cache_misses = 0
+    if 'batch_result' not in st.session_state:
+        st.session_state.batch_result = None
+    if 'session_input_tokens' not in st.session_state:
+        st.session_state.session_input_tokens = 0
+    if 'session_output_tokens' not in st.session_state:
+        st.session_state.session_output_tokens = 0
+    if 'session_cost' not in st.session_state:
+        st.session_state.session_cost = 0.0
+    if 'downgrade_model' not in st.session_state:
+        st.session_state.downgrade_model = None
+    if 'pipeline_result' not in st.session_state:
+        st.session_state.pipeline_result = None
+
+# ===============================================================================
+# レスポンスキャッシュ
+# ===============================================================================
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """プロセス全体で共有するレスポンスキャッシュを取得"""
+    return ResponseCache(CACHE_PATH)
+
+@st.cache_resource
+def get_context_cache() -> ContextCache:
+    """同じ原稿・指示を繰り返し送る場合に使う、プロセス全体で共有するコンテキストキャッシュを取得"""
+    return ContextCache()
+
+def record_cache_result(hit: bool):
+    """キャッシュのヒット/ミスをセッションに記録"""
+    if hit:
+        st.session_state.cache_hits += 1
+    else:
+        st.session_state.cache_misses += 1
+
+def cache_enabled() -> bool:
+    """サイドバーの設定でキャッシュが有効かどうか"""
+    return st.session_state.get('use_response_cache', True)
+
+# ===============================================================================
+# 生成履歴
+# ===============================================================================
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    """プロセス全体で共有する生成履歴ストアを取得"""
+    return HistoryStore(HISTORY_PATH)
+
+def get_history_session_id() -> str:
+    """URLのクエリパラメータに保存した履歴セッションIDを取得（ページを再読み込みしても同じ履歴を表示する）"""
+    if 'sid' not in st.query_params:
+        st.query_params['sid'] = uuid.uuid4().hex
+    return st.query_params['sid']
+
+def add_history(content_type: str, content: str):
+    """生成結果を履歴ストアに保存"""
+    get_history_store().add(st.session_state.history_session_id, content_type, content)
+
+def load_history_item(history_id: int):
+    """履歴の本文を読み込んで生成結果に表示する（履歴ボタンのコールバック）"""
+    content = get_history_store().get_content(history_id)
+    if content is not None:
+        st.session_state.generated_content = content
+
+def render_history_items(items: list, key_prefix: str):
+    """履歴の概要（プレビュー）を表示し、本文はボタンで必要な時だけ読み込む"""
+    for item in items:
+        with st.expander(f"{item['timestamp']} - {item['type']}"):
+            st.text(item['preview'] + ("..." if item['size'] > len(item['preview']) else ""))
+            st.button("📄 この結果を開く", key=f"{key_prefix}_{item['id']}", on_click=load_history_item, args=(item['id'],))
+
+# ===============================================================================
+# 設定資料（シリーズの登場人物・世界観・プロット）
+# ===============================================================================
+@st.cache_resource
+def get_bible_store() -> BibleStore:
+    """プロセス全体で共有する設定資料ストアを取得"""
+    return BibleStore(BIBLE_PATH)
+
+def active_bible_summary():
+    """サイドバーで選んだ設定資料の要約（選んでいなければNone）"""
+    bible_id = st.session_state.get('active_bible_id')
+    if not bible_id:
+        return None
+    return get_bible_store().summary(bible_id, int(st.session_state.get('bible_budget_tokens', BIBLE_SUMMARY_TOKENS)))
+
+def with_bible(params: dict) -> dict:
+    """生成パラメータに設定資料のIDと要約を加える（プロンプトには全文ではなく要約だけを差し込む）"""
+    summary = active_bible_summary()
+    if not summary:
+        return params
+    return dict(params, bible_id=st.session_state.active_bible_id, bible=summary['text'])
+
+def save_plot_to_bible(plot: str):
+    """生成したプロットを選択中の設定資料に取り込む（ボタンのコールバック）"""
+    if get_bible_store().import_plot(st.session_state.active_bible_id, plot):
+        st.session_state.bible_saved = True
+
+# ===============================================================================
+# トークン見積もり・予算管理
+# ===============================================================================
+@st.cache_resource
+def get_token_estimator() -> TokenEstimator:
+    """プロンプトのハッシュごとに見積もりをキャッシュするトークン見積もりを取得"""
+    return TokenEstimator()
+
+@st.cache_resource
+def get_usage_ledger() -> UsageLedger:
+    """全セッション共通の日別使用量台帳を取得"""
+    return UsageLedger(USAGE_PATH)
+
+def budget_limits():
+    """サイドバーで設定した予算（0は無制限）"""
+    return {'request_tokens': st.session_state.get('budget_request_tokens', 0),
+            'session_cost': st.session_state.get('budget_session_cost', 0.0),
+            'day_cost': st.session_state.get('budget_day_cost', 0.0)}
+
+def estimate_request(model, prompt_func, params, calls=1, output_calls=None):
+    """生成前に入力・出力トークン数と料金を見積もる（output_callsは1本分の出力を返す呼び出しの数。省略時はcallsと同じ）"""
+    counter = model if st.session_state.get('use_count_tokens_api', False) else None
+    return get_token_estimator().estimate(prompt_func(params), params, getattr(model, 'model_name', ''), counter, calls, output_calls)
+
+def render_preflight(model, prompt_func, params, calls=1, output_calls=None):
+    """生成ボタンの前に見積もりを表示"""
+    estimate = estimate_request(model, prompt_func, params, calls, output_calls)
+    reason = check_budget(estimate, st.session_state.session_cost, get_usage_ledger().today()['cost'], budget_limits())
+    st.caption(f"📏 見積もり: 入力 約{estimate['input_tokens']:,} / 出力 約{estimate['output_tokens']:,} トークン・約${estimate['cost']:.4f}"
+               + (f"　⚠️ {reason}" if reason else ""))
+
+def get_downgrade_model():
+    """予算超過時に使う低価格モデルを取得"""
+    if st.session_state.downgrade_model is None and st.session_state.api_key:
+        st.session_state.downgrade_model = ContextCachedModel(create_model(st.session_state.api_key, DOWNGRADE_MODEL_NAME), get_context_cache())
+    return st.session_state.downgrade_model
+
+def apply_budget(model, prompt_func, params, calls=1, output_calls=None):
+    """予算を確認して使用するモデルを返す（超過時は設定に応じて低価格モデルに切り替えるか、Noneを返して中止）"""
+    estimate = estimate_request(model, prompt_func, params, calls, output_calls)
+    day_cost = get_usage_ledger().today()['cost']
+    reason = check_budget(estimate, st.session_state.session_cost, day_cost, budget_limits())
+    if reason is None:
+        return model
+    if st.session_state.get('budget_policy', 'block') == 'downgrade':
+        downgraded = get_downgrade_model()
+        if downgraded is not None:
+            estimate = estimate_request(downgraded, prompt_func, params, calls, output_calls)
+            if check_budget(estimate, st.session_state.session_cost, day_cost, budget_limits()) is None:
+                st.warning(f"⚠️ {reason}。低価格モデル {DOWNGRADE_MODEL_NAME} で生成します。")
+                return downgraded
+    st.error(f"🚫 予算を超えるため生成を中止しました: {reason}")
+    return None
+
+# ===============================================================================
+# モデルの振り分け
+# ===============================================================================
+@st.cache_resource
+def get_call_log() -> CallLog:
+    """モデル呼び出しの実績ログを取得"""
+    return CallLog()
+
+@st.cache_resource
+def get_router(api_key: str) -> ModelRouter:
+    """プロセス全体で共有するモデルルーター（サーキットブレーカーの状態も共有）を取得"""
+    return ModelRouter(api_key, call_log=get_call_log(), model_factory=context_cached_factory(get_context_cache()))
+
+def routing_enabled() -> bool:
+    """モデルの自動振り分けが有効か"""
+    return st.session_state.get('use_model_routing', True) and bool(st.session_state.api_key)
+
+def route_model(model, prompt_func, params):
+    """自動振り分けが有効ならタスクに応じたモデルを返す"""
+    if not routing_enabled():
+        return model
+    return get_router(st.session_state.api_key).for_task(classify_task(prompt_func, params))
+
+# ===============================================================================
+# 呼び出しごとの計測
+# ===============================================================================
+# プロンプト関数から計測結果の集計に使うタブ名を決める
+METRIC_TABS = {
+    'create_theme_generation_prompt': 'テーマ生成', 'create_plot_prompt': 'プロット作成', 'create_script_prompt': '台本作成',
+    'create_error_check_prompt': '誤字脱字検出', 'create_2ch_video_prompt': 'YouTube動画台本', 'create_kaigai_hanno_prompt': 'YouTube動画台本',
+    'create_sukatto_prompt': 'YouTube動画台本', 'create_name_prompt': 'ネーム作成', 'create_secondary_check_prompt': '推敲・二次チェック',
+}
+
+@st.cache_resource
+def get_metrics_store() -> MetricsStore:
+    """プロセス全体で共有する計測結果の保存先を取得"""
+    return MetricsStore(METRICS_PATH)
+
+def instrument(model, tab: str, content_type: str):
+    """モデル呼び出しを計測するラッパーで包む（予算超過でNoneの場合はそのまま）"""
+    return InstrumentedModel(model, get_metrics_store(), tab=tab, content_type=content_type) if model is not None else None
 
 # ===============================================================================
 # Gemini API 関連の関数
@@ -79,8 +320,7 @@ def initialize_session_state():
 def setup_gemini_api(api_key: str):
     """Gemini APIを設定"""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        model = ContextCachedModel(create_model(api_key), get_context_cache())
         model.generate_content("テスト")
         return model
     except Exception as e:
@@ -88,260 +328,556 @@ def setup_gemini_api(api_key: str):
         st.info("💡 ヒント: 'gemini-2.0-flash-exp' が利用できない場合、他のモデル名をお試しください。")
         return None
 
-def generate_content(model, prompt_func, params, content_type):
-    """コンテンツ生成の共通関数"""
+def record_token_usage(usage, ledger=True):
+    """トークン使用量と料金をセッションと本日の合計に記録（ledger=Falseならセッションのみ）"""
+    st.session_state.last_token_count = usage['tokens']
+    st.session_state.session_token_count += usage['tokens']
+    st.session_state.session_input_tokens += usage['input_tokens']
+    st.session_state.session_output_tokens += usage['output_tokens']
+    st.session_state.session_cost += usage['cost']
+    if ledger and usage['tokens']:
+        get_usage_ledger().add(usage)
+
+# ===============================================================================
+# 共有ジョブキュー（全セッションの生成をワーカープールで実行し、流量を制限する）
+# ===============================================================================
+@st.cache_resource
+def get_job_store() -> JobStore:
+    """ジョブの状態と結果の保存先を取得（再読み込み・再接続後に結果を受け取るため）"""
+    return JobStore(JOBS_PATH)
+
+@st.cache_resource
+def get_job_queue() -> JobQueue:
+    """プロセス全体で共有するジョブキュー（RPM・TPMの制限とワーカープール）を取得"""
+    return JobQueue(store=get_job_store())
+
+def submit_job(func, content_type, model, prompt_func, params, calls=1, priority=INTERACTIVE, output_calls=None):
+    """見積もりトークン数を添えてバックグラウンドのジョブを投入（ユーザーごとの公平な順番・再接続には履歴のセッションIDを使う）"""
+    estimate = estimate_request(model, prompt_func, params, calls, output_calls)
+    return submit_estimated_job(func, content_type, estimate, calls, priority)
+
+def submit_estimated_job(func, label, estimate, calls=1, priority=INTERACTIVE):
+    """見積もり済みの使用量でジョブを投入し、再接続できるように保存して実行中のジョブにする"""
+    job = get_job_queue().submit(func, st.session_state.history_session_id, priority, calls,
+                                 estimate['input_tokens'] + estimate['output_tokens'], label, persist=True)
+    st.session_state.active_job_id = job.id
+    return job
+
+def note_queue_wait(model, job):
+    """ジョブの待ち時間を計測に記録（ワーカースレッドで、最初のモデル呼び出しの前に呼ぶ）"""
+    model.note(queue_ms=((job.started_at or time.time()) - job.submitted_at) * 1000)
+
+def job_result(text, usage, context, content_type, cache_hits=0, cache_misses=0):
+    """ジョブの結果を履歴と本日の使用量に記録し、保存できる形にまとめる（ワーカースレッドで実行するため、ストアは呼び出し元で取得して渡す）"""
+    context['store'].add(context['session_id'], content_type, text)
+    if usage['tokens']:
+        context['ledger'].add(usage)
+    return {'text': text, **{key: usage[key] for key in ('tokens', 'input_tokens', 'output_tokens', 'cost')},
+            'cache_hits': cache_hits, 'cache_misses': cache_misses}
+
+def job_context():
+    """ワーカースレッドから使うストアとセッションID"""
+    return {'store': get_history_store(), 'session_id': st.session_state.history_session_id, 'ledger': get_usage_ledger()}
+
+def cancel_streaming():
+    """実行中・待機中のジョブを中止し、途中までの結果を保持する（停止ボタンのコールバック）"""
+    job = get_job_queue().get(st.session_state.active_job_id) if st.session_state.active_job_id else None
+    if job is not None:
+        partial = job.partial
+        get_job_queue().cancel(job.id)
+        if partial:
+            st.session_state.generated_content = partial
+            add_history(f"{job.label}（中断）", partial)
+            st.session_state.last_token_count = 0
+    st.session_state.stream_cancelled = True
+
+# ストリーミング中に毎秒送り直す本文は末尾のこの文字数だけにする
+STREAM_TAIL_CHARS = 3000
+
+@st.fragment(run_every=1.0)
+def render_job_progress(job_id):
+    """実行中のジョブの待ち順・ストリーミング中の本文・進捗を定期的に更新して表示（完了したらページ全体を再実行）"""
+    job_queue = get_job_queue()
+    job = job_queue.get(job_id)
+    if job is None or job.future.done():
+        st.rerun()
+    position = job_queue.position(job)
+    if job.status == 'レート制限待ち':
+        st.caption(f"⏳ {job.label}: 次に実行されます。APIのレート制限の空きを待っています...")
+    elif position:
+        waiting = job_queue.stats()['waiting']
+        st.caption(f"⏳ {job.label}: 待ち順 {position}番目（待機中 " + "・".join(f"{label} {count}件" for label, count in waiting.items()) + "）")
+    else:
+        st.caption(f"⚡ {job.label}生成中...（ページを再読み込みしても生成は続きます）")
+    st.button("⏹️ 生成を中止", on_click=cancel_streaming, key="stream_stop_button", help="途中までの結果を残して生成を中止")
+    if job.progress:
+        done, total = job.progress
+        st.progress(done / total, text=f"{job.label}を並列生成中... ({done}/{total})")
+    if job.partial:
+        if len(job.partial) > STREAM_TAIL_CHARS:
+            st.caption(f"…（先頭の{len(job.partial) - STREAM_TAIL_CHARS:,}文字は完了後に表示します）")
+        st.markdown(job.partial[-STREAM_TAIL_CHARS:] + "▌")
+
+def apply_job_record(record):
+    """完了したジョブの結果をセッションに反映（本日の使用量と履歴はワーカー側で記録済み）"""
+    result = record['result'] or {}
+    # 一括生成・パイプラインの結果は各タブで表示するので、反映したらページを再実行する
+    rerun = record['status'] == '完了' and ('batch' in result or 'pipeline' in result)
+    if record['status'] == '完了':
+        if 'batch' in result:
+            st.session_state.batch_result = {'zip': build_batch_zip(result['batch'], tuple(result['export_formats'])),
+                                             'manifest': [{k: v for k, v in item.items() if k != 'text'} for item in result['batch']]}
+        elif 'pipeline' in result:
+            st.session_state.pipeline_result = result['pipeline']
+            if result['text']:
+                st.session_state.generated_content = result['text']
+        else:
+            st.session_state.generated_content = result['text']
+            st.session_state.best_of_n = result.get('candidates')
+            st.session_state.name_pages = result.get('name_pages')
+            if result.get('recheck_base'):
+                st.session_state.recheck_bases[result['recheck_base']['kind']] = result['recheck_base']
+        st.session_state.stream_cancelled = False
+        record_token_usage(result, ledger=False)
+        if cache_enabled():
+            st.session_state.cache_hits += result['cache_hits']
+            st.session_state.cache_misses += result['cache_misses']
+        if not rerun:
+            st.success(f"✅ {record['label']} 生成完了！")
+    elif record['status'] == '中止':
+        if result:
+            record_token_usage(result, ledger=False)
+        st.session_state.stream_cancelled = True
+    else:
+        st.error(f"生成エラー（{record['label']}）: {record['error']}")
+    get_job_store().mark_delivered(record['id'])
+    st.session_state.active_job_id = None
+    if rerun:
+        st.rerun()
+
+def render_job_panel():
+    """実行中のジョブの進捗、または完了したジョブの結果を表示（再接続時は未受け取りのジョブに再接続する）"""
+    job_id = st.session_state.active_job_id
+    if job_id is None:
+        pending = get_job_store().pending(st.session_state.history_session_id)
+        if not pending:
+            return
+        job_id = st.session_state.active_job_id = pending[0]['id']
+    job = get_job_queue().get(job_id)
+    if job is not None and not job.future.done():
+        render_job_progress(job_id)
+        return
+    record = get_job_store().load(job_id)
+    if record is None:
+        st.session_state.active_job_id = None
+        return
+    apply_job_record(record)
+
+def run_generation(model, prompt, job, stream, build_ms):
+    """1回分の生成（ワーカースレッドで実行。ストリーミングの場合は受信した本文をjob.partialに反映し、中止されたら打ち切る）"""
+    model.note(build_ms=build_ms)
+    note_queue_wait(model, job)
+    if not stream:
+        response = model.generate_content(prompt)
+        return response.text, response_usage(response, getattr(model, 'model_name', ''))
+    response = model.generate_content(prompt, stream=True)
+    result = ""
+    for chunk in response:
+        if job.cancelled.is_set():
+            return result, partial_usage(response, getattr(model, 'model_name', ''), prompt, result)
+        if not chunk.parts: continue
+        result += chunk.text
+        job.update(partial=result)
+    return result, response_usage(response, getattr(model, 'model_name', ''))
+
+def generate_content(model, prompt_func, params, content_type, use_cache=True):
+    """コンテンツ生成の共通関数（use_cache=Falseでキャッシュを読まずに新しく生成）
+
+    キャッシュにあればすぐに結果を返し、なければバックグラウンドのジョブを投入してNoneを返す（結果はrender_job_panelで受け取る）。
+    """
     try:
+        started = time.perf_counter()
         prompt = prompt_func(params)
+        build_ms = (time.perf_counter() - started) * 1000
         st.session_state.last_generation_params = {'prompt_func': prompt_func, 'params': params, 'content_type': content_type}
-        with st.spinner(f"{content_type}生成中..."):
-            response = model.generate_content(prompt)
-            result = response.text
-            if hasattr(response, 'usage_metadata') and response.usage_metadata:
-                last_tokens = response.usage_metadata.total_token_count
-                st.session_state.last_token_count = last_tokens
-                st.session_state.session_token_count += last_tokens
-            else:
-                st.session_state.last_token_count = 0
-            st.session_state.generated_content = result
-            st.session_state.generation_history.append({'timestamp': datetime.now().strftime("%Y/%m/%d %H:%M"), 'type': content_type, 'content': result})
+        st.session_state.stream_cancelled = False
+        model = instrument(apply_budget(route_model(model, prompt_func, params), prompt_func, params), METRIC_TABS.get(prompt_func.__name__, 'その他'), content_type)
+        if model is None:
+            return None
+        cache = get_response_cache() if cache_enabled() else None
+        cache_key = make_cache_key(model, prompt)
+        cached = cache.get(cache_key) if cache and use_cache else None
+        if cache:
+            record_cache_result(cached is not None)
+        if cached:
+            model.record_cache_hit(prompt)
+            record_token_usage(make_usage())
+            st.session_state.best_of_n = st.session_state.name_pages = None
+            if prompt_func is create_secondary_check_prompt:
+                st.session_state.recheck_bases['二次チェック'] = secondary_base_from_report(params['text_to_check'], params['check_type'], cached['text'])
+            st.session_state.generated_content = cached['text']
+            add_history(content_type, cached['text'])
+            return cached['text']
+        stream = st.session_state.get('use_streaming', True)
+        context = job_context()
+        def run(job):
+            text, usage = run_generation(model, prompt, job, stream, build_ms)
+            if job.cancelled.is_set():
+                # 途中までの本文は保存しないが、使った分は本日の使用量に記録する
+                if usage['tokens']:
+                    context['ledger'].add(usage)
+                return {'text': text, **usage, 'cache_hits': 0, 'cache_misses': 0}
+            if cache:
+                cache.put(cache_key, text, usage['tokens'])
+            result = job_result(text, usage, context, content_type)
+            if prompt_func is create_secondary_check_prompt:
+                result['recheck_base'] = secondary_base_from_report(params['text_to_check'], params['check_type'], text)
             return result
+        submit_job(run, content_type, model, prompt_func, params)
+        return None
     except Exception as e:
         st.error(f"生成エラー: {str(e)}")
         return None
 
 # ===============================================================================
-# プロンプト生成関数群
+# 長編台本の章別並列生成
 # ===============================================================================
-def create_theme_generation_prompt(params: Dict) -> str:
-    """テーマ生成用のプロンプト"""
-    if params['generation_type'] == 'genre':
-        source_text = f"【ジャンル】: {params['genre']}"
-        instruction = "このジャンルに沿った、独創的で魅力的な物語や動画のテーマを考えてください。"
-    else:
-        source_text = f"【キーワード】: {params['keyword']}"
-        instruction = "このキーワードから発想を広げ、面白そうな物語や動画のテーマを考えてください。"
+# 5章がそれぞれ想定の長さの半分ほど（最低1500～2000文字）を書き、合わせて2本分程度を見込む
+CHAPTERED_OUTPUT_CALLS = 2
 
-    prompt = f"""
-あなたは一流のクリエイティブプロデューサーです。あなたの仕事は、まだ誰も見たことがないような、視聴者の心を掴む物語のアイデアを生み出すことです。
-{instruction}
+def generate_chaptered_content(model, prompt_func, params, content_type, use_cache=True):
+    """アウトライン生成後、5章を並列に生成して1本の台本に結合する（バックグラウンドのジョブとして実行）"""
+    try:
+        st.session_state.last_generation_params = {'prompt_func': prompt_func, 'params': params, 'content_type': content_type, 'generator': generate_chaptered_content}
+        st.session_state.stream_cancelled = False
+        model = instrument(apply_budget(route_model(model, prompt_func, params), prompt_func, params, calls=6, output_calls=CHAPTERED_OUTPUT_CALLS), METRIC_TABS.get(prompt_func.__name__, 'その他'), content_type)
+        if model is None:
+            return None
+        cache = get_response_cache() if cache_enabled() else None
+        context = job_context()
+        def run(job):
+            note_queue_wait(model, job)
+            outcome = generate_chaptered(model, prompt_func, params, cache, use_cache, on_progress=lambda done, total: job.update(progress=(done, total)),
+                                         cancelled=job.cancelled)
+            return job_result(outcome['text'], outcome, context, content_type, outcome['cache_hits'], outcome['cache_misses'])
+        submit_job(run, content_type, model, prompt_func, params, calls=6, output_calls=CHAPTERED_OUTPUT_CALLS)
+        return None
+    except Exception as e:
+        st.error(f"生成エラー: {str(e)}")
+        return None
 
-{source_text}
+# ===============================================================================
+# 長編ネームのページ分割並列生成
+# ===============================================================================
+def generate_sharded_name(model, prompt_func, params, content_type, use_cache=True):
+    """ページごとのビートシートを作成してから、ページ範囲ごとにネームを並列に生成して結合する（バックグラウンドのジョブとして実行）"""
+    try:
+        st.session_state.last_generation_params = {'prompt_func': prompt_func, 'params': params, 'content_type': content_type, 'generator': generate_sharded_name}
+        st.session_state.stream_cancelled = False
+        calls = 1 + len(page_ranges(int(params['pages'])))
+        # 1回あたりはPAGES_PER_SHARDページ分なので、全体のページ数ではなく範囲の大きさでモデルを選ぶ
+        model = instrument(apply_budget(route_model(model, prompt_func, dict(params, pages=PAGES_PER_SHARD)), prompt_func, params, calls=calls, output_calls=1), METRIC_TABS.get(prompt_func.__name__, 'その他'), content_type)
+        if model is None:
+            return None
+        cache = get_response_cache() if cache_enabled() else None
+        context = job_context()
+        def run(job):
+            note_queue_wait(model, job)
+            outcome = generate_name_sharded(model, params, cache, use_cache, on_progress=lambda done, total: job.update(progress=(done, total)),
+                                            cancelled=job.cancelled)
+            return dict(job_result(outcome['text'], outcome, context, content_type, outcome['cache_hits'], outcome['cache_misses']), name_pages=outcome['pages'])
+        submit_job(run, content_type, model, prompt_func, params, calls=calls, output_calls=1)
+        return None
+    except Exception as e:
+        st.error(f"生成エラー: {str(e)}")
+        return None
 
-以下の要件に従って、{params['num_ideas']}個のテーマ案を提案してください。
+# ===============================================================================
+# 長文の分割並列校正
+# ===============================================================================
+def generate_chunked_proofread(model, prompt_func, params, content_type, use_cache=True):
+    """長文を段落・文単位のチャンクに分けて並列に校正し、結果を1つにまとめる（バックグラウンドのジョブとして実行）"""
+    try:
+        st.session_state.last_generation_params = {'prompt_func': prompt_func, 'params': params, 'content_type': content_type, 'generator': generate_chunked_proofread}
+        st.session_state.stream_cancelled = False
+        chunks = len(split_into_chunks(params['text']))
+        model = instrument(apply_budget(route_model(model, prompt_func, params), prompt_func, params, calls=chunks, output_calls=1), METRIC_TABS.get(prompt_func.__name__, 'その他'), content_type)
+        if model is None:
+            return None
+        cache = get_response_cache() if cache_enabled() else None
+        context = job_context()
+        def run(job):
+            note_queue_wait(model, job)
+            outcome = proofread_chunked(model, params['text'], params.get('level', 'basic'), cache, use_cache,
+                                        on_progress=lambda done, total: job.update(progress=(done, total)), cancelled=job.cancelled, bible=params.get('bible'))
+            return dict(job_result(format_proofread_report(outcome), outcome, context, content_type, outcome['cache_hits'], outcome['cache_misses']),
+                        recheck_base=proofread_base(params['text'], params.get('level', 'basic'), outcome['corrections']))
+        submit_job(run, content_type, model, prompt_func, params, calls=chunks, output_calls=1)
+        return None
+    except Exception as e:
+        st.error(f"生成エラー: {str(e)}")
+        return None
 
-【出力要件】
-- 各テーマは、キャッチーな「タイトル」と、2～3行の「概要」で構成してください。
-- 視聴者が「面白そう！」「続きが見たい！」と思うような、好奇心を刺激する内容にしてください。
-- ありきたりなアイデアではなく、少しひねりのある、独創的な切り口を重視してください。
+def generate_prechecked_proofread(model, prompt_func, params, content_type, use_cache=True):
+    """ローカルチェックを先に行い、指摘箇所の前後だけをAIで校正する（指摘がなければAIを呼ばない。バックグラウンドのジョブとして実行）"""
+    try:
+        st.session_state.last_generation_params = {'prompt_func': prompt_func, 'params': params, 'content_type': content_type, 'generator': generate_prechecked_proofread}
+        st.session_state.stream_cancelled = False
+        model = instrument(apply_budget(route_model(model, prompt_func, params), prompt_func, params), METRIC_TABS.get(prompt_func.__name__, 'その他'), content_type)
+        if model is None:
+            return None
+        cache = get_response_cache() if cache_enabled() else None
+        context = job_context()
+        def run(job):
+            note_queue_wait(model, job)
+            outcome = proofread_with_precheck(model, params['text'], params.get('level', 'basic'), cache, use_cache, bible=params.get('bible'))
+            hit = outcome['cache_hit'] if cache else None
+            return job_result(outcome['text'], outcome, context, content_type, int(hit is True), int(hit is False))
+        submit_job(run, content_type, model, prompt_func, params)
+        return None
+    except Exception as e:
+        st.error(f"生成エラー: {str(e)}")
+        return None
 
-【出力形式】
-1. **タイトル**: （ここにタイトル）
-   **概要**: （ここに2～3行の概要）
+# ===============================================================================
+# 編集後の差分再チェック
+# ===============================================================================
+# 再チェックの種類ごとの、チェック対象の原稿とチェック条件のパラメータ名
+RECHECK_TEXT_KEYS = {'校正': 'text', '二次チェック': 'text_to_check'}
+RECHECK_OPTION_KEYS = {'校正': 'level', '二次チェック': 'check_type'}
 
-2. **タイトル**: （ここにタイトル）
-   **概要**: （ここに2～3行の概要）
+def recheck_available(kind, params):
+    """同じ条件で前回チェックした結果があり、差分だけの再チェックができるか"""
+    base = st.session_state.recheck_bases.get(kind)
+    return base is not None and base[RECHECK_OPTION_KEYS[kind]] == params.get(RECHECK_OPTION_KEYS[kind]) and bool(params[RECHECK_TEXT_KEYS[kind]].strip())
 
-(以下、指定された数まで繰り返す)
-"""
-    return prompt
+def recheck_plan(kind, params):
+    """前回の結果・変更部分のチャンク・見積もり用のパラメータ（変更部分だけの原稿）"""
+    base = st.session_state.recheck_bases[kind]
+    text = params[RECHECK_TEXT_KEYS[kind]]
+    chunks = changed_chunks(text, diff_paragraphs(base['text'], text)['changed'])
+    return base, chunks, dict(params, **{RECHECK_TEXT_KEYS[kind]: "".join(chunk['text'] for chunk in chunks)})
 
-def create_plot_prompt(params: Dict) -> str:
-    """プロット生成用プロンプト"""
-    mode_instructions = {
-        'full-auto': '完全自動で詳細なプロットを生成してください。','semi-self': 'ユーザーの入力を参考に、AIが補完・改良したプロットを生成してください。','self': 'ユーザーの入力を最大限活用し、最小限の補完でプロットを整理してください。'
-    }
-    prompt = f"""
-あなたはプロの脚本家・小説家です。以下の条件でプロットを作成してください。
-【作成モード】: {mode_instructions.get(params.get('mode', 'full-auto'))}
-【基本情報】- ジャンル: {params.get('genre', '未指定')} - タイトル: {params.get('title', '未設定')}
-【設定詳細】- 主人公: {params.get('protagonist', '未設定')} - 世界観: {params.get('worldview', '未設定')}
-{f"【既存プロット参考】: {params.get('existing_plot')}" if params.get('existing_plot') else ""}
-【出力形式】
-1. 作品概要
-2. 主要登場人物
-3. 三幕構成での詳細プロット
-4. 重要シーン詳細
-5. テーマ・メッセージ
-プロの作家が作成したような、感情的な起伏と論理的な構成を持つ完成度の高いプロットを作成してください。"""
-    return prompt
-
-def create_script_prompt(params: Dict) -> str:
-    """台本生成用プロンプト"""
-    format_instructions = {
-        'standard': '標準的な台本形式','screenplay': '映画脚本形式','radio': 'ラジオドラマ形式','youtube': 'YouTube動画台本','2ch-thread': '2ch風スレッド形式','manga-name': 'マンガネーム形式'
-    }
-    prompt = f"""
-あなたはプロの脚本家です。以下のプロットを{format_instructions.get(params.get('format', 'standard'))}の台本に変換してください。
-【プロット】
-{params.get('plot')}
-【台本形式】: {params.get('format', 'standard')}
-【出力要件】
-- セリフは自然で感情豊かに
-- ト書きは具体的で映像化しやすく
-- キャラクターの個性を台詞に反映
-プロの脚本家が書いたような、演出意図が明確で実用性の高い台本を作成してください。"""
-    return prompt
-
-def create_error_check_prompt(params: Dict) -> str:
-    """誤字脱字チェック用プロンプト"""
-    level_instructions = {
-        'basic': '基本的な誤字脱字、変換ミスをチェック','advanced': '文法、表現の不自然さもチェック','professional': '敬語、専門用語、文体統一まで総合チェック'
-    }
-    prompt = f"""
-あなたはプロの校正者です。以下のテキストを{level_instructions.get(params.get('level', 'basic'))}してください。
-【チェック対象テキスト】
-{params.get('text')}
-【チェックレベル】: {params.get('level', 'basic')}
-【出力形式】
-1. 修正済みテキスト
-2. 修正箇所一覧（原文、修正、理由）
-3. 全体的な改善提案
-プロの校正者として、読みやすさと正確性を両立した修正を行ってください。"""
-    return prompt
-
-def create_youtube_prompt_base(params: Dict) -> str:
-    """YouTube台本プロンプトの共通ベースを作成する関数"""
-    pov_instruction = ""
-    if params.get('pov_character') == '主人公':
-        pov_instruction = "物語は主人公の一人称（私、俺など）で進行し、モノローグ（心の声）を多めに含めてください。"
-    elif params.get('pov_character') == '悪役・敵役':
-        pov_instruction = "物語は悪役の一人称（私、俺様など）で進行し、その傲慢な思考や誤算を描写してください。"
-    elif params.get('pov_character') == '第三者ナレーター':
-        pov_instruction = "物語を客観的な第三者の視点から、登場人物の行動や状況を冷静に説明してください。"
-    else: # その他の登場人物
-        pov_instruction = f"物語を「{params.get('pov_character')}」の視点から語り、その人物がどう事件に関わったかを描写してください。"
-
-    narrative_framework = ""
-    if params.get('use_advanced_settings'):
-        narrative_framework = f"""
-【物語の詳細な骨子】
-この骨子はユーザーが設定した物語の土台です。必ずこの内容を物語に反映させてください。
-- 主人公の設定: {params.get('protagonist_setting')}
-- 物語の導入（起）: {params.get('story_start')}
-- 物語の展開（承）: {params.get('story_development')}
-- 物語の転機（転）: {params.get('story_turn')}
-- 物語の結末（結）: {params.get('story_ending')}
-"""
-
-    long_story_instruction = ""
-    if params.get('length') in ['long', 'super_long']:
-        long_story_instruction = """
-【超長文生成のための特別指示】
-あなたのモデルには一度に出力できる文章量に上限があることを理解しています。その上限を最大限に活用し、可能な限り長い物語を生成するために、物語を5つの章（第一章: 発端、第二章: 展開、第三章: 転機、第四章: クライマックス、第五章: 結末）に明確に分割して構成してください。
-各章ごとに、最低でも1500文字以上、可能であれば2000文字以上を執筆してください。各章では、情景描写、人物の心理描写、会話のやり取りを詳細かつ豊富に盛り込んでください。
-この指示に従うことで、あなたは自身の能力を最大限に発揮し、ユーザーが求める長大で満足度の高い物語を完成させることができます。"""
-
-    return f"""
-【最重要指示】
-{pov_instruction}
-{narrative_framework}
-{long_story_instruction}
-"""
-
-def create_2ch_video_prompt(params: Dict) -> str:
-    base_prompt = create_youtube_prompt_base(params)
-    style_settings = {'love-story': '恋愛','work-life': '職場','school-life': '学校','family': '家族','mystery': '不思議体験','revenge': '復讐','success': '成功体験','heartwarming': 'ほっこり・感動','shuraba': '修羅場','occult': '洒落怖・ホラー','history': '歴史・偉人語り'}
-    prompt = f"""
-あなたは人気YouTube動画の台本作家です。
-{base_prompt}
-【設定】
-- 動画のテーマ: {params.get('theme')}
-- スレッドの雰囲気: {style_settings.get(params.get('style'))}
-【台本要件】
-- 興味を引くスレッドタイトルを考える。
-- 主人公「スレ主」、反応する「住民A」「住民B」などを登場させる。
-- 物語に山場とオチを作る。
-【出力形式】
-語り手（{params.get('pov_character')}）: 「（オープニングや状況説明、心の声など）」
-【テロップ】: （スレッドタイトル）
-スレ主: 「（投稿内容）」
-住民A: 「（レス）」
-（以下、この形式を繰り返して物語を完成させる）
-以上の要件を厳守し、最高の2ch風動画台本を作成してください。"""
-    return prompt
-
-def create_kaigai_hanno_prompt(params: Dict) -> str:
-    base_prompt = create_youtube_prompt_base(params)
-    style_details = {'praise': '日本称賛','technology': '技術・経済','moving': '感動・ほっこり','vs': '嫌中・比較','food': '食文化・料理','history': '歴史・伝統','anime': 'アニメ・漫画感想','culture_shock': '日常・カルチャーショック','social': '社会・ニュース'}
-    prompt = f"""
-あなたは「海外の反応」系YouTubeチャンネルのプロの台本作家です。
-{base_prompt}
-【設定】
-- 動画のテーマ: {params.get('theme')}
-- 動画のスタイル: {style_details.get(params.get('style'))}
-【台本の構成案】
-1. オープニング
-2. テーマの概要説明
-3. 海外の反応（メインパート）
-4. エンディング
-【出力形式】
-- ナレーターのセリフ、引用コメント、テロップ指示を明確に分けて記述してください。
-最高の台本を作成してください。"""
-    return prompt
-
-def create_sukatto_prompt(params: Dict) -> str:
-    base_prompt = create_youtube_prompt_base(params)
-    style_details = {'revenge': '復讐劇','dqn': 'DQN返し','karma': '因果応報','workplace': '職場の逆転劇','neighbor': 'ご近所トラブル','in_laws': '嫁姑問題','cheating': '浮気・不倫の制裁','manners': 'マナー違反への天罰','monster_parent': 'モンスターペアレント撃退','history': 'スカッと偉人伝'}
-    prompt = f"""
-あなたは「スカッと系」YouTubeチャンネルのプロの台本作家です。
-{base_prompt}
-【設定】
-- 物語のテーマ: {params.get('theme')}
-- 物語のスタイル: {style_details.get(params.get('style'))}
-【台本の構成案】
-1. プロローグ（最悪な状況）
-2. 葛藤・我慢
-3. 転機（反撃の狼煙）
-4. クライマックス（スカッとタイム）
-5. エピローグ（悪役の末路と主人公の未来）
-【出力形式】
-- 登場人物の名前を具体的に設定してください。
-- 語り手({params.get('pov_character')})、他の登場人物のセリフ、ト書きを明確に分けて記述してください。
-最高のスカッと系台本を作成してください。"""
-    return prompt
-
-def create_name_prompt(params: Dict) -> str:
-    format_instructions = {'manga': 'マンガのネーム','4koma': '4コマ漫画のネーム','storyboard': 'アニメの絵コンテ','webtoon': 'ウェブトゥーン形式'}
-    prompt = f"""
-あなたはプロの漫画家・演出家です。以下のストーリーを{format_instructions.get(params.get('format', 'manga'))}に構成してください。
-【ストーリー概要】: {params.get('story')}
-【ページ数】: {params.get('pages', 20)}ページ
-【形式】: {params.get('format', 'manga')}
-【出力形式】
-各ページ/コマごとに：- ページ/コマ番号 - コマ割り指示 - 登場人物の配置 - セリフ・モノローグ - 動作・表情指示 - 背景・効果音指示
-読者が映像として想像しやすく、感情移入できるネームを作成してください。"""
-    return prompt
-
-def create_secondary_check_prompt(params: Dict) -> str:
-    """推敲・二次チェック用のプロンプト"""
-    check_points = {
-        'plot_holes': '物語のプロット（構成）に矛盾や破綻、ご都合主義な点がないか探し、具体的な改善案を提示してください。',
-        'character_consistency': '登場人物の言動や性格に一貫性があるか確認してください。矛盾している点があれば指摘し、キャラクターの魅力を高めるための提案をしてください。',
-        'dialogue_polish': 'セリフが陳腐であったり、説明的すぎたりしないかチェックしてください。よりキャラクターの個性が際立ち、生き生きとした会話になるようにリライト案を提示してください。',
-        'pacing_improvement': '物語のテンポは適切か確認してください。中だるみしている部分や、展開が早すぎる部分を指摘し、緩急のある魅力的な展開にするための改善案を提案してください。'
-    }
-    prompt = f"""
-あなたは超一流の脚本家、または編集者です。
-以下の【元のテキスト】を、指定された【チェック項目】に従って、プロの視点から厳しくチェックし、具体的な改善提案を出してください。
+def generate_recheck(model, prompt_func, params, content_type, use_cache=True):
+    """前回チェックした版から変更された段落と前後の文脈だけをAIでチェックし、前回の指摘と統合する（バックグラウンドのジョブとして実行）"""
+    try:
+        st.session_state.last_generation_params = {'prompt_func': prompt_func, 'params': params, 'content_type': content_type, 'generator': generate_recheck}
+        st.session_state.stream_cancelled = False
+        kind = '校正' if prompt_func is create_error_check_prompt else '二次チェック'
+        base, chunks, changed_params = recheck_plan(kind, params)
+        calls = max(1, len(chunks))
+        model = instrument(apply_budget(route_model(model, prompt_func, changed_params), prompt_func, changed_params, calls=calls, output_calls=1), METRIC_TABS.get(prompt_func.__name__, 'その他'), content_type)
+        if model is None:
+            return None
+        cache = get_response_cache() if cache_enabled() else None
+        context = job_context()
+        text, option = params[RECHECK_TEXT_KEYS[kind]], params[RECHECK_OPTION_KEYS[kind]]
+        def run(job):
+            note_queue_wait(model, job)
+            progress = lambda done, total: job.update(progress=(done, total))
+            if kind == '校正':
+                outcome = recheck_proofread(model, base, text, option, cache, use_cache, on_progress=progress, cancelled=job.cancelled, bible=params.get('bible'))
+                report, next_base = format_proofread_recheck_report(outcome), proofread_base(text, option, outcome['corrections'])
+            else:
+                outcome = recheck_secondary(model, base, text, option, cache, use_cache, on_progress=progress, cancelled=job.cancelled, bible=params.get('bible'))
+                report, next_base = format_secondary_recheck_report(outcome), secondary_base(text, option, outcome['summary'], outcome['findings'])
+            return dict(job_result(report, outcome, context, content_type, outcome['cache_hits'], outcome['cache_misses']), recheck_base=next_base)
+        submit_job(run, content_type, model, prompt_func, changed_params, calls=calls, output_calls=1)
+        return None
+    except Exception as e:
+        st.error(f"生成エラー: {str(e)}")
+        return None
 
-【チェック項目】
-{check_points.get(params.get('check_type'))}
+def render_recheck_option(kind, prompt_func, params):
+    """前回チェックした結果があれば差分再チェックの選択肢と見積もりを表示し、選ばれたかを返す"""
+    if not recheck_available(kind, params):
+        return False
+    _, chunks, changed_params = recheck_plan(kind, params)
+    use_recheck = st.checkbox(f"✏️ 前回チェックした版からの変更部分だけを再チェック（{len(chunks)}箇所・{len(changed_params[RECHECK_TEXT_KEYS[kind]]):,}文字）", value=True, key=f"use_recheck_{RECHECK_OPTION_KEYS[kind]}",
+                              help="段落単位で前回の原稿と比べ、変更された段落と前後の文脈だけをAIに送ります。変更のない段落の指摘は前回の結果を引き継ぎます。")
+    if use_recheck and chunks:
+        render_preflight(st.session_state.model, prompt_func, changed_params, calls=len(chunks), output_calls=1)
+    return use_recheck
 
-【元のテキスト】
----
-{params.get('text_to_check')}
----
+# ===============================================================================
+# 複数候補からの選択（best-of-N）
+# ===============================================================================
+def generate_best_of_n(model, prompt_func, params, content_type, n=3, judge=False):
+    """温度を変えたn個の候補を並列に生成し、簡易評価（と任意でAIの審査）の順位を付ける（バックグラウンドのジョブとして実行）"""
+    try:
+        st.session_state.stream_cancelled = False
+        calls = n + (1 if judge else 0)
+        model = instrument(apply_budget(route_model(model, prompt_func, params), prompt_func, params, calls=calls), METRIC_TABS.get(prompt_func.__name__, 'その他'), f"{content_type}（{n}案）")
+        if model is None:
+            return None
+        context = job_context()
+        def run(job):
+            note_queue_wait(model, job)
+            outcome = run_best_of_n(model, prompt_func, params, n, judge, content_type, on_progress=lambda done, total: job.update(progress=(done, total)),
+                                    cancelled=job.cancelled)
+            return dict(job_result(outcome['text'], outcome, context, content_type), candidates=outcome['candidates'])
+        submit_job(run, f"{content_type}（{n}案）", model, prompt_func, params, calls=calls)
+        return None
+    except Exception as e:
+        st.error(f"生成エラー: {str(e)}")
+        return None
+
+def adopt_candidate(text: str):
+    """候補を生成結果として採用する（ボタンのコールバック）"""
+    st.session_state.generated_content = text
+
+# 候補の比較で表示する先頭の文字数（全文は採用すると生成結果に表示される）
+CANDIDATE_PREVIEW_CHARS = 2000
+
+def render_best_of_n(candidates: list):
+    """候補を順位順に横並びで表示"""
+    st.subheader("🎲 候補の比較（点数順）")
+    for row in range(0, len(candidates), 3):
+        columns = st.columns(3)
+        for column, (rank, c) in zip(columns, list(enumerate(candidates, start=1))[row:row + 3]):
+            with column:
+                if c['error']:
+                    st.markdown(f"**候補{c['index']}**（温度 {c['temperature']}）")
+                    st.error(c['error'])
+                    continue
+                st.markdown(f"**{rank}位: 候補{c['index']}** — {c['score']}点（温度 {c['temperature']}）")
+                details = "・".join(f"{HEURISTIC_LABELS[k]} {v:.0%}" for k, v in c['heuristics'].items())
+                st.caption(f"簡易評価 {c['heuristic_score']}点（{details or '評価項目なし'}）" + (f"／AI審査 {c['judge_score']}/10: {c['judge_reason']}" if c['judge_score'] is not None else "")
+                           + (f"／⚠️ {c['finish_reason']}で途中終了" if c['finish_reason'] == 'MAX_TOKENS' else ""))
+                st.text_area(f"候補{c['index']}", value=c['text'][:CANDIDATE_PREVIEW_CHARS], height=300, disabled=True, label_visibility="collapsed", key=f"best_of_n_text_{c['index']}")
+                if len(c['text']) > CANDIDATE_PREVIEW_CHARS:
+                    st.caption(f"全{len(c['text']):,}文字のうち先頭{CANDIDATE_PREVIEW_CHARS:,}文字を表示しています")
+                st.button("✅ この案を採用", key=f"best_of_n_adopt_{c['index']}", on_click=adopt_candidate, args=(c['text'],), use_container_width=True)
+
+# ===============================================================================
+# 大きな生成結果の表示
+# ===============================================================================
+def render_result_text(content: str):
+    """生成結果を表示（長い結果は章・見出しの区切りで分け、選んだ部分だけを送る）"""
+    pages = text_pages(content)
+    if len(pages) <= 1:
+        st.text_area(label="生成された内容", value=content, height=500, key="generated_content_display")
+        return
+    index = st.selectbox("表示する部分", range(len(pages)), format_func=lambda i: page_label(pages, i), key="generated_content_page",
+                         help="長い結果は章・見出しの区切りで分けて表示します。全文はダウンロードできます。")
+    page = pages[index]
+    st.text_area(label="生成された内容", value=content[page['start']:page['end']], height=500, key=f"generated_content_display_{index}")
+
+def prepare_download(digest: str):
+    """ダウンロード用のデータを用意する（ボタンのコールバック）"""
+    st.session_state.download_ready = digest
+
+def render_download(content: str):
+    """テキストファイルのダウンロードボタン（長い結果は、押されたときだけバッファを作って送る）"""
+    file_name = f"generated_content_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+    if len(text_pages(content)) <= 1:
+        st.download_button(label="💾 テキストファイルダウンロード", data=content.encode('utf-8'), file_name=file_name, mime="text/plain", use_container_width=True)
+        return
+    digest = content_hash(content)
+    if st.session_state.download_ready != digest:
+        st.button(f"💾 テキストファイルを用意（{len(content):,}文字）", on_click=prepare_download, args=(digest,), use_container_width=True, key="prepare_download_button")
+        return
+    st.download_button(label="💾 テキストファイルダウンロード", data=download_buffer(content), file_name=file_name, mime="text/plain", use_container_width=True)
+
+def prepare_export(key: str):
+    """字幕・TTS用のデータを用意する（ボタンのコールバック）"""
+    st.session_state.export_ready = key
+
+def render_export(content: str):
+    """台本を話者ごとの行に分けた字幕・TTS用の形式のダウンロード（押されたときだけ書き出す）"""
+    fmt = st.selectbox("形式", list(EXPORT_FORMATS), format_func=lambda x: EXPORT_FORMATS[x]['label'], key="export_format")
+    key = f"{content_hash(content)}:{fmt}"
+    if st.session_state.export_ready != key:
+        st.button(f"🎞️ {EXPORT_FORMATS[fmt]['label']}を用意", on_click=prepare_export, args=(key,), use_container_width=True, key="prepare_export_button")
+        return
+    st.download_button(label=f"📥 {EXPORT_FORMATS[fmt]['label']}ダウンロード", data=download_buffer(export_text(content, fmt)),
+                       file_name=f"generated_content_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[fmt]['ext']}", mime=EXPORT_FORMATS[fmt]['mime'], use_container_width=True)
+
+# ===============================================================================
+# YouTube台本の一括生成
+# ===============================================================================
+def run_batch_generation(model, rows: list, default_type: str, export_formats: tuple = ()):
+    """CSV/JSONLの全行を1件のジョブとして一括の優先度で投入する（予算は全行の見積もりの合計で確認。結果はrender_job_panelで受け取り、再読み込み後も再接続できる）"""
+    bible = with_bible({}).get('bible', '')
+    jobs = []
+    for row in rows:
+        try:
+            jobs.append(build_batch_params(row, default_type, bible))
+        except ValueError:
+            continue
+    estimates = [estimate_request(route_model(model, VIDEO_PROMPT_FUNCS[job['type']], job['params']), VIDEO_PROMPT_FUNCS[job['type']], job['params']) for job in jobs]
+    total = add_usage(*estimates)
+    if jobs:
+        reason = check_budget(total, st.session_state.session_cost, get_usage_ledger().today()['cost'], dict(budget_limits(), request_tokens=0))
+        if reason:
+            st.error(f"🚫 予算を超えるため一括生成を中止しました: {reason}")
+            return
+    cache = get_response_cache() if cache_enabled() else None
+    context = job_context()
+    if routing_enabled():
+        model = get_router(st.session_state.api_key)
+    model = instrument(model, 'YouTube一括', '一括生成')
+
+    def run(job):
+        # 流量は投入時に全行分をキューで確保しているので、行ごとのレート制限はかけない
+        note_queue_wait(model, job)
+        def show_status(results):
+            job.update(progress=(sum(1 for item in results if item['status'] in ('完了', 'エラー')), len(results)))
+        results = run_batch(model, rows, default_type, requests_per_minute=0, cache=cache, on_update=show_status, bible=bible, cancelled=job.cancelled)
+        usage = add_usage(*results)
+        if usage['tokens']:
+            context['ledger'].add(usage)
+        finished = [item for item in results if item['status'] == '完了']
+        hits = sum(1 for item in finished if item['cache_hit'])
+        return {**usage, 'cache_hits': hits, 'cache_misses': len(finished) - hits, 'batch': results, 'export_formats': list(export_formats)}
+
+    st.session_state.batch_result = None
+    submit_estimated_job(run, f"一括生成（{len(rows)}件）", total, max(1, len(jobs)), BATCH)
+
+# ===============================================================================
+# パイプライン（テーマ → プロット → 台本 → 校正 → 二次チェック）
+# ===============================================================================
+@st.cache_resource
+def get_pipeline_store() -> PipelineStore:
+    """プロセス全体で共有するパイプラインの段階ごとの保存先を取得"""
+    return PipelineStore(PIPELINE_PATH)
+
+def show_pipeline_stage(text: str):
+    """パイプラインの段階の結果を生成結果エリアに表示する（ボタンのコールバック）"""
+    st.session_state.generated_content = text
+
+def run_pipeline_generation(model, config: dict, resume: bool = True):
+    """テーマから二次チェックまでを1件のジョブとして投入する（予算は段階ごとの見積もりの合計で確認。結果はrender_job_panelで受け取り、再読み込み後も再接続できる）"""
+    total = add_usage(*[estimate_request(route_model(model, stage['prompt_func'], params), stage['prompt_func'], params)
+                        for stage, params in pipeline_stage_params(config)])
+    reason = check_budget(total, st.session_state.session_cost, get_usage_ledger().today()['cost'], dict(budget_limits(), request_tokens=0))
+    if reason:
+        st.error(f"🚫 予算を超えるためパイプラインを中止しました: {reason}")
+        return
+    cache = get_response_cache() if cache_enabled() else None
+    store = get_pipeline_store()
+    context = job_context()
+    if routing_enabled():
+        model = get_router(st.session_state.api_key)
+    model = instrument(model, 'パイプライン', 'パイプライン')
 
-【出力形式】
-1. **総評**: 全体を読んだ上での良い点と、最も改善が必要な点を簡潔に述べてください。
-2. **具体的な問題点の指摘と改善案**:
-   - (問題箇所1の引用) → (問題点の指摘) → (具体的な改善案やリライト例)
-   - (問題箇所2の引用) → (問題点の指摘) → (具体的な改善案やリライト例)
-   - (以下、問題点を複数挙げる)
-3. **総合的な改善後のプロット/文章の提案**: 可能であれば、指摘事項を反映した改善後の全体の流れや、新しいシーンのアイデアなどを提案してください。
+    def run(job):
+        note_queue_wait(model, job)
+        def show_status(entries):
+            job.update(progress=(sum(1 for e in entries if e['status'] not in ('待機中', '実行中')), len(entries)))
+        outcome = run_pipeline(model, config, store, cache, resume=resume, on_update=show_status, cancelled=job.cancelled)
+        completed = [e for e in outcome['stages'] if e['status'] == '完了']
+        usage = add_usage(*completed)
+        if usage['tokens']:
+            context['ledger'].add(usage)
+        for e in completed:
+            context['store'].add(context['session_id'], e['label'], e['display'])
+        script = next((e for e in outcome['stages'] if e['name'] == 'proofread' and e['status'] in FINISHED_STATUSES), None)
+        return {**usage, 'cache_hits': sum(e['cache_hits'] for e in completed), 'cache_misses': sum(e['cache_misses'] for e in completed),
+                'pipeline': outcome, 'text': script['text'] if script else ''}
 
-あなたの厳しい視点と的確なアドバイスで、この作品を一段上のレベルに引き上げてください。"""
-    return prompt
+    st.session_state.pipeline_result = None
+    submit_estimated_job(run, "パイプライン", total, sum(stage_calls(stage, config, {}) for stage in build_pipeline(config)), BATCH)
 
 # ===============================================================================
 # メインアプリケーション
@@ -362,22 +898,69 @@ def main():
             st.session_state.api_key = api_key; st.session_state.model = None
         if api_key and not st.session_state.model:
             with st.spinner("API接続中..."): st.session_state.model = setup_gemini_api(api_key)
+        if os.environ.get(BACKEND_ENV) == 'mock': st.info("🧪 モックバックエンドで動作中（APIは呼ばれません。APIキーには任意の文字列を入力できます）")
         if st.session_state.model: st.success("✅ API接続成功")
         elif api_key: st.error("❌ API接続失敗")
         else: st.warning("APIキーを入力してください")
         st.markdown("---")
         st.subheader("🎯 生成モード")
         generation_mode = st.selectbox("モード選択", ['full-auto', 'semi-self', 'self'], format_func=lambda x: {'full-auto': '🤖 フルオート', 'semi-self': '🤝 セミセルフ（AI）', 'self': '✋ セルフ'}[x])
-        if st.session_state.generation_history:
+        st.checkbox("⚡ ストリーミング表示", value=True, key="use_streaming", help="生成中の文章を受信した順に表示します（途中で中止できます）")
+        with st.expander("💰 予算設定"):
+            st.number_input("1回あたりの上限トークン（0で無制限）", min_value=0, value=0, step=10_000, key="budget_request_tokens")
+            st.number_input("このセッションの予算 USD（0で無制限）", min_value=0.0, value=0.0, step=0.1, format="%.4f", key="budget_session_cost")
+            st.number_input("1日の予算 USD・全セッション合計（0で無制限）", min_value=0.0, value=0.0, step=0.5, format="%.4f", key="budget_day_cost")
+            st.radio("予算を超える場合", ['block', 'downgrade'], format_func=lambda x: {'block': '🚫 生成しない', 'downgrade': f'⬇️ 低価格モデル（{DOWNGRADE_MODEL_NAME}）に切り替える'}[x], key="budget_policy")
+            st.checkbox("APIでトークン数を正確に数える（count_tokens）", value=False, key="use_count_tokens_api", help="オフの場合は文字数からの概算です。結果はプロンプトごとにキャッシュされます。")
+            today = get_usage_ledger().today()
+            st.caption(f"本日の使用量: {today['tokens']:,} トークン・約${today['cost']:.4f}")
+        st.checkbox("🗃️ レスポンスキャッシュを使用", value=True, key="use_response_cache", help="同じプロンプト・モデルの結果を再利用します。オフにすると常に新しく生成します（🔄 再生成は常にキャッシュを使わず新しく生成します）")
+        context_stats = get_context_cache().stats()
+        if context_stats['created']:
+            st.caption(f"🧠 コンテキストキャッシュ: 登録 {context_stats['created']:,}件・再利用 {context_stats['hits']:,}回（固定部分 約{context_stats['reused_tokens']:,}トークン）")
+        queue_stats = get_job_queue().stats()
+        if queue_stats['running'] or any(queue_stats['waiting'].values()):
+            st.caption(f"🚦 共有キュー: 実行中 {queue_stats['running']}件・待機中 " + "・".join(f"{label} {count}件" for label, count in queue_stats['waiting'].items()))
+        st.checkbox("🔀 モデル自動振り分け", value=True, key="use_model_routing", help="短いタスクは軽量モデル、長編は上位モデルに振り分け、429・5xxエラー時は別のモデルに切り替えます")
+        if routing_enabled():
+            with st.expander("📊 モデル別の実績（7日間）"):
+                summary = get_call_log().summary()
+                if summary:
+                    st.table([{'タスク': TASK_LABELS.get(s['task'], s['task']), 'モデル': s['model'], '回数': s['calls'], '失敗': s['failures'],
+                               '平均秒': s['avg_latency_sec'], '平均入力': s['avg_input_tokens'], '平均出力': s['avg_output_tokens']} for s in summary])
+                else:
+                    st.caption("まだ呼び出し実績がありません")
+                opened = {name: state for name, state in get_router(st.session_state.api_key).breaker_states().items() if state != 'closed'}
+                if opened:
+                    st.warning("一時停止中のモデル: " + "、".join(f"{name}（{state}）" for name, state in opened.items()))
+        st.subheader("📚 設定資料")
+        bibles = {item['id']: item['name'] for item in get_bible_store().list()}
+        if st.session_state.get('active_bible_id') not in bibles:
+            st.session_state.active_bible_id = ''
+        st.selectbox("使用する設定資料", [''] + list(bibles), format_func=lambda x: bibles.get(x, '（使用しない）'), key="active_bible_id",
+                     help="登場人物・主人公・世界観・起承転結・プロットを保存したシリーズの設定資料です。選ぶと各タブのプロンプトに要約だけを差し込みます。作成・編集は「bible」ページで行います。")
+        if st.session_state.active_bible_id:
+            st.number_input("要約の上限トークン", min_value=100, max_value=4000, value=BIBLE_SUMMARY_TOKENS, step=100, key="bible_budget_tokens")
+            summary = active_bible_summary()
+            st.caption(f"要約 約{summary['tokens']:,}トークン" + (f"（上限を超える{summary['omitted_lines']}行を省略）" if summary['omitted_lines'] else ""))
+            if st.checkbox("要約を表示", key="show_bible_summary"):
+                st.text(summary['text'] or "（設定資料が空です）")
+        history = get_history_store()
+        recent_items = history.recent(st.session_state.history_session_id, limit=5)
+        if recent_items:
             st.subheader("📜 生成履歴")
-            for item in reversed(st.session_state.generation_history[-5:]):
-                with st.expander(f"{item['timestamp']} - {item['type']}"): st.text(item['content'][:200] + "...")
+            history_query = st.text_input("🔎 履歴を検索", placeholder="本文のキーワード（全セッション）", key="history_query")
+            if history_query.strip():
+                render_history_items(history.search(history_query), "history_search")
+            else:
+                render_history_items(recent_items, "history_recent")
 
     if not st.session_state.model:
+        render_job_panel()
         st.error("🚫 サイドバーでAPIキーを設定してください")
         return
 
-    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["💡 テーマ生成", "📝 プロット作成", "🎭 台本作成", "🔍 誤字脱字検出", "📺 YouTube動画台本", "🎨 ネーム作成", "✍️ 推敲・二次チェック"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs(["💡 テーマ生成", "📝 プロット作成", "🎭 台本作成", "🔍 誤字脱字検出", "📺 YouTube動画台本", "🎨 ネーム作成", "✍️ 推敲・二次チェック", "🔗 パイプライン"])
 
     with tab1:
         st.header("💡 テーマ生成＆アイデア出し")
@@ -397,16 +980,17 @@ def main():
             keyword_input = st.text_input("アイデアを広げたいキーワードを入力してください", placeholder="例：タイムマシン、最後の夏休み、AIとの共存", key="theme_keyword_input")
             selected_genre = ""
             
+        params = with_bible({
+            'generation_type': 'genre' if generation_type == "ジャンルからアイデアを得る" else 'keyword',
+            'genre': selected_genre,
+            'keyword': keyword_input,
+            'num_ideas': num_ideas
+        })
+        render_preflight(st.session_state.model, create_theme_generation_prompt, params)
         if st.button("💡 アイデアを生成する", type="primary", use_container_width=True, key="theme_gen_button"):
             if generation_type == "キーワードから発想を広げる" and not keyword_input.strip():
                 st.error("キーワードを入力してください。")
             else:
-                params = {
-                    'generation_type': 'genre' if generation_type == "ジャンルからアイデアを得る" else 'keyword',
-                    'genre': selected_genre,
-                    'keyword': keyword_input,
-                    'num_ideas': num_ideas
-                }
                 if generate_content(st.session_state.model, create_theme_generation_prompt, params, "テーマ案"):
                     st.success(f"✅ テーマ案を{num_ideas}個生成しました！"); st.rerun()
 
@@ -424,22 +1008,22 @@ def main():
             worldview = st.text_area("世界観・設定", placeholder="時代、場所、社会情勢、特殊な設定など...", height=100, key="worldview_input_plot")
         st.subheader("既存プロット取り込み（オプション）")
         existing_plot = st.text_area("既存プロット", placeholder="既存のプロットを貼り付けて改良・発展させることができます...", height=150, key="existing_plot_plot")
+        params = with_bible({'genre': selected_genre, 'title': title, 'protagonist': protagonist, 'worldview': worldview, 'existing_plot': existing_plot, 'mode': generation_mode})
+        render_preflight(st.session_state.model, create_plot_prompt, params)
         if st.button("🎬 プロット生成", type="primary", use_container_width=True, key="plot_gen_button"):
-            params = {'genre': selected_genre, 'title': title, 'protagonist': protagonist, 'worldview': worldview, 'existing_plot': existing_plot, 'mode': generation_mode}
             if generate_content(st.session_state.model, create_plot_prompt, params, "プロット"):
                 st.success("✅ プロット生成完了！"); st.rerun()
 
     with tab3:
         st.header("🎭 台本作成")
-        plot_from_history = ""
-        plot_items = [item for item in st.session_state.generation_history if item['type'] == 'プロット']
-        if plot_items: plot_from_history = plot_items[-1]['content']
+        plot_from_history = get_history_store().latest_content('プロット', st.session_state.history_session_id) or ""
         plot_input = st.text_area("プロット入力", value=plot_from_history, placeholder="台本化したいプロットを入力してください...", height=250, key="plot_input_for_script")
         script_format = st.selectbox("台本形式", ['standard', 'screenplay', 'radio', 'youtube', '2ch-thread', 'manga-name'], format_func=lambda x: {'standard': '標準台本', 'screenplay': '映画脚本', 'radio': 'ラジオドラマ', 'youtube': 'YouTube動画', '2ch-thread': '2ch風スレッド', 'manga-name': 'マンガネーム'}[x], key="script_format_select")
+        params = with_bible({'plot': plot_input, 'format': script_format, 'mode': generation_mode})
+        if plot_input.strip(): render_preflight(st.session_state.model, create_script_prompt, params)
         if st.button("🎭 台本生成", type="primary", use_container_width=True, key="script_gen_button"):
             if not plot_input.strip(): st.error("プロットを入力してください")
             else:
-                params = {'plot': plot_input, 'format': script_format, 'mode': generation_mode}
                 if generate_content(st.session_state.model, create_script_prompt, params, "台本"):
                     st.success("✅ 台本生成完了！"); st.rerun()
 
@@ -447,11 +1031,23 @@ def main():
         st.header("🔍 AI誤字脱字検出")
         text_to_check = st.text_area("チェック対象テキスト", placeholder="誤字脱字をチェックしたいテキストを入力してください...", height=250, key="text_to_check_input")
         check_level = st.selectbox("チェックレベル", ['basic', 'advanced', 'professional'], format_func=lambda x: {'basic': '基本チェック', 'advanced': '高度チェック', 'professional': 'プロフェッショナル'}[x], key="check_level_select")
+        local_findings = run_precheck(text_to_check) if text_to_check.strip() else []
+        if text_to_check.strip():
+            st.caption(f"⚡ ローカルチェック: {len(local_findings)}件の指摘（助詞の重複・括弧の対応・全角半角の混在・重複行・文体の混在）")
+        use_precheck = False
+        if check_level == 'basic':
+            use_precheck = st.checkbox("⚡ ローカルチェックの指摘箇所だけをAIに送る", value=True, key="use_precheck_proofread", help="基本チェックでは、ローカルチェックで見つかった箇所とその前後だけをAIで確認します。指摘がなければAIを呼ばずに完了します。")
+        use_chunked = st.checkbox("🧩 長文を分割して並列チェック", value=len(text_to_check) > CHUNK_SIZE, key="use_chunked_proofread", help=f"段落・文の区切りで約{CHUNK_SIZE:,}文字ずつに分割し、同時にチェックしてから結合します。修正箇所一覧には原文での文字位置が付きます。")
+        params = with_bible({'text': text_to_check, 'level': check_level})
+        use_recheck = render_recheck_option('校正', create_error_check_prompt, params)
+        if text_to_check.strip() and not use_recheck and not (use_precheck and not local_findings):
+            chunked = use_chunked and not use_precheck
+            render_preflight(st.session_state.model, create_error_check_prompt, params, calls=len(split_into_chunks(text_to_check)) if chunked else 1, output_calls=1 if chunked else None)
         if st.button("🔍 誤字脱字チェック実行", type="primary", use_container_width=True, key="proofread_button"):
             if not text_to_check.strip(): st.error("チェックするテキストを入力してください")
             else:
-                params = {'text': text_to_check, 'level': check_level}
-                if generate_content(st.session_state.model, create_error_check_prompt, params, "校正"):
+                generator = generate_recheck if use_recheck else generate_prechecked_proofread if use_precheck else generate_chunked_proofread if use_chunked else generate_content
+                if generator(st.session_state.model, create_error_check_prompt, params, "校正"):
                     st.success("✅ チェック完了！"); st.rerun()
     
     with tab5:
@@ -473,6 +1069,9 @@ def main():
         with col2:
             length_options = {'super_short': '超ショート(~5分)', 'short': 'ショート(5-8分)', 'standard': '標準(10-15分)', 'long': '長編(15-20分)', 'super_long': '超長編(20分以上)'}
             selected_length = st.selectbox("動画の長さ", options=list(length_options.keys()), format_func=lambda x: length_options[x], key=f"{video_type}_length")
+            use_chaptered = False
+            if selected_length in ['long', 'super_long']:
+                use_chaptered = st.checkbox("📚 章別並列生成", value=True, key="use_chaptered_generation", help="アウトラインを作成してから5つの章を同時に生成し、結合します。長編でも文字数が途切れにくくなります。")
 
         video_theme = st.text_input("動画テーマ", placeholder=f"{video_type}のテーマを入力", key=f"{video_type}_theme")
         pov_character = st.selectbox("視点・語り手を選択してください",["第三者ナレーター", "主人公", "悪役・敵役", "その他の登場人物"],key="pov_select",help="物語を誰の視点で語るかを選択します。")
@@ -497,33 +1096,61 @@ def main():
             selected_end = st.selectbox("物語の結末（結）", options=list(end_options.keys()), format_func=lambda x: end_options[x], key="end_select")
             custom_end = st.text_area("（または、結末を自由記述）", key="end_custom", height=100)
         
+        params = with_bible({
+            'theme': video_theme, 'style': selected_style, 'length': selected_length, 
+            'pov_character': pov_character, 'mode': generation_mode,
+            'use_advanced_settings': use_advanced,
+            'protagonist_setting': protagonist_setting,
+            'story_start': custom_start if custom_start.strip() else start_options[selected_start],
+            'story_development': custom_dev if custom_dev.strip() else dev_options[selected_dev],
+            'story_turn': custom_turn if custom_turn.strip() else turn_options[selected_turn],
+            'story_ending': custom_end if custom_end.strip() else end_options[selected_end],
+        })
+        if video_theme.strip(): render_preflight(st.session_state.model, base_prompt_func, params, calls=6 if use_chaptered else 1, output_calls=CHAPTERED_OUTPUT_CALLS if use_chaptered else 1)
         if st.button(f"🚀 {video_type} 台本生成", type="primary", use_container_width=True, key=f"{video_type}_gen"):
             if not video_theme.strip(): st.error("動画テーマを入力してください")
             else:
-                params = {
-                    'theme': video_theme, 'style': selected_style, 'length': selected_length, 
-                    'pov_character': pov_character, 'mode': generation_mode,
-                    'use_advanced_settings': use_advanced,
-                    'protagonist_setting': protagonist_setting,
-                    'story_start': custom_start if custom_start.strip() else start_options[selected_start],
-                    'story_development': custom_dev if custom_dev.strip() else dev_options[selected_dev],
-                    'story_turn': custom_turn if custom_turn.strip() else turn_options[selected_turn],
-                    'story_ending': custom_end if custom_end.strip() else end_options[selected_end],
-                }
-                if generate_content(st.session_state.model, base_prompt_func, params, f"{video_type}台本"):
+                generator = generate_chaptered_content if use_chaptered else generate_content
+                if generator(st.session_state.model, base_prompt_func, params, f"{video_type}台本"):
                     st.success(f"✅ {video_type}台本 生成完了！"); st.rerun()
 
+        with st.expander("📦 一括生成（CSV/JSONL）"):
+            st.caption("列: theme（必須）, type（sukatto / 2ch / kaigai、省略時は上で選択中の種類）, style（省略時は種類ごとの先頭のスタイル）, length, pov_character, 骨子（protagonist_setting, story_start, story_development, story_turn, story_ending）")
+            batch_file = st.file_uploader("テーマ一覧ファイル", type=['csv', 'jsonl'], key="batch_upload")
+            batch_exports = st.multiselect("字幕・TTS用のファイルも含める", options=list(EXPORT_FORMATS), format_func=lambda x: EXPORT_FORMATS[x]['label'], key="batch_export_formats",
+                                           help="台本ごとに、話者ごとの行に分けた字幕（推定タイミング付き）・TTS用JSONLなどをzipに追加します")
+            st.caption("同時実行数と1分あたりのリクエスト数・トークン数は、全セッション共有のキューで制限されます（対話の生成が優先されます）")
+            if st.button("📦 一括生成を開始", use_container_width=True, key="batch_gen_button"):
+                if batch_file is None: st.error("CSVまたはJSONLファイルをアップロードしてください")
+                else:
+                    try:
+                        rows = parse_batch_rows(batch_file.getvalue(), batch_file.name)
+                    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                        rows = []; st.error(f"ファイル読み込みエラー: {str(e)}")
+                    if rows:
+                        default_type = VIDEO_TYPE_ALIASES[video_type]
+                        run_batch_generation(st.session_state.model, rows, default_type, tuple(batch_exports))
+            if st.session_state.batch_result:
+                manifest = st.session_state.batch_result['manifest']
+                done = sum(1 for item in manifest if item['status'] == '完了')
+                st.success(f"✅ {done}/{len(manifest)}件の台本を生成しました（合計 {sum(item['tokens'] for item in manifest):,} トークン）")
+                st.download_button(label="💾 一括生成結果(zip)ダウンロード", data=st.session_state.batch_result['zip'], file_name=f"batch_scripts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip", mime="application/zip", use_container_width=True, key="batch_download")
+
     with tab6:
         st.header("🎨 マンガ・アニメネーム作成")
         story_summary = st.text_area("ストーリー概要", placeholder="ネーム化したいストーリーの概要（プロットやあらすじ）を入力...", height=200, key="story_summary_input")
         col1, col2 = st.columns(2)
         with col1: page_count = st.number_input("ページ数", min_value=1, max_value=200, value=20, key="page_count_input")
         with col2: name_format = st.selectbox("ネーム形式", ['manga', '4koma', 'storyboard', 'webtoon'], format_func=lambda x: {'manga': '📚 マンガネーム', '4koma': '📄 4コマネーム', 'storyboard': '🎬 アニメ絵コンテ', 'webtoon': '📱 ウェブトゥーン'}[x], key="name_format_select")
+        use_sharded = st.checkbox("📑 ページ分割並列生成", value=page_count > SHARDED_NAME_MIN_PAGES, key="use_sharded_name",
+                                  help=f"ページごとのビートシートを作成してから、{PAGES_PER_SHARD}ページずつ同時に生成して結合します。コマには通し番号が付き、ページごとのデータ（JSON）もダウンロードできます。長いネームでも途中で切れにくくなります。")
+        params = with_bible({'story': story_summary, 'pages': page_count, 'format': name_format, 'mode': generation_mode})
+        if story_summary.strip(): render_preflight(st.session_state.model, create_name_prompt, params, calls=1 + len(page_ranges(page_count)) if use_sharded else 1, output_calls=1)
         if st.button("🎨 ネーム生成", type="primary", use_container_width=True, key="name_gen_button"):
             if not story_summary.strip(): st.error("ストーリー概要を入力してください")
             else:
-                params = {'story': story_summary, 'pages': page_count, 'format': name_format, 'mode': generation_mode}
-                if generate_content(st.session_state.model, create_name_prompt, params, "ネーム"):
+                generator = generate_sharded_name if use_sharded else generate_content
+                if generator(st.session_state.model, create_name_prompt, params, "ネーム"):
                     st.success("✅ ネーム生成完了！"); st.rerun()
 
     with tab7:
@@ -532,53 +1159,144 @@ def main():
         text_to_check_secondary = st.text_area("チェックしたい文章をここに貼り付けてください", height=300, key="secondary_check_input")
         check_type = st.selectbox(
             "どの視点でチェックしますか？",
-            options=['plot_holes', 'character_consistency', 'dialogue_polish', 'pacing_improvement'],
-            format_func=lambda x: {'plot_holes': 'プロットの穴・矛盾チェック','character_consistency': 'キャラクターの一貫性チェック','dialogue_polish': 'セリフの洗練','pacing_improvement': '物語のテンポ改善'}[x],
+            options=list(SECONDARY_CHECK_LABELS),
+            format_func=lambda x: SECONDARY_CHECK_LABELS[x],
             key="secondary_check_type"
         )
+        params = with_bible({'text_to_check': text_to_check_secondary, 'check_type': check_type})
+        use_recheck_secondary = render_recheck_option('二次チェック', create_secondary_check_prompt, params)
+        if text_to_check_secondary.strip() and not use_recheck_secondary: render_preflight(st.session_state.model, create_secondary_check_prompt, params)
         if st.button("📝 二次チェックを実行", type="primary", use_container_width=True, key="secondary_check_button"):
             if not text_to_check_secondary.strip(): st.error("チェックする文章を入力してください。")
             else:
-                params = {'text_to_check': text_to_check_secondary, 'check_type': check_type}
-                if generate_content(st.session_state.model, create_secondary_check_prompt, params, "二次チェック結果"):
+                generator = generate_recheck if use_recheck_secondary else generate_content
+                if generator(st.session_state.model, create_secondary_check_prompt, params, "二次チェック結果"):
                     st.success("✅ 二次チェック完了！"); st.rerun()
 
+    with tab8:
+        st.header("🔗 パイプライン（テーマ → プロット → 台本 → 校正 → 二次チェック）")
+        st.info("テーマからプロット・台本・校正・二次チェックまでを自動で実行します。二次チェックの各観点は同時に実行され、途中で失敗しても同じ設定で再実行すれば完了済みの段階は再利用されます。")
+        theme_source = st.radio("テーマの決め方", ['input', 'idea'], format_func=lambda x: {'input': '✏️ テーマを入力する', 'idea': '💡 AIのテーマ案から選ぶ'}[x], horizontal=True, key="pipeline_theme_source")
+        col1, col2 = st.columns(2)
+        with col1:
+            pipeline_genre = st.selectbox("ジャンル", ['ドラマ', 'コメディ', 'ホラー', 'SF', 'ファンタジー', 'ミステリー', '恋愛', '日常系', 'スカッと系', '2ch系', '海外の反応'], key="pipeline_genre")
+            if theme_source == 'input':
+                pipeline_theme = st.text_input("テーマ", placeholder="例：義母に家を乗っ取られかけた話", key="pipeline_theme")
+            else:
+                pipeline_num_ideas = st.slider("テーマ案の数", min_value=3, max_value=10, value=5, key="pipeline_num_ideas")
+                pipeline_idea = st.number_input("使用するテーマ案の番号", min_value=1, max_value=pipeline_num_ideas, value=1, key="pipeline_idea_index")
+            pipeline_protagonist = st.text_input("主人公設定（任意）", key="pipeline_protagonist")
+            pipeline_worldview = st.text_input("世界観・設定（任意）", key="pipeline_worldview")
+        with col2:
+            pipeline_format = st.selectbox("台本形式", ['standard', 'screenplay', 'radio', 'youtube', '2ch-thread'], format_func=lambda x: {'standard': '標準台本', 'screenplay': '映画脚本', 'radio': 'ラジオドラマ', 'youtube': 'YouTube動画', '2ch-thread': '2ch風スレッド'}[x], key="pipeline_format")
+            pipeline_level = st.selectbox("校正レベル", ['basic', 'advanced', 'professional'], format_func=lambda x: {'basic': '基本チェック', 'advanced': '高度チェック', 'professional': 'プロフェッショナル'}[x], key="pipeline_level")
+            pipeline_checks = st.multiselect("二次チェックの観点", options=list(SECONDARY_CHECK_LABELS), default=list(SECONDARY_CHECK_LABELS), format_func=lambda x: SECONDARY_CHECK_LABELS[x], key="pipeline_checks")
+            pipeline_resume = st.checkbox("完了済みの段階を再利用する", value=True, key="pipeline_resume", help="オフにすると保存済みの段階を破棄して最初から実行します")
+        config = {'genre': pipeline_genre, 'protagonist': pipeline_protagonist, 'worldview': pipeline_worldview, 'format': pipeline_format,
+                  'level': pipeline_level, 'check_types': pipeline_checks, 'mode': generation_mode}
+        bible = with_bible({}).get('bible')
+        if bible:
+            config['bible'] = bible
+        if theme_source == 'input':
+            config['theme'] = pipeline_theme.strip()
+        else:
+            config.update(num_ideas=pipeline_num_ideas, idea_index=int(pipeline_idea) - 1)
+        if st.button("🔗 パイプラインを実行", type="primary", use_container_width=True, key="pipeline_run_button"):
+            if theme_source == 'input' and not config['theme']: st.error("テーマを入力してください")
+            else:
+                run_pipeline_generation(st.session_state.model, config, pipeline_resume)
+        if st.session_state.pipeline_result:
+            stages = st.session_state.pipeline_result['stages']
+            done = sum(1 for e in stages if e['status'] in FINISHED_STATUSES)
+            (st.success if done == len(stages) else st.warning)(f"{done}/{len(stages)}段階が完了しました（失敗した段階は同じ設定で再実行すると続きから実行します）")
+            for e in stages:
+                with st.expander(f"{e['label']} - {e['status']}"):
+                    if e['display']:
+                        st.text(e['display'])
+                        st.button("📄 結果エリアに表示", key=f"pipeline_show_{e['name']}", on_click=show_pipeline_stage, args=(e['display'],))
+                    elif e['error']:
+                        st.error(e['error'])
+
+    # --- バックグラウンドのジョブ（実行中の進捗・完了した結果の受け取り） ---
+    render_job_panel()
+
     # --- 生成結果の表示エリア ---
     if st.session_state.generated_content:
         st.markdown("---")
         st.header("📄 生成結果")
+        if st.session_state.stream_cancelled:
+            st.warning("⏹️ 生成を中止しました。途中までの結果を表示しています。")
         
         b_col1, b_col2, _ = st.columns([1, 1, 5])
         if b_col1.button("🔄 再生成", help="同じ条件で再生成"):
             if st.session_state.last_generation_params:
                 params = st.session_state.last_generation_params
-                if generate_content(st.session_state.model, params['prompt_func'], params['params'], params['content_type']):
+                generator = params.get('generator', generate_content)
+                if generator(st.session_state.model, params['prompt_func'], params['params'], params['content_type'], use_cache=False):
                     st.success("✅ 再生成完了！"); st.rerun()
+                elif st.session_state.active_job_id:
+                    st.rerun()
             else:
                 st.warning("再生成するパラメータが見つかりません")
         if b_col2.button("🗑️ クリア", help="生成結果をクリア"):
-            st.session_state.generated_content = ""; st.rerun()
+            st.session_state.generated_content = ""; st.session_state.best_of_n = st.session_state.name_pages = None; st.rerun()
+        last = st.session_state.last_generation_params
+        if last and 'generator' not in last:
+            with st.expander("🎲 複数案を同時に生成して比較（best-of-N）"):
+                st.caption("同じ条件で温度を変えた候補を並列に生成し、長さ・構成・話者形式の簡易評価（と任意でAIの審査）で順位を付けます。所要時間は1回分とほぼ同じで、料金は候補の数だけかかります。")
+                n_col1, n_col2 = st.columns(2)
+                sample_count = n_col1.number_input("候補の数", min_value=2, max_value=6, value=3, key="best_of_n_count")
+                use_judge = n_col2.checkbox("AIで審査する（+1回）", value=False, key="best_of_n_judge")
+                if st.button("🎲 候補を生成", use_container_width=True, key="best_of_n_button"):
+                    generate_best_of_n(st.session_state.model, last['prompt_func'], last['params'], last['content_type'], int(sample_count), use_judge)
+                    if st.session_state.active_job_id:
+                        st.rerun()
+        if st.session_state.best_of_n:
+            render_best_of_n(st.session_state.best_of_n)
+        if last.get('content_type') == 'プロット' and st.session_state.active_bible_id:
+            st.button("📚 このプロットを設定資料に取り込む", key="save_plot_to_bible", on_click=save_plot_to_bible, args=(st.session_state.generated_content,),
+                      help="選択中の設定資料のプロットを置き換え、新しい登場人物を追加します。以降の台本・ネーム・チェックにはその要約が差し込まれます。")
+            if st.session_state.bible_saved:
+                st.success("✅ 設定資料に取り込みました"); st.session_state.bible_saved = False
         
         st.info("💡 以下のボックス内をクリックし、Ctrl+A (全選択) -> Ctrl+C (コピー) で内容をコピーできます。")
-        st.text_area(label="生成された内容", value=st.session_state.generated_content, height=500, key="generated_content_display")
+        render_result_text(st.session_state.generated_content)
         
         content = st.session_state.generated_content
         st.subheader("📊 統計情報 & トークン使用量")
         
-        col1, col2, col3 = st.columns(3)
-        col1.metric("文字数", f"{len(content):,}")
-        col2.metric("行数", f"{content.count('n') + 1:,}")
-        col3.metric("段落数", f"{len([p for p in content.split('nn') if p.strip()]):,}")
+        stats = text_stats(content)
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("文字数", f"{stats['chars']:,}")
+        col2.metric("行数", f"{stats['lines']:,}")
+        col3.metric("段落数", f"{stats['paragraphs']:,}")
+        col4.metric("ナレーション目安", format_duration(stats['narration_seconds']), help=f"読み上げる文字 {stats['spoken_chars']:,} 字を1分{NARRATION_CHARS_PER_MINUTE}字で換算")
+        s_col1, s_col2, s_col3, s_col4 = st.columns(4)
+        s_col1.metric("セリフ率", f"{stats['dialogue_ratio']:.0%}", help=f"セリフ {stats['dialogue_chars']:,} 字 / ト書き {stats['direction_chars']:,} 字")
+        s_col2.metric("話者数", f"{len(stats['speakers']):,}")
+        s_col3.metric("漢字率", f"{stats['kanji_ratio']:.0%}")
+        s_col4.metric("ルビ", f"{stats['ruby_count']:,}")
+        if stats['speakers']:
+            with st.expander("🗣️ 話者ごとの行数"):
+                st.table([{'話者': name, '行数': count} for name, count in stats['speakers'].items()])
 
-        t_col1, t_col2 = st.columns(2)
+        t_col1, t_col2, t_col3 = st.columns(3)
         t_col1.metric("今回の使用トークン", f"{st.session_state.last_token_count:,}")
-        t_col2.metric("このセッションの累計トークン", f"{st.session_state.session_token_count:,}")
+        t_col2.metric("このセッションの累計トークン", f"{st.session_state.session_token_count:,}", help=f"入力 {st.session_state.session_input_tokens:,} / 出力 {st.session_state.session_output_tokens:,}")
+        t_col3.metric("キャッシュ ヒット / ミス", f"{st.session_state.cache_hits:,} / {st.session_state.cache_misses:,}")
         
-        price_per_million_tokens_input = 0.525
-        session_cost = (st.session_state.session_token_count / 1_000_000) * price_per_million_tokens_input
-        st.info(f"💰 このセッションの概算料金: 約 ${session_cost:.6f} (USD)\n\n※この料金は概算です。正確な料金はGoogle Cloudの請求をご確認ください。")
+        st.info(f"💰 このセッションの概算料金: 約 ${st.session_state.session_cost:.6f} (USD・モデル別の入力/出力単価で計算)\n\n※この料金は概算です。正確な料金はGoogle Cloudの請求をご確認ください。")
         
-        st.download_button(label="💾 テキストファイルダウンロード", data=content.encode('utf-8'), file_name=f"generated_content_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt", mime="text/plain", use_container_width=True)
+        render_download(content)
+        with st.expander("🎞️ 字幕・TTS用に書き出す（SRT / VTT / JSONL / CSV）"):
+            st.caption(f"台本を話者ごとの行（語り手・スレ主・住民・【テロップ】など）に分け、1分{NARRATION_CHARS_PER_MINUTE}字の読み上げ速度で推定したタイミングを付けて書き出します。")
+            render_export(content)
+        if st.session_state.name_pages:
+            st.download_button(label="📥 ページごとのネーム（JSON）", data=json.dumps(st.session_state.name_pages, ensure_ascii=False, indent=2).encode('utf-8'),
+                               file_name=f"name_pages_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json", mime="application/json", use_container_width=True)
+            with st.expander(f"🎨 コマ一覧（{len(st.session_state.name_pages)}ページ）"):
+                st.dataframe([{'ページ': record['page'], 'コマ': panel['number'], **{label: panel[key] for key, label in PANEL_FIELDS.items()}}
+                              for record in st.session_state.name_pages for panel in record['panels']], use_container_width=True)
         
         with st.expander("⭐ 生成結果の評価"):
             with st.form(key="feedback_form"):
@@ -0,0 +1,75 @@
+import streamlit as st
+
+from story2ch.bible import BIBLE_PATH, BIBLE_SUMMARY_TOKENS, OUTLINE_LABELS, BibleStore
+
+# ===============================================================================
+# 設定資料（シリーズの登場人物・主人公・世界観・起承転結・プロット）の作成と編集
+# ===============================================================================
+st.set_page_config(page_title="設定資料", page_icon="📚", layout="wide")
+
+CHARACTER_COLUMNS = {'name': '名前', 'role': '役割', 'traits': '特徴・口調'}
+
+@st.cache_resource
+def get_bible_store() -> BibleStore:
+    """プロセス全体で共有する設定資料ストアを取得"""
+    return BibleStore(BIBLE_PATH)
+
+def characters_from_editor(rows: list) -> list:
+    """表の行を登場人物の一覧にする（名前が空の行は捨てる）"""
+    return [{key: str(row.get(label) or '').strip() for key, label in CHARACTER_COLUMNS.items()} for row in rows if str(row.get('名前') or '').strip()]
+
+st.title("📚 設定資料")
+# 保存・削除の後はページを再実行するので、完了のメッセージは次の実行で表示する
+if st.session_state.get('bible_notice'):
+    st.success(st.session_state.pop('bible_notice'))
+st.caption("シリーズの登場人物・主人公・世界観・起承転結・プロットを保存します。メイン画面のサイドバーで選ぶと、各タブのプロンプトには全文ではなく上限トークン内の要約だけが差し込まれます。")
+store = get_bible_store()
+
+with st.expander("➕ 新しい設定資料を作成", expanded=not store.list()):
+    with st.form("create_bible_form", clear_on_submit=True):
+        new_name = st.text_input("名前", placeholder="例：嫁姑スカッとシリーズ")
+        if st.form_submit_button("作成"):
+            if new_name.strip():
+                st.session_state.editing_bible_id = store.create(new_name.strip())
+            else:
+                st.error("名前を入力してください")
+
+bibles = {item['id']: item for item in store.list()}
+if not bibles:
+    st.info("設定資料がまだありません")
+    st.stop()
+ids = list(bibles)
+bible_id = st.selectbox("編集する設定資料", ids, index=ids.index(st.session_state.get('editing_bible_id')) if st.session_state.get('editing_bible_id') in bibles else 0,
+                        format_func=lambda x: f"{bibles[x]['name']}（rev {bibles[x]['revision']}）")
+bible = store.get(bible_id)
+
+with st.form(f"bible_form_{bible_id}"):
+    name = st.text_input("名前", value=bible['name'])
+    col1, col2 = st.columns(2)
+    title = col1.text_input("作品タイトル", value=bible['title'])
+    genre = col2.text_input("ジャンル", value=bible['genre'])
+    protagonist = st.text_area("主人公の設定", value=bible['protagonist'], height=80)
+    worldview = st.text_area("世界観・設定", value=bible['worldview'], height=80)
+    st.markdown("**登場人物**（名前が空の行は保存されません）")
+    characters = st.data_editor([{label: c.get(key, '') for key, label in CHARACTER_COLUMNS.items()} for c in bible['characters']] or [{label: '' for label in CHARACTER_COLUMNS.values()}],
+                                num_rows="dynamic", use_container_width=True, key=f"bible_characters_{bible_id}")
+    st.markdown("**物語の骨子（起承転結）**")
+    outline = {key: st.text_input(label, value=bible['outline'].get(key, ''), key=f"bible_outline_{key}_{bible_id}") for key, label in OUTLINE_LABELS.items()}
+    plot = st.text_area("プロット", value=bible['plot'], height=200, help="プロット作成タブの結果から「📚 このプロットを設定資料に取り込む」でも保存できます")
+    notes = st.text_area("メモ（口調の決まり・禁止事項など）", value=bible['notes'], height=80)
+    if st.form_submit_button("💾 保存", type="primary"):
+        store.update(bible_id, name=name.strip() or bible['name'], title=title, genre=genre, protagonist=protagonist, worldview=worldview,
+                     characters=characters_from_editor(characters), outline=outline, plot=plot, notes=notes)
+        st.session_state.bible_notice = "✅ 保存しました"; st.rerun()
+
+st.subheader("プロンプトに差し込まれる要約")
+budget = st.number_input("上限トークン", min_value=100, max_value=4000, value=BIBLE_SUMMARY_TOKENS, step=100)
+summary = store.summary(bible_id, int(budget))
+st.caption(f"約{summary['tokens']:,}トークン" + (f"・上限を超える{summary['omitted_lines']}行を省略" if summary['omitted_lines'] else "") + f"・ID: {bible_id}")
+st.code(summary['text'] or "（設定資料が空です）", language="text")
+
+with st.expander("🗑️ この設定資料を削除"):
+    if st.button("削除する", key=f"delete_bible_{bible_id}"):
+        store.delete(bible_id)
+        st.session_state.pop('editing_bible_id', None)
+        st.session_state.bible_notice = f"🗑️ {bible['name']}を削除しました"; st.rerun()
@@ -0,0 +1,55 @@
+import streamlit as st
+from datetime import datetime
+
+from story2ch.metrics import METRICS_PATH, MetricsStore, prometheus_text
+
+# ===============================================================================
+# 管理用: モデル呼び出しの計測結果
+# ===============================================================================
+st.set_page_config(page_title="計測ダッシュボード", page_icon="📈", layout="wide")
+
+WINDOWS = {'1時間': 3600, '24時間': 24 * 3600, '7日間': 7 * 24 * 3600, 'すべて': None}
+SUMMARY_COLUMNS = {'calls': '回数', 'errors': 'エラー', 'cache_hit_rate': 'キャッシュ率', 'latency_p50_ms': 'p50(ms)', 'latency_p95_ms': 'p95(ms)',
+                   'ttft_p50_ms': '初回p50(ms)', 'ttft_p95_ms': '初回p95(ms)', 'input_tokens': '入力', 'output_tokens': '出力', 'cost': '料金($)'}
+
+@st.cache_resource
+def get_metrics_store() -> MetricsStore:
+    """プロセス全体で共有する計測結果の保存先を取得"""
+    return MetricsStore(METRICS_PATH)
+
+def render_summary(store: MetricsStore, group_by: str, label: str, since_seconds):
+    """集計表を表示"""
+    summary = store.summary(group_by, since_seconds)
+    if not summary:
+        st.caption("この期間の呼び出し記録はありません")
+        return
+    st.table([{label: s[group_by], **{name: s[key] for key, name in SUMMARY_COLUMNS.items()}} for s in summary])
+
+st.title("📈 計測ダッシュボード")
+st.caption("モデル呼び出しごとのレイテンシ（キャッシュヒット・エラーを除く）・最初のチャンクまでの時間・トークン数・料金")
+store = get_metrics_store()
+window = st.radio("期間", list(WINDOWS), horizontal=True)
+since_seconds = WINDOWS[window]
+
+rows = store.rows(since_seconds)
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("呼び出し", f"{len(rows):,}")
+col2.metric("エラー", f"{sum(1 for r in rows if r['error']):,}")
+col3.metric("トークン", f"{sum((r['input_tokens'] or 0) + (r['output_tokens'] or 0) for r in rows):,}")
+col4.metric("料金", f"${sum(r['cost'] or 0 for r in rows):.4f}")
+
+st.subheader("タブ別")
+render_summary(store, 'tab', 'タブ', since_seconds)
+st.subheader("内容の種類別")
+render_summary(store, 'content_type', '種類', since_seconds)
+st.subheader("モデル別")
+render_summary(store, 'model', 'モデル', since_seconds)
+
+st.subheader("直近の呼び出し")
+st.dataframe([{'時刻': datetime.fromtimestamp(r['created_at']).strftime('%m-%d %H:%M:%S'), 'タブ': r['tab'], '種類': r['content_type'], 'モデル': r['model'], '作成(ms)': r['build_ms'], '待ち(ms)': r['queue_ms'],
+               'レイテンシ(ms)': r['latency_ms'], '初回(ms)': r['ttft_ms'], '入力': r['input_tokens'], '出力': r['output_tokens'],
+               'キャッシュ': bool(r['cache_hit']), '終了理由': r['finish_reason'], 'エラー': r['error']} for r in reversed(rows[-50:])],
+             use_container_width=True)
+
+with st.expander("Prometheus形式（`python -m story2ch metrics --port 9464` で /metrics として公開できます）"):
+    st.code(prometheus_text(store), language="text")
@@ -0,0 +1,20 @@
+"""プロ仕様 台本・プロット作成システムのプロンプト生成と生成クライアント（Streamlitに依存しない）"""
+from .cache import ResponseCache, make_cache_key
+from .client import DEFAULT_MODEL_NAME, cached_generate, create_model, generate_chaptered, response_token_count
+from .prompts import (
+    CHAPTER_TITLES, PROMPT_FUNCS, VIDEO_PROMPT_FUNCS, PromptText,
+    create_2ch_video_prompt, create_error_check_prompt, create_kaigai_hanno_prompt, create_name_prompt,
+    create_plot_prompt, create_script_prompt, create_secondary_check_prompt, create_sukatto_prompt,
+    create_theme_generation_prompt, create_youtube_prompt_base,
+)
+from .routing import ModelRouter, classify_task
+
+__all__ = [
+    'ResponseCache', 'make_cache_key',
+    'DEFAULT_MODEL_NAME', 'cached_generate', 'create_model', 'generate_chaptered', 'response_token_count',
+    'CHAPTER_TITLES', 'PROMPT_FUNCS', 'VIDEO_PROMPT_FUNCS', 'PromptText',
+    'create_2ch_video_prompt', 'create_error_check_prompt', 'create_kaigai_hanno_prompt', 'create_name_prompt',
+    'create_plot_prompt', 'create_script_prompt', 'create_secondary_check_prompt', 'create_sukatto_prompt',
+    'create_theme_generation_prompt', 'create_youtube_prompt_base',
+    'ModelRouter', 'classify_task',
+]
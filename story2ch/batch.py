@@ -0,0 +1,144 @@
+"""YouTube台本の一括生成（CSV/JSONLの各行を並列に生成する）"""
+import io
+import re
+import csv
+import json
+import time
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional
+
+from .budget import TokenEstimator
+from .client import cached_generate
+from .export import EXPORT_FORMATS, write_script_exports
+from .jobqueue import BATCH, cancellable
+from .prompts import OUTLINE_FIELDS, VIDEO_LENGTHS, VIDEO_PROMPT_FUNCS, VIDEO_TYPE_ALIASES, resolve_video_style
+from .routing import classify_task
+
+class RateLimiter:
+    """1分あたりのリクエスト数を制限する（複数スレッドから共有可能）"""
+
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def acquire(self):
+        """次のリクエストを送ってよい時刻まで待機"""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+def parse_batch_rows(data: bytes, filename: str) -> list:
+    """アップロードされたCSV/JSONLを行の辞書リストに変換"""
+    text = data.decode('utf-8-sig')
+    if filename.lower().endswith(('.jsonl', '.ndjson')):
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+
+def build_batch_params(row: Dict, default_type: str, bible: str = '') -> Dict:
+    """一括生成の1行を(プロンプト関数キー, パラメータ)に変換（不正な行はValueError。bibleは全行に共通の設定資料の要約）"""
+    row = {k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+    theme = row.get('theme')
+    if not theme:
+        raise ValueError("themeが空です")
+    video_type = row.get('type') or default_type
+    video_type = VIDEO_TYPE_ALIASES.get(video_type, video_type)
+    if video_type not in VIDEO_PROMPT_FUNCS:
+        raise ValueError(f"不明な動画の種類です: {video_type}")
+    length = row.get('length') or 'standard'
+    if length not in VIDEO_LENGTHS:
+        raise ValueError(f"不明な長さです: {length}")
+    params = {
+        'theme': theme, 'style': resolve_video_style(video_type, row.get('style')), 'length': length,
+        'pov_character': row.get('pov_character') or '第三者ナレーター', 'mode': 'full-auto',
+        'use_advanced_settings': any(row.get(field) for field in OUTLINE_FIELDS), 'bible': bible,
+    }
+    params.update({field: row.get(field) or '' for field in OUTLINE_FIELDS})
+    return {'type': video_type, 'params': params}
+
+def run_batch_row(model, job: Dict, cache, limiter) -> Dict:
+    """一括生成の1行を実行し、結果とマニフェスト情報を返す（ワーカースレッドで実行、modelにModelRouterを渡すと行ごとに振り分け）"""
+    started = time.monotonic()
+    prompt_func = VIDEO_PROMPT_FUNCS[job['type']]
+    if hasattr(model, 'for_task'):
+        model = model.for_task(classify_task(prompt_func, job['params']))
+    text, usage, hit = cached_generate(model, prompt_func(job['params']), cache, limiter=limiter)
+    return {'text': text, **usage, 'cache_hit': hit, 'latency_sec': round(time.monotonic() - started, 2)}
+
+def estimate_batch_row(model, job: Dict, estimator: TokenEstimator) -> int:
+    """一括生成の1行の見積もりトークン数（キューのTPMの予約に使う）"""
+    prompt_func = VIDEO_PROMPT_FUNCS[job['type']]
+    return estimator.estimate(prompt_func(job['params']), job['params'], getattr(model, 'model_name', ''))['tokens']
+
+def safe_filename(text: str, max_length: int = 40) -> str:
+    """ファイル名に使えない文字を取り除く"""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', text).strip('_')[:max_length] or 'untitled'
+
+def build_batch_zip(results: list, export_formats: tuple = ()) -> bytes:
+    """生成結果のテキストとmanifest.jsonをzipにまとめる（export_formatsを指定すると字幕・TTS用のファイルも台本ごとに追加する）"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        manifest = []
+        for item in results:
+            entry = {k: v for k, v in item.items() if k != 'text'}
+            if item.get('text'):
+                archive.writestr(item['file'], item['text'])
+                if export_formats:
+                    stem = item['file'].rsplit('.', 1)[0]
+                    summary = write_script_exports(archive, stem, item['text'], export_formats)
+                    entry.update(exports=[f"{stem}.{EXPORT_FORMATS[fmt]['ext']}" for fmt in export_formats], segments=summary['segments'], duration_sec=summary['duration_sec'])
+            manifest.append(entry)
+        archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    return buffer.getvalue()
+
+def collect_batch_results(results: list, jobs: list, futures: Dict, on_update: Optional[Callable[[list], None]]):
+    """投入した行の完了を待ち、完了した順に結果を反映する"""
+    for item in jobs: item['status'] = '生成中'
+    if on_update: on_update(results)
+    for future in as_completed(futures):
+        item = futures[future]
+        try:
+            item.update(future.result(), status='完了', file=f"{item['row']:03d}_{item['type']}_{safe_filename(item['theme'])}.txt")
+        except Exception as e:
+            item.update(status='エラー', error=str(e))
+        if on_update: on_update(results)
+
+def run_batch(model, rows: list, default_type: str, max_workers: int = 4, requests_per_minute: int = 10,
+              cache=None, on_update: Optional[Callable[[list], None]] = None, job_queue=None, user: str = '', bible: str = '',
+              estimator: Optional[TokenEstimator] = None, cancelled: Optional[threading.Event] = None) -> list:
+    """CSV/JSONLの全行を並列に生成し、行ごとの結果リストを返す（on_updateは各行の完了時に呼び出し元スレッドで呼ばれる）
+
+    job_queue（jobqueue.JobQueue）を渡すと、各行を見積もりトークン数を添えて一括の優先度でプロセス共有のキューに投入し、流量はキュー側で制限する。
+    bible（設定資料の要約）を渡すと、シリーズの全話で同じ登場人物・世界観を使うように各行のプロンプトに差し込む。
+    cancelledがセットされると、まだ始まっていない行は生成せずにエラーにする。
+    """
+    results = []
+    for i, row in enumerate(rows, start=1):
+        entry = {'row': i, 'type': row.get('type') or default_type, 'theme': row.get('theme', ''), 'status': '待機中', 'tokens': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0, 'latency_sec': None, 'cache_hit': False, 'file': '', 'error': ''}
+        try:
+            entry['job'] = build_batch_params(row, default_type, bible)
+            entry['type'] = entry['job']['type']
+        except ValueError as e:
+            entry.update(status='エラー', error=str(e))
+        results.append(entry)
+
+    jobs = [item for item in results if 'job' in item]
+    if job_queue is not None:
+        estimator = estimator or TokenEstimator()
+        futures = {job_queue.submit(lambda _, job=item['job']: run_batch_row(model, job, cache, None), user, BATCH,
+                                    tokens=estimate_batch_row(model, item['job'], estimator), label=f"一括 {item['row']}行目").future: item
+                   for item in jobs}
+        collect_batch_results(results, jobs, futures, on_update)
+    else:
+        limiter = RateLimiter(requests_per_minute)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(cancellable(run_batch_row, cancelled), model, item['job'], cache, limiter): item for item in jobs}
+            collect_batch_results(results, jobs, futures, on_update)
+
+    for item in results: item.pop('job', None)
+    return results
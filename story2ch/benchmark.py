@@ -0,0 +1,165 @@
+"""オフラインのベンチマーク（タブごとの処理の所要時間・最初のトークンまでの時間・同時実行時のスループット・再実行のオーバーヘッド）
+
+既定ではmock.MockModelを使うためAPIキーもネットワークも不要。結果は回帰の追跡用にJSONで出力する。
+"""
+import os
+import time
+import platform
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from .budget import TokenEstimator
+from .cache import ResponseCache, make_cache_key
+from .client import generate_chaptered, response_usage
+from .metrics import percentile
+from .pipeline import run_pipeline
+from .precheck import proofread_with_precheck
+from .proofread import format_proofread_report, proofread_chunked
+from .prompts import (
+    create_error_check_prompt, create_name_prompt, create_plot_prompt, create_script_prompt,
+    create_secondary_check_prompt, create_sukatto_prompt, create_theme_generation_prompt,
+)
+from .stats import text_stats
+
+SAMPLE_PARAGRAPH = ("その日、私は会社の会議室で部長に呼び出された。「君の企画書、のの内容について話がある」と部長は言った。"
+                    "私は内心ドキドキしながら、資料を1枚ずつ確認した。\n「はい、わかりました」\n"
+                    "数日後、同僚たちの態度が急に変わったことに気づいた。誰も目を合わせようとしない。\n\n")
+SAMPLE_MANUSCRIPT = SAMPLE_PARAGRAPH * 40
+YOUTUBE_PARAMS = {'theme': '義母に家を乗っ取られかけた話', 'style': 'in_laws', 'length': 'standard', 'pov_character': '主人公', 'mode': 'full-auto',
+                  'use_advanced_settings': False}
+
+# タブごとの処理（プロンプト関数・パラメータ・実行方法）。streamはストリーミング表示の流れを再現する
+BENCH_FLOWS = {
+    'theme': {'prompt_func': create_theme_generation_prompt, 'params': {'generation_type': 'genre', 'genre': 'スカッと系', 'keyword': '', 'num_ideas': 5}, 'mode': 'stream'},
+    'plot': {'prompt_func': create_plot_prompt, 'params': {'genre': 'ドラマ', 'title': '青春の記憶', 'protagonist': '高校生', 'worldview': '現代日本', 'existing_plot': '', 'mode': 'full-auto'}, 'mode': 'stream'},
+    'script': {'prompt_func': create_script_prompt, 'params': {'plot': SAMPLE_PARAGRAPH * 5, 'format': 'standard', 'mode': 'full-auto'}, 'mode': 'stream'},
+    'proofread': {'prompt_func': create_error_check_prompt, 'params': {'text': SAMPLE_MANUSCRIPT[:1500], 'level': 'advanced'}, 'mode': 'stream'},
+    'proofread_precheck': {'prompt_func': create_error_check_prompt, 'params': {'text': SAMPLE_MANUSCRIPT, 'level': 'basic'}, 'mode': 'precheck'},
+    'proofread_chunked': {'prompt_func': create_error_check_prompt, 'params': {'text': SAMPLE_MANUSCRIPT, 'level': 'advanced'}, 'mode': 'chunked'},
+    'youtube': {'prompt_func': create_sukatto_prompt, 'params': YOUTUBE_PARAMS, 'mode': 'stream'},
+    'youtube_chaptered': {'prompt_func': create_sukatto_prompt, 'params': dict(YOUTUBE_PARAMS, length='long'), 'mode': 'chaptered'},
+    'name': {'prompt_func': create_name_prompt, 'params': {'story': SAMPLE_PARAGRAPH * 3, 'pages': 20, 'format': 'manga', 'mode': 'full-auto'}, 'mode': 'stream'},
+    'check': {'prompt_func': create_secondary_check_prompt, 'params': {'text_to_check': SAMPLE_MANUSCRIPT, 'check_type': 'plot_holes'}, 'mode': 'stream'},
+    'pipeline': {'prompt_func': create_plot_prompt, 'params': {'theme': '義母に家を乗っ取られかけた話', 'genre': 'ドラマ', 'format': 'standard', 'level': 'basic', 'mode': 'full-auto'}, 'mode': 'pipeline'},
+}
+
+def summarize(values: list) -> Optional[Dict]:
+    """ミリ秒の値の一覧をp50・p95・平均・最大にまとめる"""
+    if not values:
+        return None
+    return {'p50': round(percentile(values, 50), 2), 'p95': round(percentile(values, 95), 2),
+            'mean': round(sum(values) / len(values), 2), 'max': round(max(values), 2)}
+
+def elapsed_ms(started: float) -> float:
+    """開始時刻からの経過ミリ秒"""
+    return (time.perf_counter() - started) * 1000
+
+def run_flow(model, flow: Dict) -> Dict:
+    """1つのタブの処理（プロンプト作成 → 生成 → 表示用の集計）を1回実行して各段階の時間を返す"""
+    started = time.perf_counter()
+    prompt = flow['prompt_func'](flow['params'])
+    build_ms = elapsed_ms(started)
+    ttft_ms, output_tokens = None, 0
+    generate_started = time.perf_counter()
+    if flow['mode'] == 'stream':
+        # app.run_generationと同じく、チャンクごとに受信した本文を連結する（表示は定期更新で末尾だけを送るため、ここでは組み立て直さない）
+        response = model.generate_content(prompt, stream=True)
+        text = ""
+        for chunk in response:
+            if ttft_ms is None:
+                ttft_ms = elapsed_ms(generate_started)
+            if not chunk.parts: continue
+            text += chunk.text
+        output_tokens = response_usage(response, getattr(model, 'model_name', ''))['output_tokens']
+    elif flow['mode'] == 'precheck':
+        result = proofread_with_precheck(model, flow['params']['text'], flow['params']['level'])
+        text, output_tokens = result['text'], result['output_tokens']
+    elif flow['mode'] == 'chunked':
+        result = proofread_chunked(model, flow['params']['text'], flow['params']['level'])
+        text, output_tokens = format_proofread_report(result), result['output_tokens']
+    elif flow['mode'] == 'chaptered':
+        result = generate_chaptered(model, flow['prompt_func'], flow['params'])
+        text, output_tokens = result['text'], result['output_tokens']
+    elif flow['mode'] == 'pipeline':
+        result = run_pipeline(model, flow['params'])
+        text = "\n\n".join(stage['display'] for stage in result['stages'])
+        output_tokens = sum(stage['output_tokens'] for stage in result['stages'])
+    else:
+        raise ValueError(f"不明な処理です: {flow['mode']}")
+    latency_ms = elapsed_ms(generate_started)
+    render_started = time.perf_counter()
+    # 生成結果の表示と同じく、内容のハッシュごとにキャッシュされる統計を使う
+    text_stats(text)
+    return {'build_ms': build_ms, 'latency_ms': latency_ms, 'ttft_ms': ttft_ms, 'render_ms': elapsed_ms(render_started),
+            'total_ms': elapsed_ms(started), 'output_tokens': output_tokens}
+
+def measure_rerun(model, flow: Dict, cache: ResponseCache, estimator: TokenEstimator, iterations: int) -> Dict:
+    """Streamlitの再実行1回分（プロンプト作成・見積もり表示・キャッシュ確認）のオーバーヘッドを計測"""
+    prompt = flow['prompt_func'](flow['params'])
+    cache.put(make_cache_key(model, prompt), "cached", 0)
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        prompt = flow['prompt_func'](flow['params'])
+        estimator.estimate(prompt, flow['params'], getattr(model, 'model_name', ''))
+        cache.get(make_cache_key(model, prompt))
+        samples.append(elapsed_ms(started))
+    return summarize(samples)
+
+def bench_flow(model, name: str, iterations: int, cache: ResponseCache, estimator: TokenEstimator) -> Dict:
+    """1つのタブの処理をiterations回実行して集計"""
+    runs, errors = [], []
+    for _ in range(iterations):
+        try:
+            runs.append(run_flow(model, BENCH_FLOWS[name]))
+        except Exception as e:
+            errors.append(type(e).__name__)
+    return {
+        'runs': len(runs), 'errors': len(errors), 'error_types': sorted(set(errors)),
+        **{key: summarize([run[key] for run in runs if run[key] is not None]) for key in ('total_ms', 'build_ms', 'latency_ms', 'ttft_ms', 'render_ms')},
+        'output_tokens_mean': round(sum(run['output_tokens'] for run in runs) / len(runs), 1) if runs else None,
+        'rerun_ms': measure_rerun(model, BENCH_FLOWS[name], cache, estimator, max(iterations, 20)),
+    }
+
+def bench_concurrency(model, sessions: int, requests_per_session: int, flows: list) -> Dict:
+    """sessions個のセッションが同時に処理を実行した場合のスループットとレイテンシ"""
+    def session(index: int) -> list:
+        results = []
+        for i in range(requests_per_session):
+            name = flows[(index + i) % len(flows)]
+            try:
+                results.append(('ok', run_flow(model, BENCH_FLOWS[name])['total_ms']))
+            except Exception as e:
+                results.append((type(e).__name__, None))
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = [item for items in executor.map(session, range(sessions)) for item in items]
+    wall_sec = time.perf_counter() - started
+    latencies = [ms for status, ms in results if status == 'ok']
+    return {'sessions': sessions, 'requests': len(results), 'errors': len(results) - len(latencies), 'wall_sec': round(wall_sec, 3),
+            'throughput_rps': round(len(latencies) / wall_sec, 3) if wall_sec else None, 'latency_ms': summarize(latencies)}
+
+def run_benchmark(model, flows: Optional[list] = None, iterations: int = 5, sessions: tuple = (1, 4, 16), requests_per_session: int = 3,
+                  concurrency_flows: tuple = ('script', 'youtube', 'check'), on_progress: Optional[Callable[[str], None]] = None) -> Dict:
+    """ベンチマーク全体を実行し、JSONにできる結果を返す"""
+    flows = flows or list(BENCH_FLOWS)
+    estimator = TokenEstimator()
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResponseCache(os.path.join(tmp, 'bench.sqlite3'))
+        flow_results = {}
+        for name in flows:
+            if on_progress: on_progress(f"計測中: {name}")
+            flow_results[name] = bench_flow(model, name, iterations, cache, estimator)
+    concurrency = []
+    for n in sessions:
+        if on_progress: on_progress(f"同時実行を計測中: {n}セッション")
+        concurrency.append(bench_concurrency(model, n, requests_per_session, [f for f in concurrency_flows if f in BENCH_FLOWS]))
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+        'backend': type(model).__name__, 'model': getattr(model, 'model_name', ''), 'options': getattr(model, 'options', None),
+        'iterations': iterations, 'flows': flow_results, 'concurrency': concurrency,
+    }
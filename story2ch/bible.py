@@ -0,0 +1,215 @@
+"""作品ごとの設定資料（登場人物・主人公・世界観・起承転結の骨子・プロット）のSQLiteストアと、プロンプトに差し込むトークン上限付きの要約"""
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from .budget import approximate_tokens
+
+BIBLE_PATH = os.environ.get("STORY_BIBLE_PATH", os.path.join(".story_cache", "bible.sqlite3"))
+BIBLE_SUMMARY_TOKENS = 600
+BIBLE_TEXT_FIELDS = ['title', 'genre', 'protagonist', 'worldview', 'plot', 'notes']
+OUTLINE_LABELS = {'story_start': '起', 'story_development': '承', 'story_turn': '転', 'story_ending': '結'}
+# 要約での各項目の最大文字数
+SECTION_CHARS = {'protagonist': 120, 'worldview': 160, 'traits': 50, 'outline': 80, 'plot': 300, 'notes': 120}
+# 要約に入れる順（トークン上限に収まらない場合は後ろの項目から省く）
+SUMMARY_SECTIONS = ['work', 'characters', 'protagonist', 'worldview', 'outline', 'plot', 'notes']
+# 上限に収まらない行を縮めて入れる場合の最小トークン数（これより短くなるなら省く）
+MIN_SHORTENED_TOKENS = 20
+
+SENTENCE_END_PATTERN = re.compile(r'(?<=[。！？!?])')
+# 「1. 作品概要」「## 主要登場人物」「【世界観】」「**プロット**」のような見出し行
+PLOT_HEADING_PATTERN = re.compile(r'^[ \t]*(?:#+[ \t]*|\d+[.．][ \t]*|【|\*\*)\**([^\n*】:：]{1,30}?)\**】?[ \t]*[:：]?[ \t]*$', re.M)
+CHARACTER_LINE_PATTERN = re.compile(r'^\s*(?:[-*・]|\d+[.．)])?\s*\**([^\s:：（()*]{1,20})\**\s*(?:[（(]([^）)\n]{1,30})[）)])?\s*\**\s*[:：]\s*(.+)$')
+
+def empty_bible() -> Dict:
+    """空の設定資料"""
+    return {**{field: '' for field in BIBLE_TEXT_FIELDS}, 'characters': [], 'outline': {key: '' for key in OUTLINE_LABELS}}
+
+def compact_text(text: str, max_chars: int) -> str:
+    """空白をまとめ、文の区切りでmax_chars文字以内に縮める（1文目が長すぎる場合は途中で切る）"""
+    text = re.sub(r'\s+', ' ', text or '').strip()
+    if len(text) <= max_chars:
+        return text
+    result = ''
+    for sentence in SENTENCE_END_PATTERN.split(text):
+        if len(result) + len(sentence) > max_chars:
+            break
+        result += sentence
+    return result.strip() or text[:max_chars - 1] + '…'
+
+def plot_section(plot: str, heading: str) -> str:
+    """プロットから見出し（例: 作品概要・主要登場人物）の部分を取り出す（見つからなければ空文字）"""
+    headings = [m for m in PLOT_HEADING_PATTERN.finditer(plot)]
+    for i, m in enumerate(headings):
+        if heading in m.group(1):
+            end = headings[i + 1].start() if i + 1 < len(headings) else len(plot)
+            return plot[m.end():end].strip()
+    return ''
+
+def extract_characters(plot: str) -> list:
+    """プロットの「主要登場人物」の行から、名前・役割・特徴を取り出す"""
+    characters = []
+    for line in plot_section(plot, '登場人物').splitlines():
+        m = CHARACTER_LINE_PATTERN.match(line)
+        if m:
+            characters.append({'name': m.group(1), 'role': (m.group(2) or '').strip(), 'traits': m.group(3).strip()})
+    return characters
+
+def merge_characters(existing: list, added: list) -> list:
+    """登場人物を名前で統合する（既存の人物はそのまま、新しい名前だけを追加）"""
+    names = {c['name'] for c in existing}
+    return list(existing) + [c for c in added if c['name'] not in names]
+
+def compact_section(section: str, bible: Dict) -> list:
+    """要約の1項目を行の一覧にする"""
+    if section == 'work':
+        work = "・".join(part for part in (f"『{bible['title']}』" if bible['title'] else '', bible['genre']) if part)
+        return [f"作品: {work}"] if work else []
+    if section == 'characters':
+        return [f"- {c['name']}" + (f"（{c['role']}）" if c.get('role') else "") + (f": {compact_text(c['traits'], SECTION_CHARS['traits'])}" if c.get('traits') else "")
+                for c in bible['characters'] if c.get('name')]
+    if section == 'outline':
+        return [f"{label}: {compact_text(bible['outline'][key], SECTION_CHARS['outline'])}" for key, label in OUTLINE_LABELS.items() if bible['outline'].get(key)]
+    if section == 'plot':
+        gist = compact_text(plot_section(bible['plot'], '概要') or bible['plot'], SECTION_CHARS['plot'])
+        return [f"あらすじ: {gist}"] if gist else []
+    labels = {'protagonist': '主人公', 'worldview': '世界観', 'notes': 'メモ'}
+    return [f"{labels[section]}: {compact_text(bible[section], SECTION_CHARS[section])}"] if bible[section] else []
+
+def section_source(section: str, bible: Dict) -> str:
+    """要約の1項目の元になる内容（変わったかどうかの判定に使う）"""
+    if section == 'work':
+        return json.dumps([bible['title'], bible['genre']], ensure_ascii=False)
+    if section in ('characters', 'outline'):
+        return json.dumps(bible[section], ensure_ascii=False, sort_keys=True)
+    return bible[section]
+
+def fit_summary(sections: Dict[str, list], budget_tokens: int) -> Dict:
+    """項目の優先順に、トークン上限に収まる行だけを並べた要約（収まらない行は残りが十分あれば縮めて入れる）"""
+    lines, tokens, omitted = [], 0, 0
+    for section in SUMMARY_SECTIONS:
+        for line in sections.get(section, []):
+            cost = approximate_tokens(line) + 1
+            remaining = budget_tokens - tokens - 1
+            if tokens + cost > budget_tokens and remaining >= MIN_SHORTENED_TOKENS:
+                # 1トークンは1文字以上なので、残りのトークン数を文字数の上限にすれば必ず収まる
+                line = compact_text(line, remaining)
+                cost = approximate_tokens(line) + 1
+            if tokens + cost > budget_tokens:
+                omitted += 1
+                continue
+            lines.append(line)
+            tokens += cost
+    return {'text': "\n".join(lines), 'tokens': tokens, 'omitted_lines': omitted}
+
+class BibleStore:
+    """作品ごとの設定資料をIDで保存し、要約は項目ごとに内容が変わった部分だけを作り直して保持する"""
+
+    def __init__(self, path: str = BIBLE_PATH):
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS bibles (
+            id TEXT PRIMARY KEY, name TEXT NOT NULL, data TEXT NOT NULL, revision INTEGER NOT NULL, updated_at REAL NOT NULL)""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS bible_sections (
+            bible_id TEXT NOT NULL, section TEXT NOT NULL, digest TEXT NOT NULL, lines TEXT NOT NULL, PRIMARY KEY (bible_id, section))""")
+        # 要約は上限トークン数ごとに保持する（メイン画面と設定資料のページで上限が違っても作り直し合わない）
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS bible_summaries (
+            bible_id TEXT NOT NULL, budget INTEGER NOT NULL, revision INTEGER NOT NULL, summary TEXT NOT NULL, tokens INTEGER NOT NULL,
+            omitted INTEGER NOT NULL, PRIMARY KEY (bible_id, budget))""")
+        self._conn.commit()
+
+    def create(self, name: str, **fields) -> str:
+        """設定資料を作成してIDを返す"""
+        bible_id = uuid.uuid4().hex[:12]
+        data = dict(empty_bible(), **fields)
+        with self._lock:
+            self._conn.execute("INSERT INTO bibles (id, name, data, revision, updated_at) VALUES (?, ?, ?, 1, ?)",
+                               (bible_id, name, json.dumps(data, ensure_ascii=False), time.time()))
+            self._conn.commit()
+        return bible_id
+
+    def get(self, bible_id: str) -> Optional[Dict]:
+        """設定資料（id・name・revisionと各項目）を取得"""
+        with self._lock:
+            row = self._conn.execute("SELECT id, name, data, revision FROM bibles WHERE id = ?", (bible_id,)).fetchone()
+        if row is None:
+            return None
+        return {'id': row['id'], 'name': row['name'], 'revision': row['revision'], **dict(empty_bible(), **json.loads(row['data']))}
+
+    def list(self) -> list:
+        """設定資料の一覧（新しく更新した順）"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, name, revision, updated_at FROM bibles ORDER BY updated_at DESC").fetchall()
+        return [dict(row) for row in rows]
+
+    def update(self, bible_id: str, name: Optional[str] = None, **fields) -> bool:
+        """項目を更新してリビジョンを上げる（内容が変わらなければ何もしない）"""
+        bible = self.get(bible_id)
+        if bible is None:
+            return False
+        data = {key: bible[key] for key in empty_bible()}
+        updated = dict(data, **fields)
+        if updated == data and (name is None or name == bible['name']):
+            return True
+        with self._lock:
+            self._conn.execute("UPDATE bibles SET name = ?, data = ?, revision = revision + 1, updated_at = ? WHERE id = ?",
+                               (name or bible['name'], json.dumps(updated, ensure_ascii=False), time.time(), bible_id))
+            self._conn.commit()
+        return True
+
+    def import_plot(self, bible_id: str, plot: str) -> bool:
+        """生成したプロットを設定資料に取り込む（プロットを置き換え、登場人物は新しい名前だけを追加）"""
+        bible = self.get(bible_id)
+        if bible is None:
+            return False
+        return self.update(bible_id, plot=plot, characters=merge_characters(bible['characters'], extract_characters(plot)))
+
+    def delete(self, bible_id: str):
+        """設定資料を削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM bibles WHERE id = ?", (bible_id,))
+            self._conn.execute("DELETE FROM bible_sections WHERE bible_id = ?", (bible_id,))
+            self._conn.execute("DELETE FROM bible_summaries WHERE bible_id = ?", (bible_id,))
+            self._conn.commit()
+
+    def _section_lines(self, bible: Dict, section: str) -> list:
+        """要約の1項目（元の内容が前回と同じなら保存済みの行を使う）"""
+        digest = hashlib.sha256(section_source(section, bible).encode('utf-8')).hexdigest()
+        with self._lock:
+            row = self._conn.execute("SELECT digest, lines FROM bible_sections WHERE bible_id = ? AND section = ?", (bible['id'], section)).fetchone()
+        if row is not None and row['digest'] == digest:
+            return json.loads(row['lines'])
+        lines = compact_section(section, bible)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO bible_sections (bible_id, section, digest, lines) VALUES (?, ?, ?, ?)",
+                               (bible['id'], section, digest, json.dumps(lines, ensure_ascii=False)))
+            self._conn.commit()
+        return lines
+
+    def summary(self, bible_id: str, budget_tokens: int = BIBLE_SUMMARY_TOKENS) -> Optional[Dict]:
+        """プロンプトに差し込む要約（text・tokens・omitted_lines。同じリビジョン・上限で作った要約があればそれを返す）"""
+        with self._lock:
+            row = self._conn.execute("""SELECT b.revision, s.revision AS summary_revision, s.summary, s.tokens, s.omitted FROM bibles b
+                LEFT JOIN bible_summaries s ON s.bible_id = b.id AND s.budget = ? WHERE b.id = ?""", (budget_tokens, bible_id)).fetchone()
+        if row is None:
+            return None
+        if row['summary_revision'] == row['revision']:
+            return {'text': row['summary'], 'tokens': row['tokens'], 'omitted_lines': row['omitted'], 'revision': row['revision']}
+        bible = self.get(bible_id)
+        result = fit_summary({section: self._section_lines(bible, section) for section in SUMMARY_SECTIONS}, budget_tokens)
+        with self._lock:
+            # 古いリビジョンの要約は使わないので消す
+            self._conn.execute("DELETE FROM bible_summaries WHERE bible_id = ? AND revision != ?", (bible_id, bible['revision']))
+            self._conn.execute("INSERT OR REPLACE INTO bible_summaries (bible_id, budget, revision, summary, tokens, omitted) VALUES (?, ?, ?, ?, ?, ?)",
+                               (bible_id, budget_tokens, bible['revision'], result['text'], result['tokens'], result['omitted_lines']))
+            self._conn.commit()
+        return dict(result, revision=bible['revision'])
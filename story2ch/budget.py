@@ -0,0 +1,140 @@
+"""トークン数・料金の事前見積もりと、セッション/1日あたりの予算管理"""
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Optional
+
+# 100万トークンあたりの概算料金（USD）。正確な料金はGoogle Cloudの請求を確認すること
+MODEL_PRICING = {
+    'gemini-2.0-flash-exp': {'input': 0.10, 'output': 0.40},
+    'gemini-2.0-flash': {'input': 0.10, 'output': 0.40},
+    'gemini-2.0-flash-lite': {'input': 0.075, 'output': 0.30},
+    'gemini-1.5-flash': {'input': 0.075, 'output': 0.30},
+    'gemini-1.5-flash-8b': {'input': 0.0375, 'output': 0.15},
+    'gemini-1.5-pro': {'input': 1.25, 'output': 5.00},
+}
+DEFAULT_PRICING = {'input': 0.10, 'output': 0.40}
+# コンテキストキャッシュから読み込んだ入力トークンは通常の入力単価の25%
+CACHED_INPUT_RATE = 0.25
+DOWNGRADE_MODEL_NAME = 'gemini-2.0-flash-lite'
+
+USAGE_PATH = os.environ.get("STORY_USAGE_PATH", os.path.join(".story_cache", "usage.sqlite3"))
+
+# 出力の想定文字数（動画の長さ別・その他の種類）
+EXPECTED_OUTPUT_CHARS = {'super_short': 2000, 'short': 4000, 'standard': 7000, 'long': 11000, 'super_long': 15000}
+DEFAULT_OUTPUT_CHARS = 3000
+NAME_CHARS_PER_PAGE = 400
+WIDE_CHAR_PATTERN = re.compile(r'[　-鿿豈-﫿＀-￯]')
+
+def model_pricing(model_name: str) -> Dict:
+    """モデル名（'models/'付きも可）から料金表を取得"""
+    return MODEL_PRICING.get((model_name or '').split('/')[-1], DEFAULT_PRICING)
+
+def estimate_cost(model_name: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> float:
+    """入力・出力トークン数から料金（USD）を計算（cached_tokensは入力のうちコンテキストキャッシュから読み込んだ分）"""
+    pricing = model_pricing(model_name)
+    input_cost = (input_tokens - cached_tokens + cached_tokens * CACHED_INPUT_RATE) * pricing['input']
+    return (input_cost + output_tokens * pricing['output']) / 1_000_000
+
+def approximate_tokens(text: str) -> int:
+    """APIを呼ばずにトークン数を概算（日本語は1文字≒1トークン、英数字は4文字≒1トークン）"""
+    wide = len(WIDE_CHAR_PATTERN.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+def expected_output_chars(params: Dict) -> int:
+    """パラメータから出力の想定文字数を決める"""
+    if params.get('length') in EXPECTED_OUTPUT_CHARS:
+        return EXPECTED_OUTPUT_CHARS[params['length']]
+    if params.get('pages'):
+        return int(params['pages']) * NAME_CHARS_PER_PAGE
+    text = params.get('text') or params.get('text_to_check') or ''
+    if text:
+        # 校正は修正済み全文＋修正箇所一覧、二次チェックは指摘と改善案を返すため、入力と同程度を見込む
+        return max(DEFAULT_OUTPUT_CHARS, int(len(text) * 1.2))
+    return DEFAULT_OUTPUT_CHARS
+
+class TokenEstimator:
+    """プロンプトのトークン数を見積もり、プロンプトのハッシュごとに結果をキャッシュする"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._counts = OrderedDict()
+
+    def count(self, prompt: str, model=None) -> int:
+        """入力トークン数を取得（modelを渡すとcount_tokensで正確に数え、失敗時は概算）"""
+        prefix = getattr(prompt, 'prefix', '')
+        if prefix and model is not None:
+            # 固定部分は観点・章が変わっても同じなので、固定部分と残りを別々に数えて固定部分の結果を再利用する
+            return self.count(prefix, model) + self.count(prompt[len(prefix):], model)
+        key = hashlib.sha256(f"{getattr(model, 'model_name', '') if model else ''}\n{prompt}".encode('utf-8')).hexdigest()
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+        tokens = None
+        if model is not None:
+            try:
+                tokens = model.count_tokens(prompt).total_tokens
+            except Exception:
+                tokens = None
+        if tokens is None:
+            tokens = approximate_tokens(prompt)
+        with self._lock:
+            self._counts[key] = tokens
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def estimate(self, prompt: str, params: Dict, model_name: str, model=None, calls: int = 1, output_calls: Optional[int] = None) -> Dict:
+        """1回の生成で見込まれる入力・出力トークン数と料金を返す
+
+        callsは呼び出し回数、output_callsはそのうち想定の長さの出力を1本ずつ返す回数（省略時はcallsと同じ）。
+        章別・ページ分割・チャンク分割のように、複数の呼び出しで1本分の出力を分担する場合は1を渡す。
+        """
+        input_tokens = self.count(prompt, model) * calls
+        output_tokens = approximate_tokens('あ' * expected_output_chars(params)) * (calls if output_calls is None else output_calls)
+        return {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'tokens': input_tokens + output_tokens,
+                'cost': estimate_cost(model_name, input_tokens, output_tokens)}
+
+def check_budget(estimate: Dict, session_cost: float, day_cost: float, limits: Dict) -> Optional[str]:
+    """予算を超える場合は理由を返す（limitsの0は無制限）"""
+    if limits.get('request_tokens') and estimate['tokens'] > limits['request_tokens']:
+        return f"1回あたりの上限（{limits['request_tokens']:,}トークン）を超えます（見積もり {estimate['tokens']:,}トークン）"
+    if limits.get('session_cost') and session_cost + estimate['cost'] > limits['session_cost']:
+        return f"このセッションの予算（${limits['session_cost']:.4f}）を超えます（使用済み ${session_cost:.4f} + 見積もり ${estimate['cost']:.4f}）"
+    if limits.get('day_cost') and day_cost + estimate['cost'] > limits['day_cost']:
+        return f"本日の予算（${limits['day_cost']:.4f}）を超えます（使用済み ${day_cost:.4f} + 見積もり ${estimate['cost']:.4f}）"
+    return None
+
+class UsageLedger:
+    """日ごとのトークン使用量と料金をSQLiteに記録する（全セッション共通の1日の予算に使う）"""
+
+    def __init__(self, path: str = USAGE_PATH):
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS daily_usage (
+            day TEXT PRIMARY KEY, input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, cost REAL NOT NULL)""")
+        self._conn.commit()
+
+    def add(self, usage: Dict):
+        """使用量を本日の合計に加算"""
+        with self._lock:
+            self._conn.execute("""INSERT INTO daily_usage (day, input_tokens, output_tokens, cost) VALUES (?, ?, ?, ?)
+                ON CONFLICT(day) DO UPDATE SET input_tokens = input_tokens + excluded.input_tokens,
+                output_tokens = output_tokens + excluded.output_tokens, cost = cost + excluded.cost""",
+                               (date.today().isoformat(), usage['input_tokens'], usage['output_tokens'], usage['cost']))
+            self._conn.commit()
+
+    def today(self) -> Dict:
+        """本日の使用量を取得"""
+        with self._lock:
+            row = self._conn.execute("SELECT input_tokens, output_tokens, cost FROM daily_usage WHERE day = ?", (date.today().isoformat(),)).fetchone()
+        input_tokens, output_tokens, cost = row or (0, 0, 0.0)
+        return {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'tokens': input_tokens + output_tokens, 'cost': cost}
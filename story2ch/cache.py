@@ -0,0 +1,74 @@
+"""プロンプト・モデル・生成設定をキーにしたSQLiteレスポンスキャッシュ"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional
+
+CACHE_PATH = os.environ.get("STORY_CACHE_PATH", os.path.join(".story_cache", "responses.sqlite3"))
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+class ResponseCache:
+    """プロンプト・モデル・生成設定のハッシュをキーにしたSQLiteレスポンスキャッシュ（TTL・LRU・容量上限付き）"""
+
+    def __init__(self, path: str, ttl_seconds: int = CACHE_TTL_SECONDS, max_bytes: int = CACHE_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, text TEXT NOT NULL, tokens INTEGER NOT NULL, size INTEGER NOT NULL,
+            created_at REAL NOT NULL, accessed_at REAL NOT NULL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(prompt: str, model_name: str, generation_config=None) -> str:
+        """レンダリング済みプロンプトとモデル名・生成設定からキャッシュキーを作成"""
+        payload = json.dumps({'prompt': prompt, 'model': model_name, 'config': generation_config}, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """キャッシュを取得（期限切れの場合は削除してNone）"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT text, tokens, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return {'text': row[0], 'tokens': row[1]}
+
+    def put(self, key: str, text: str, tokens: int):
+        """キャッシュに保存し、期限切れと容量超過分を削除"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, text, tokens, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, text, tokens, len(text.encode('utf-8')), now, now))
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """TTL切れのエントリを削除し、容量上限を超えた分を最終アクセスが古い順に削除"""
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+def make_cache_key(model, prompt: str) -> str:
+    """モデルの名前と生成設定を含めたキャッシュキーを作成"""
+    return ResponseCache.make_key(prompt, getattr(model, 'model_name', ''), getattr(model, '_generation_config', None))
@@ -0,0 +1,356 @@
+"""コマンドライン版の台本生成（python -m story2ch generate --type sukatto --theme ... --length long）"""
+import os
+import sys
+import json
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .batch import build_batch_zip, parse_batch_rows, run_batch
+from .benchmark import BENCH_FLOWS, run_benchmark
+from .bible import BIBLE_SUMMARY_TOKENS, BibleStore
+from .cache import CACHE_PATH, ResponseCache
+from .client import BACKEND_ENV, BACKENDS, DEFAULT_MODEL_NAME, cached_generate, create_model, generate_chaptered
+from .context_cache import ContextCache, ContextCachedModel, context_cached_factory
+from .export import EXPORT_FORMATS, export_script, write_export_zip
+from .metrics import InstrumentedModel, MetricsStore, prometheus_text
+from .mock import MockModel
+from .pipeline import FINISHED_STATUSES, PipelineStore, run_pipeline
+from .precheck import proofread_with_precheck
+from .proofread import CHUNK_SIZE, format_proofread_report, proofread_chunked
+from .prompts import OUTLINE_FIELDS, PROMPT_FUNCS, SECONDARY_CHECK_LABELS, VIDEO_LENGTHS, VIDEO_PROMPT_FUNCS, VIDEO_STYLES, resolve_video_style
+from .routing import CallLog, ModelRouter, classify_task
+from .stats import NARRATION_CHARS_PER_MINUTE
+from .storyboard import SHARDED_NAME_MIN_PAGES, generate_name_sharded
+
+# 入力ファイルの内容を渡すパラメータ名（種類ごと）
+INPUT_PARAM_KEYS = {'script': 'plot', 'proofread': 'text', 'name': 'story', 'check': 'text_to_check', 'plot': 'existing_plot'}
+
+def parse_param(text: str):
+    """key=value形式のパラメータを分解"""
+    key, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"key=value の形式で指定してください: {text}")
+    return key.strip(), value
+
+def build_params(args) -> dict:
+    """コマンドライン引数からプロンプト関数に渡すパラメータを作成"""
+    params = {'mode': 'full-auto'}
+    if args.type in VIDEO_PROMPT_FUNCS:
+        params.update({'length': 'standard', 'pov_character': '第三者ナレーター'})
+    if args.type == 'theme':
+        params.update({'generation_type': 'keyword' if args.keyword else 'genre', 'genre': args.genre or '', 'keyword': args.keyword or '', 'num_ideas': 5})
+    for key in ['theme', 'style', 'length', 'genre', 'title']:
+        if getattr(args, key, None):
+            params[key] = getattr(args, key)
+    if args.pov:
+        params['pov_character'] = args.pov
+    if args.input_file:
+        with open(args.input_file, encoding='utf-8') as f:
+            params[INPUT_PARAM_KEYS.get(args.type, 'text')] = f.read()
+    params.update(dict(args.param or []))
+    if args.bible:
+        params.update(bible_id=args.bible, bible=load_bible(args))
+    if args.type in VIDEO_PROMPT_FUNCS:
+        params['use_advanced_settings'] = any(params.get(field) for field in OUTLINE_FIELDS)
+        try:
+            params['style'] = resolve_video_style(args.type, params.get('style'))
+        except ValueError as e:
+            raise SystemExit(str(e))
+    return params
+
+def load_bible(args) -> str:
+    """--bibleで指定した設定資料の要約（未指定なら空文字）"""
+    if not getattr(args, 'bible', None):
+        return ''
+    summary = BibleStore().summary(args.bible, args.bible_tokens)
+    if summary is None:
+        raise SystemExit(f"設定資料が見つかりません: {args.bible}")
+    print(f"設定資料: 要約 約{summary['tokens']:,}トークン" + (f"（上限を超える{summary['omitted_lines']}行を省略）" if summary['omitted_lines'] else ""), file=sys.stderr)
+    return summary['text']
+
+def get_api_key(args) -> str:
+    """引数または環境変数からAPIキーを取得"""
+    api_key = args.api_key or os.environ.get('GEMINI_API_KEY') or os.environ.get('GOOGLE_API_KEY')
+    if not api_key and os.environ.get(BACKEND_ENV) == 'mock':
+        return 'mock'
+    if not api_key:
+        raise SystemExit("APIキーがありません。--api-key または環境変数 GEMINI_API_KEY を指定してください。")
+    return api_key
+
+def load_model(args, prompt_func=None, params=None):
+    """--modelに応じてモデルを作成（autoの場合はタスク別の振り分け・フォールバックを使う。固定部分はコンテキストキャッシュで再利用し、呼び出しは計測する）"""
+    context_cache = ContextCache()
+    if args.model != 'auto':
+        model = ContextCachedModel(create_model(get_api_key(args), args.model), context_cache)
+    else:
+        router = ModelRouter(get_api_key(args), call_log=CallLog(), model_factory=context_cached_factory(context_cache))
+        model = router.for_task(classify_task(prompt_func, params)) if prompt_func else router
+    return InstrumentedModel(model, MetricsStore(), tab='CLI', content_type=getattr(args, 'type', None) or args.command)
+
+def write_output(path: str, data):
+    """出力先（未指定なら標準出力）に書き込む"""
+    if not path or path == '-':
+        sys.stdout.write(data if isinstance(data, str) else data.decode('utf-8'))
+        return
+    mode = 'w' if isinstance(data, str) else 'wb'
+    with open(path, mode, **({'encoding': 'utf-8'} if mode == 'w' else {})) as f:
+        f.write(data)
+
+def cmd_generate(args) -> int:
+    """1本生成する"""
+    params = build_params(args)
+    prompt_func = PROMPT_FUNCS[args.type]
+    model = load_model(args, prompt_func, params)
+    cache = None if args.no_cache else ResponseCache(CACHE_PATH)
+    if args.type in VIDEO_PROMPT_FUNCS and params.get('length') in ['long', 'super_long'] and not args.single_call:
+        result = generate_chaptered(model, prompt_func, params, cache,
+                                    on_progress=lambda done, total: print(f"章別生成中... ({done}/{total})", file=sys.stderr))
+        text, usage = result['text'], result
+    elif args.type == 'proofread' and params.get('level', 'basic') == 'basic' and not args.no_precheck:
+        result = proofread_with_precheck(model, params['text'], 'basic', cache, bible=params.get('bible'))
+        text, usage = result['text'], result
+    elif args.type == 'name' and int(params.get('pages', 20)) > SHARDED_NAME_MIN_PAGES and not args.single_call:
+        result = generate_name_sharded(model, params, cache,
+                                       on_progress=lambda done, total: print(f"ページ分割生成中... ({done}/{total})", file=sys.stderr))
+        text, usage = result['text'], result
+        if args.records:
+            write_output(args.records, json.dumps(result['pages'], ensure_ascii=False, indent=2) + "\n")
+    elif args.type == 'proofread' and len(params.get('text') or '') > CHUNK_SIZE and not args.single_call:
+        result = proofread_chunked(model, params['text'], params.get('level', 'basic'), cache,
+                                   on_progress=lambda done, total: print(f"分割校正中... ({done}/{total})", file=sys.stderr), bible=params.get('bible'))
+        text, usage = format_proofread_report(result), result
+    else:
+        text, usage, hit = cached_generate(model, prompt_func(params), cache)
+    write_output(args.output, text if text.endswith("\n") else text + "\n")
+    print(f"使用トークン: {usage['tokens']:,}（入力 {usage['input_tokens']:,} / 出力 {usage['output_tokens']:,}）概算料金: ${usage['cost']:.6f}", file=sys.stderr)
+    return 0
+
+def cmd_batch(args) -> int:
+    """CSV/JSONLの全行を生成し、zipを書き出す"""
+    with open(args.file, 'rb') as f:
+        rows = parse_batch_rows(f.read(), args.file)
+    model = load_model(args)
+    cache = None if args.no_cache else ResponseCache(CACHE_PATH)
+
+    def report(results):
+        done = sum(1 for item in results if item['status'] in ('完了', 'エラー'))
+        print(f"一括生成中... ({done}/{len(results)})", file=sys.stderr)
+
+    results = run_batch(model, rows, args.type, args.workers, args.rpm, cache, on_update=report, bible=load_bible(args))
+    write_output(args.output, build_batch_zip(results, tuple(args.export or ())))
+    manifest = [{k: v for k, v in item.items() if k != 'text'} for item in results]
+    print(json.dumps(manifest, ensure_ascii=False, indent=2), file=sys.stderr)
+    return 0 if all(item['status'] == '完了' for item in results) else 1
+
+def cmd_pipeline(args) -> int:
+    """テーマから二次チェックまでを実行し、段階ごとの結果をJSONで書き出す"""
+    config = {'genre': args.genre or '', 'protagonist': args.protagonist or '', 'worldview': args.worldview or '', 'format': args.format,
+              'level': args.level, 'check_types': args.check or list(SECONDARY_CHECK_LABELS), 'mode': 'full-auto'}
+    if args.bible:
+        config['bible'] = load_bible(args)
+    if args.theme:
+        config['theme'] = args.theme
+    else:
+        config.update(keyword=args.keyword or '', num_ideas=args.num_ideas, idea_index=args.idea - 1)
+    model = load_model(args)
+    cache = None if args.no_cache else ResponseCache(CACHE_PATH)
+
+    def report(entries):
+        print(" / ".join(f"{e['label']}: {e['status']}" for e in entries), file=sys.stderr)
+
+    result = run_pipeline(model, config, PipelineStore(), cache, resume=not args.fresh, on_update=report)
+    stages = [{k: e[k] for k in ('name', 'label', 'status', 'display', 'tokens', 'cost', 'latency_sec', 'error')} for e in result['stages']]
+    write_output(args.output, json.dumps({'run_id': result['run_id'], 'stages': stages}, ensure_ascii=False, indent=2) + "\n")
+    return 0 if all(e['status'] in FINISHED_STATUSES for e in result['stages']) else 1
+
+def cmd_bible(args) -> int:
+    """設定資料の一覧・要約の表示・プロットの取り込み"""
+    store = BibleStore()
+    if args.action == 'list':
+        write_output(args.output, "".join(f"{item['id']}\t{item['name']}\t(rev {item['revision']})\n" for item in store.list()))
+        return 0
+    if args.action == 'show':
+        summary = store.summary(args.bible, args.bible_tokens) if args.bible else None
+        if summary is None:
+            raise SystemExit("--bible に設定資料のIDを指定してください" if not args.bible else f"設定資料が見つかりません: {args.bible}")
+        write_output(args.output, summary['text'] + "\n")
+        print(f"約{summary['tokens']:,}トークン・省略 {summary['omitted_lines']}行", file=sys.stderr)
+        return 0
+    if not args.input_file:
+        raise SystemExit("--input-file に取り込むプロットのファイルを指定してください")
+    with open(args.input_file, encoding='utf-8') as f:
+        plot = f.read()
+    bible_id = args.bible or store.create(args.name or os.path.splitext(os.path.basename(args.input_file))[0])
+    if not store.import_plot(bible_id, plot):
+        raise SystemExit(f"設定資料が見つかりません: {args.bible}")
+    write_output(args.output, bible_id + "\n")
+    return 0
+
+def read_scripts(paths: list):
+    """台本ファイルを1本ずつ読み込んで(ファイル名の拡張子を除いた名前, 本文)を返す"""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            yield os.path.splitext(os.path.basename(path))[0], f.read()
+
+def cmd_export(args) -> int:
+    """台本を話者ごとの行に分け、字幕・TTS用の形式で書き出す（1本・1形式なら1ファイル、それ以外はzip）"""
+    formats = args.format or ['srt']
+    if len(args.files) == 1 and len(formats) == 1 and not (args.output or '').lower().endswith('.zip'):
+        with open(args.files[0], encoding='utf-8') as source:
+            if not args.output or args.output == '-':
+                summary = export_script(source, {formats[0]: sys.stdout}, args.chars_per_minute)
+            else:
+                with open(args.output, 'w', encoding='utf-8', newline='') as out:
+                    summary = export_script(source, {formats[0]: out}, args.chars_per_minute)
+        print(f"{summary['segments']:,}行・約{summary['duration_sec']:,.0f}秒・話者 " + "、".join(f"{name} {count}" for name, count in summary['speakers'].items()), file=sys.stderr)
+        return 0
+    if not args.output or args.output == '-':
+        raise SystemExit("複数の台本・形式を書き出す場合は -o にzipファイルを指定してください")
+    manifest = write_export_zip(read_scripts(args.files), formats, args.output, args.chars_per_minute)
+    print(f"{len(manifest)}本を書き出しました（合計 約{sum(item['duration_sec'] for item in manifest):,.0f}秒）", file=sys.stderr)
+    return 0
+
+def parse_mock_option(text: str):
+    """key=value形式のスタブ設定を分解（値はJSONとして読めれば数値などに変換）"""
+    key, value = parse_param(text)
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+def cmd_bench(args) -> int:
+    """モックバックエンド（--backend geminiなら実際のAPI）でベンチマークを実行し、結果をJSONで書き出す"""
+    if args.backend == 'gemini':
+        model = load_model(args)
+    else:
+        model = MockModel(args.model, dict(args.mock_option or []))
+    sessions = tuple(int(n) for n in args.sessions.split(',') if n.strip())
+    result = run_benchmark(model, args.flow, args.iterations, sessions, args.requests_per_session,
+                           on_progress=lambda message: print(message, file=sys.stderr))
+    write_output(args.output, json.dumps(result, ensure_ascii=False, indent=2) + "\n")
+    return 0
+
+def cmd_metrics(args) -> int:
+    """計測結果をPrometheus形式で出力（--portを指定すると /metrics として公開し続ける）"""
+    store = MetricsStore(args.metrics_path) if args.metrics_path else MetricsStore()
+    if not args.port:
+        write_output(args.output, prometheus_text(store))
+        return 0
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text(store).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((args.host, args.port), MetricsHandler)
+    print(f"http://{args.host}:{args.port}/metrics で公開中（Ctrl+Cで終了）", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    """引数パーサーを作成"""
+    parser = argparse.ArgumentParser(prog='2chstory', description='プロ仕様 台本・プロット作成システム（コマンドライン版）')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--api-key', help='Gemini APIキー（省略時は環境変数 GEMINI_API_KEY）')
+    common.add_argument('--model', default=DEFAULT_MODEL_NAME, help='使用するモデル名（auto: タスクに応じて振り分け、429/5xx時は別モデルにフォールバック）')
+    common.add_argument('--no-cache', action='store_true', help='レスポンスキャッシュを使わない')
+    common.add_argument('--backend', choices=BACKENDS, help='生成に使うバックエンド（mock: APIを呼ばないスタブ。省略時は環境変数 STORY_BACKEND）')
+    bible_options = argparse.ArgumentParser(add_help=False)
+    bible_options.add_argument('--bible', metavar='ID', help='プロンプトに要約を差し込む設定資料のID（python -m story2ch bible list で確認）')
+    bible_options.add_argument('--bible-tokens', type=int, default=BIBLE_SUMMARY_TOKENS, help='設定資料の要約の上限トークン数')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', parents=[common, bible_options], help='1本生成する')
+    gen.add_argument('--type', required=True, choices=sorted(PROMPT_FUNCS), help='生成する内容の種類')
+    gen.add_argument('--theme', help='動画のテーマ')
+    gen.add_argument('--style', help='スタイル（省略時は種類ごとの先頭）。' + ' / '.join(f"{t}: {', '.join(styles)}" for t, styles in VIDEO_STYLES.items()))
+    gen.add_argument('--length', choices=VIDEO_LENGTHS, help='動画の長さ')
+    gen.add_argument('--pov', help='視点・語り手（例: 主人公）')
+    gen.add_argument('--genre', help='ジャンル（theme / plot）')
+    gen.add_argument('--keyword', help='キーワード（theme）')
+    gen.add_argument('--title', help='作品タイトル（plot）')
+    gen.add_argument('--input-file', help='プロット・チェック対象テキストなどの入力ファイル')
+    gen.add_argument('--param', action='append', type=parse_param, metavar='KEY=VALUE', help='プロンプトに渡す任意のパラメータ（複数指定可）')
+    gen.add_argument('--single-call', action='store_true', help='長編の章別並列生成・長文の分割校正・長編ネームのページ分割生成を使わず1回で生成する')
+    gen.add_argument('--no-precheck', action='store_true', help='基本チェックでもローカルチェックを使わず全文をAIに送る')
+    gen.add_argument('--records', help='ネームのページ分割生成で、ページごとの構造化データ（JSON）を書き出すファイル')
+    gen.add_argument('-o', '--output', help='出力ファイル（省略時は標準出力）')
+    gen.set_defaults(func=cmd_generate)
+
+    batch = subparsers.add_parser('batch', parents=[common, bible_options], help='CSV/JSONLのテーマ一覧から一括生成する')
+    batch.add_argument('file', help='テーマ一覧のCSV/JSONLファイル')
+    batch.add_argument('--type', default='sukatto', choices=sorted(VIDEO_PROMPT_FUNCS), help='type列が空の行に使う動画の種類')
+    batch.add_argument('--workers', type=int, default=4, help='同時実行数')
+    batch.add_argument('--rpm', type=int, default=10, help='1分あたりの最大リクエスト数')
+    batch.add_argument('--export', action='append', choices=list(EXPORT_FORMATS), help='台本ごとに字幕・TTS用のファイルもzipに追加する形式（複数指定可）')
+    batch.add_argument('-o', '--output', required=True, help='出力するzipファイル')
+    batch.set_defaults(func=cmd_batch)
+
+    pipeline = subparsers.add_parser('pipeline', parents=[common, bible_options], help='テーマ → プロット → 台本 → 校正 → 二次チェックを一括実行する')
+    pipeline.add_argument('--theme', help='テーマ（省略時はテーマ案を生成して --idea 番目を使う）')
+    pipeline.add_argument('--genre', help='ジャンル')
+    pipeline.add_argument('--keyword', help='テーマ案のキーワード')
+    pipeline.add_argument('--num-ideas', type=int, default=5, help='生成するテーマ案の数')
+    pipeline.add_argument('--idea', type=int, default=1, help='使用するテーマ案の番号（1始まり）')
+    pipeline.add_argument('--protagonist', help='主人公設定')
+    pipeline.add_argument('--worldview', help='世界観・設定')
+    pipeline.add_argument('--format', default='standard', help='台本形式（standard, screenplay, radio, youtube, 2ch-thread）')
+    pipeline.add_argument('--level', default='basic', choices=['basic', 'advanced', 'professional'], help='校正レベル')
+    pipeline.add_argument('--check', action='append', choices=sorted(SECONDARY_CHECK_LABELS), help='二次チェックの観点（複数指定可、省略時はすべて）')
+    pipeline.add_argument('--fresh', action='store_true', help='保存済みの段階を使わず最初から実行する')
+    pipeline.add_argument('-o', '--output', help='結果のJSONファイル（省略時は標準出力）')
+    pipeline.set_defaults(func=cmd_pipeline)
+
+    bible = subparsers.add_parser('bible', parents=[bible_options], help='設定資料（登場人物・世界観・プロット）の一覧・要約の表示・プロットの取り込み')
+    bible.add_argument('action', choices=['list', 'show', 'import'], help='list: 一覧 / show: --bibleの要約を表示 / import: --input-fileのプロットを取り込む（--bible未指定なら新規作成してIDを出力）')
+    bible.add_argument('--name', help='新規作成する設定資料の名前（省略時は入力ファイル名）')
+    bible.add_argument('--input-file', help='取り込むプロットのファイル')
+    bible.add_argument('-o', '--output', help='出力ファイル（省略時は標準出力）')
+    bible.set_defaults(func=cmd_bible)
+
+    export = subparsers.add_parser('export', help='台本を話者ごとの行に分け、SRT/VTT字幕・TTS用JSONL・CSVで書き出す')
+    export.add_argument('files', nargs='+', help='台本のテキストファイル（複数指定するとzipにまとめる）')
+    export.add_argument('--format', action='append', choices=list(EXPORT_FORMATS), help='書き出す形式（複数指定可、省略時はsrt）')
+    export.add_argument('--chars-per-minute', type=int, default=NARRATION_CHARS_PER_MINUTE, help='タイミングの推定に使う読み上げの速さ（1分あたりの文字数）')
+    export.add_argument('-o', '--output', help='出力ファイル（1本・1形式で省略時は標準出力、それ以外はzipファイル）')
+    export.set_defaults(func=cmd_export)
+
+    bench = subparsers.add_parser('bench', parents=[common], help='モックバックエンドでタブごとの処理時間・同時実行時のスループットを計測する')
+    bench.add_argument('--flow', action='append', choices=list(BENCH_FLOWS), help='計測する処理（複数指定可、省略時はすべて）')
+    bench.add_argument('--iterations', type=int, default=5, help='処理ごとの実行回数')
+    bench.add_argument('--sessions', default='1,4,16', help='同時実行数の一覧（カンマ区切り）')
+    bench.add_argument('--requests-per-session', type=int, default=3, help='同時実行の計測で1セッションあたりに実行する回数')
+    bench.add_argument('--mock-option', action='append', type=parse_mock_option, metavar='KEY=VALUE',
+                       help='スタブの設定（latency_sec, chunk_interval_sec, chunk_chars, output_chars, error_rate, truncate_rate, seed）')
+    bench.add_argument('-o', '--output', help='結果のJSONファイル（省略時は標準出力）')
+    bench.set_defaults(func=cmd_bench)
+
+    metrics = subparsers.add_parser('metrics', help='モデル呼び出しの計測結果をPrometheus形式で出力・公開する')
+    metrics.add_argument('--metrics-path', help='計測結果のSQLiteファイル（省略時は環境変数 STORY_METRICS_PATH または .story_cache/metrics.sqlite3）')
+    metrics.add_argument('--port', type=int, help='指定するとHTTPサーバーを起動して /metrics を公開する')
+    metrics.add_argument('--host', default='127.0.0.1', help='HTTPサーバーの待ち受けアドレス')
+    metrics.add_argument('-o', '--output', help='出力ファイル（--port未指定時、省略時は標準出力）')
+    metrics.set_defaults(func=cmd_metrics)
+    return parser
+
+def main(argv=None) -> int:
+    """コマンドラインのエントリーポイント"""
+    args = build_parser().parse_args(argv)
+    if getattr(args, 'backend', None):
+        os.environ[BACKEND_ENV] = args.backend
+    return args.func(args)
@@ -0,0 +1,113 @@
+"""Streamlitに依存しないGemini生成クライアント"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional
+
+from .budget import approximate_tokens, estimate_cost
+from .cache import ResponseCache, make_cache_key
+from .jobqueue import cancellable, raise_if_cancelled
+from .prompts import build_chapter_params, create_outline_prompt
+
+DEFAULT_MODEL_NAME = 'gemini-2.0-flash-exp'
+BACKEND_ENV = "STORY_BACKEND"
+BACKENDS = ['gemini', 'mock']
+
+def create_model(api_key: str, model_name: str = DEFAULT_MODEL_NAME, backend: Optional[str] = None):
+    """APIキーを設定してGenerativeModelを作成（SDKは必要になった時点で読み込む）
+
+    backend（省略時は環境変数STORY_BACKEND）が'mock'の場合はAPIを呼ばないオフライン計測用のスタブを返す。
+    """
+    backend = backend or os.environ.get(BACKEND_ENV) or 'gemini'
+    if backend == 'mock':
+        from .mock import MockModel
+        return MockModel(model_name)
+    if backend != 'gemini':
+        raise ValueError(f"不明なバックエンドです: {backend}")
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
+def response_token_count(response) -> int:
+    """レスポンスのusage_metadataから合計トークン数を取得"""
+    if hasattr(response, 'usage_metadata') and response.usage_metadata:
+        return response.usage_metadata.total_token_count
+    return 0
+
+def make_usage(model_name: str = '', input_tokens: int = 0, output_tokens: int = 0, total_tokens: Optional[int] = None, cached_tokens: int = 0) -> Dict:
+    """入力・出力トークン数と料金をまとめた使用量を作成"""
+    return {'tokens': total_tokens if total_tokens is not None else input_tokens + output_tokens,
+            'input_tokens': input_tokens, 'output_tokens': output_tokens, 'cost': estimate_cost(model_name, input_tokens, output_tokens, cached_tokens)}
+
+def response_usage(response, model_name: str) -> Dict:
+    """レスポンスのusage_metadataから使用量を作成（フォールバックで別のモデルが応答した場合はそのモデルの単価で計算）"""
+    model_name = getattr(response, 'served_model', None) or model_name
+    metadata = getattr(response, 'usage_metadata', None)
+    if not metadata:
+        return make_usage()
+    return make_usage(model_name, metadata.prompt_token_count or 0, metadata.candidates_token_count or 0, metadata.total_token_count,
+                      getattr(metadata, 'cached_content_token_count', 0) or 0)
+
+def partial_usage(response, model_name: str, prompt: str, text: str) -> Dict:
+    """途中で打ち切ったストリーミングの使用量（受信済みのusage_metadataに出力トークン数がなければ、プロンプトと受信した本文から概算）"""
+    usage = response_usage(response, model_name)
+    if usage['output_tokens']:
+        return usage
+    model_name = getattr(response, 'served_model', None) or model_name
+    return make_usage(model_name, usage['input_tokens'] or approximate_tokens(str(prompt)), approximate_tokens(text))
+
+def add_usage(*usages: Dict) -> Dict:
+    """複数の使用量を合計"""
+    return {key: sum(usage[key] for usage in usages) for key in ('tokens', 'input_tokens', 'output_tokens', 'cost')}
+
+def cached_generate(model, prompt: str, cache: Optional[ResponseCache], read_cache: bool = True, limiter=None):
+    """キャッシュを確認してから生成し、(本文, 使用量, ヒット有無)を返す（スレッドセーフ）"""
+    key = make_cache_key(model, prompt)
+    cached = cache.get(key) if cache and read_cache else None
+    if cached:
+        if hasattr(model, 'record_cache_hit'):
+            model.record_cache_hit(prompt)
+        return cached['text'], make_usage(), True
+    if limiter:
+        started = time.perf_counter()
+        limiter.acquire()
+        if hasattr(model, 'note'):
+            model.note(queue_ms=(time.perf_counter() - started) * 1000)
+    response = model.generate_content(prompt)
+    text, usage = response.text, response_usage(response, getattr(model, 'model_name', ''))
+    if cache:
+        cache.put(key, text, usage['tokens'])
+    return text, usage, False
+
+def generate_chapter(model, prompt_func, params, cache, read_cache):
+    """1章分を生成し、本文・使用量・キャッシュヒット有無を返す（ワーカースレッドで実行）"""
+    text, usage, hit = cached_generate(model, prompt_func(params), cache, read_cache)
+    return text.strip(), usage, hit
+
+def generate_chaptered(model, prompt_func, params: Dict, cache: Optional[ResponseCache] = None, read_cache: bool = True,
+                       on_progress: Optional[Callable[[int, int], None]] = None, cancelled: Optional[threading.Event] = None) -> Dict:
+    """アウトライン生成後、5章を並列に生成して1本の台本に結合する
+
+    on_progress(完了章数, 全章数)はアウトライン完了時と各章の完了時に呼び出し元スレッドで呼ばれる。
+    cancelledがセットされると、まだ始まっていない章は生成せずにJobCancelledを送出する。
+    """
+    raise_if_cancelled(cancelled)
+    outline, total_usage, hit = cached_generate(model, create_outline_prompt({'prompt_func': prompt_func, 'params': params}), cache, read_cache)
+    hits = [hit]
+
+    chapter_params = build_chapter_params(params, outline)
+    chapters = [""] * len(chapter_params)
+    if on_progress: on_progress(0, len(chapter_params))
+    with ThreadPoolExecutor(max_workers=len(chapter_params)) as executor:
+        futures = {executor.submit(cancellable(generate_chapter, cancelled), model, prompt_func, p, cache, read_cache): p['chapter']['index'] for p in chapter_params}
+        for done, future in enumerate(as_completed(futures), start=1):
+            raise_if_cancelled(cancelled)
+            text, usage, hit = future.result()
+            chapters[futures[future]] = text
+            total_usage = add_usage(total_usage, usage)
+            hits.append(hit)
+            if on_progress: on_progress(done, len(chapter_params))
+
+    return {'text': "\n\n".join(chapters), 'outline': outline, **total_usage,
+            'cache_hits': sum(hits), 'cache_misses': len(hits) - sum(hits)}
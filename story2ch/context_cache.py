@@ -0,0 +1,172 @@
+"""プロンプトの固定部分（prefix）をGeminiのコンテキストキャッシュに登録し、同じ原稿・指示の繰り返し送信を減らす"""
+import time
+import hashlib
+import threading
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from .budget import approximate_tokens
+from .client import create_model
+
+# Geminiのコンテキストキャッシュに登録できる最小トークン数（これより短い固定部分は通常どおり毎回送る）
+CONTEXT_CACHE_MIN_TOKENS = 4096
+CONTEXT_CACHE_TTL_SECONDS = 10 * 60
+# 一時的なエラー（429・通信エラーなど）で登録できなかったモデルは、この秒数だけ登録を試さない
+CONTEXT_CACHE_RETRY_SECONDS = 60
+# コンテキストキャッシュ非対応（SDKにcachingがない・モデルが対応していない）を示すエラー
+UNSUPPORTED_ERROR_NAMES = {'MethodNotImplemented', 'NotImplementedError', 'ImportError', 'ModuleNotFoundError'}
+# その固定部分だけが登録を断られたことを示すエラー（実際のトークン数が最小に足りないなど）
+REJECTED_ERROR_NAMES = {'InvalidArgument'}
+# 登録済みのキャッシュが期限切れ・削除済みで使えないことを示すエラー
+CACHE_INVALID_ERROR_NAMES = {'NotFound'}
+
+def error_code(error: Exception):
+    """APIエラーのHTTPステータス（なければNone）"""
+    try:
+        return int(getattr(error, 'code', None))
+    except (TypeError, ValueError):
+        return None
+
+def is_caching_unsupported(error: Exception) -> bool:
+    """コンテキストキャッシュの登録失敗が、再試行しても直らないモデル・SDKの非対応によるものか"""
+    return type(error).__name__ in UNSUPPORTED_ERROR_NAMES or error_code(error) == 501
+
+def is_prefix_rejected(error: Exception) -> bool:
+    """コンテキストキャッシュの登録失敗が、その固定部分だけの問題（APIの数えたトークン数が最小に足りないなど）によるものか
+
+    approximate_tokensは日本語を1文字1トークンと多めに数えるため、手元の判定を通っても登録を断られることがある。
+    """
+    return type(error).__name__ in REJECTED_ERROR_NAMES or error_code(error) == 400
+
+def is_cache_invalid(error: Exception) -> bool:
+    """生成の失敗が、登録済みのキャッシュが使えなくなったこと（期限切れ・削除済み・不正）によるものか"""
+    if type(error).__name__ in CACHE_INVALID_ERROR_NAMES or error_code(error) == 404:
+        return True
+    message = str(error).lower()
+    return (type(error).__name__ in ('InvalidArgument', 'FailedPrecondition') or error_code(error) in (400, 412)) and 'cache' in message
+
+def create_cached_model(model_name: str, prefix: str, ttl_seconds: int):
+    """固定部分をコンテキストキャッシュに登録し、それを前提にしたGenerativeModelを作成（SDKは必要になった時点で読み込む）"""
+    import google.generativeai as genai
+    from google.generativeai import caching
+    name = model_name if model_name.startswith('models/') else f"models/{model_name}"
+    cached = caching.CachedContent.create(model=name, contents=[prefix], ttl=timedelta(seconds=ttl_seconds))
+    return genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+class ContextCache:
+    """モデル名と固定部分のハッシュごとにコンテキストキャッシュを再利用する（プロセス全体で共有、スレッドセーフ）
+
+    並列の二次チェックのように同じ固定部分が同時に送られても登録は1回にまとめる。
+    コンテキストキャッシュ非対応のモデルは以後このキャッシュを使わない。登録を断られた固定部分はキャッシュのTTLの間だけその固定部分の登録を試さず、
+    一時的なエラーで登録できなかったモデルはCONTEXT_CACHE_RETRY_SECONDS秒だけ登録を試さない。
+    """
+
+    def __init__(self, min_tokens: int = CONTEXT_CACHE_MIN_TOKENS, ttl_seconds: int = CONTEXT_CACHE_TTL_SECONDS,
+                 model_factory: Optional[Callable] = None, clock: Optional[Callable[[], float]] = None, retry_seconds: float = CONTEXT_CACHE_RETRY_SECONDS):
+        self.min_tokens = min_tokens
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self._model_factory = model_factory or create_cached_model
+        self._clock = clock or time.monotonic
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}
+        self._unsupported = set()
+        self._retry_after = {}
+        self._rejected = {}
+        self.hits = 0
+        self.created = 0
+        self.reused_tokens = 0
+
+    @staticmethod
+    def make_key(model_name: str, prefix: str) -> str:
+        """モデル名と固定部分からキーを作成"""
+        return hashlib.sha256(f"{model_name}\n{prefix}".encode('utf-8')).hexdigest()
+
+    def model_for(self, model_name: str, prefix: str):
+        """固定部分を登録済みのモデルを取得（短すぎる・非対応・登録失敗の場合はNone）"""
+        tokens = approximate_tokens(prefix)
+        if tokens < self.min_tokens:
+            return None
+        key = self.make_key(model_name, prefix)
+        with self._lock:
+            now = self._clock()
+            if model_name in self._unsupported or self._retry_after.get(model_name, 0) > now or self._rejected.get(key, 0) > now:
+                return None
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                # 期限ぎりぎりのキャッシュは生成中に切れる可能性があるため、残り1分を切ったら作り直す
+                if entry and entry['expires_at'] - self._clock() > 60:
+                    self.hits += 1
+                    self.reused_tokens += tokens
+                    return entry['model']
+            try:
+                cached_model = self._model_factory(model_name, prefix, self.ttl_seconds)
+            except Exception as e:
+                with self._lock:
+                    if is_caching_unsupported(e):
+                        self._unsupported.add(model_name)
+                    elif is_prefix_rejected(e):
+                        self._rejected[key] = self._clock() + self.ttl_seconds
+                        self._evict()
+                    else:
+                        self._retry_after[model_name] = self._clock() + self.retry_seconds
+                return None
+            with self._lock:
+                self._entries[key] = {'model': cached_model, 'expires_at': self._clock() + self.ttl_seconds}
+                self.created += 1
+                self._evict()
+            return cached_model
+
+    def discard(self, model_name: str, prefix: str):
+        """登録済みのキャッシュを使わないようにする（サーバー側で期限切れ・削除された場合など）"""
+        with self._lock:
+            self._entries.pop(self.make_key(model_name, prefix), None)
+
+    def _evict(self):
+        """期限切れのエントリを削除"""
+        now = self._clock()
+        for key in [key for key, entry in self._entries.items() if entry['expires_at'] <= now]:
+            del self._entries[key]
+            self._key_locks.pop(key, None)
+        for key in [key for key, until in self._rejected.items() if until <= now]:
+            del self._rejected[key]
+
+    def stats(self) -> Dict:
+        """登録数・再利用回数・再利用した固定部分の概算トークン数"""
+        with self._lock:
+            return {'entries': len(self._entries), 'created': self.created, 'hits': self.hits, 'reused_tokens': self.reused_tokens}
+
+class ContextCachedModel:
+    """プロンプトに固定部分があればコンテキストキャッシュを使い、残りの部分だけを送るGenerativeModelのラッパー"""
+
+    def __init__(self, model, context_cache: ContextCache):
+        self.model = model
+        self.context_cache = context_cache
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_content(self, prompt, **kwargs):
+        """固定部分が登録済み（または登録できた）なら残りだけを送って生成"""
+        prefix = getattr(prompt, 'prefix', '')
+        cached_model = self.context_cache.model_for(getattr(self.model, 'model_name', ''), prefix) if prefix else None
+        if cached_model is None:
+            return self.model.generate_content(prompt, **kwargs)
+        try:
+            return cached_model.generate_content(prompt[len(prefix):], **kwargs)
+        except Exception as e:
+            # 429・5xxなどはそのまま投げ、再試行・フォールバックはModelRouterに任せる
+            if not is_cache_invalid(e):
+                raise
+            # サーバー側で期限切れ・削除されたキャッシュだけは、登録を破棄して全文で送り直す
+            self.context_cache.discard(getattr(self.model, 'model_name', ''), prefix)
+            return self.model.generate_content(prompt, **kwargs)
+
+def context_cached_factory(context_cache: ContextCache) -> Callable:
+    """ModelRouterのmodel_factoryに渡す、コンテキストキャッシュ付きのモデルを作成する関数"""
+    def factory(api_key: str, model_name: str):
+        return ContextCachedModel(create_model(api_key, model_name), context_cache)
+    return factory
@@ -0,0 +1,212 @@
+"""台本の書き出し（話者ごとの行に分け、推定タイミング付きのSRT/VTT字幕・TTS用のJSONL・CSVを、台本を1回走査しながら少しずつ書き出す）"""
+import io
+import re
+import csv
+import json
+import zipfile
+from collections import Counter
+from typing import Dict, Iterable, Iterator, Optional
+
+from .stats import HEADING_PATTERN, NARRATION_CHARS_PER_MINUTE, NON_SPEAKER_LABELS, QUOTE_PATTERN, RUBY_PATTERN, SILENT_PATTERN
+
+NARRATION_SPEAKER = 'ナレーション'
+TELOP_SPEAKER = 'テロップ'
+# 話者名のない「…」だけの行（セリフだが誰の発言かは台本から分からない）
+UNKNOWN_SPEAKER = '話者不明'
+# 1行あたりの最短表示時間・行間の間（秒）
+MIN_SEGMENT_SEC = 1.0
+PAUSE_SEC = 0.3
+# 字幕1枚あたりの最大文字数と1行の文字数（これより長い行は文の区切りで複数の字幕に分け、1枚は2行までにする）
+CAPTION_MAX_CHARS = 48
+CAPTION_LINE_CHARS = 24
+# 行頭に置かない文字（句読点・閉じ括弧など）
+LINE_START_FORBIDDEN = '、。，．！？!?」』）)ーっゃゅょ…'
+
+# 「スレ主: 」「住民A：」「語り手（主人公）: 」「【テロップ】: 」のような話者付きの行（括弧内は役割）
+EXPORT_SPEAKER_PATTERN = re.compile(r'^\s*\**([^\s:：「」『』（）()、。]{1,20}?)\s*(?:[（(]([^）)\n]{1,20})[）)])?\**\s*[:：]\s*(.*)$')
+SENTENCE_END_PATTERN = re.compile(r'(?<=[。！？!?」』])')
+MARKDOWN_PATTERN = re.compile(r'\*\*|__')
+
+def strip_quotes(body: str) -> str:
+    """セリフを囲む「」『』とMarkdownの強調を取り除く"""
+    body = MARKDOWN_PATTERN.sub('', body).strip()
+    if len(body) >= 2 and body[0] in '「『' and body[-1] in '」』':
+        body = body[1:-1].strip()
+    return body
+
+def parse_line(line: str) -> Optional[Dict]:
+    """1行を話者・種類・本文に分ける（空行・見出しはNone）"""
+    if not line.strip() or HEADING_PATTERN.match(line):
+        return None
+    match = EXPORT_SPEAKER_PATTERN.match(line)
+    if match and match.group(1) not in NON_SPEAKER_LABELS:
+        speaker, role, body = match.group(1), match.group(2) or '', match.group(3)
+        if speaker.startswith('【') and speaker.endswith('】'):
+            return {'speaker': TELOP_SPEAKER, 'role': speaker.strip('【】'), 'kind': 'telop', 'body': strip_quotes(body)}
+        return {'speaker': speaker, 'role': role, 'kind': 'dialogue', 'body': strip_quotes(body)}
+    match = QUOTE_PATTERN.match(line)
+    if match:
+        return {'speaker': match.group(1) or UNKNOWN_SPEAKER, 'role': '', 'kind': 'dialogue', 'body': match.group(2).strip()}
+    return {'speaker': NARRATION_SPEAKER, 'role': '', 'kind': 'narration', 'body': strip_quotes(line)}
+
+def display_text(body: str) -> str:
+    """字幕に表示する本文（ルビは親文字だけにする）"""
+    return RUBY_PATTERN.sub(lambda m: m.group(0).split('《')[0].lstrip('｜|'), body)
+
+def speech_text(body: str) -> str:
+    """TTSに読ませる本文（ルビは読みにする）"""
+    return RUBY_PATTERN.sub(lambda m: m.group(0).split('《')[1].rstrip('》'), body)
+
+def iter_segments(lines: Iterable[str], chars_per_minute: int = NARRATION_CHARS_PER_MINUTE) -> Iterator[Dict]:
+    """台本の行を順に読み、話者ごとの行（開始・終了の推定秒数付き）を1つずつ返す（全文を読み込まない）"""
+    clock, index, section = 0.0, 0, ''
+    for line in lines:
+        line = line.rstrip('\r\n')
+        parsed = parse_line(line)
+        if parsed is None:
+            if line.strip():
+                section = line.strip(' \t　#*■━=-【】')
+            continue
+        text = display_text(parsed['body'])
+        if not text:
+            continue
+        speech = speech_text(parsed['body'])
+        spoken_chars = len(SILENT_PATTERN.sub('', speech))
+        duration = max(MIN_SEGMENT_SEC, spoken_chars / chars_per_minute * 60)
+        index += 1
+        yield {'index': index, 'speaker': parsed['speaker'], 'role': parsed['role'], 'kind': parsed['kind'], 'section': section,
+               'text': text, 'speech': speech if parsed['kind'] != 'telop' else '', 'start': round(clock, 3), 'end': round(clock + duration, 3)}
+        clock += duration + PAUSE_SEC
+
+def caption_chunks(text: str, max_chars: int = CAPTION_MAX_CHARS) -> list:
+    """長い行を文の区切り（文が長すぎる場合は文字数）でmax_chars文字以内の字幕に分ける"""
+    chunks, current = [], ''
+    for sentence in SENTENCE_END_PATTERN.split(text):
+        while len(sentence) > max_chars:
+            if current:
+                chunks.append(current); current = ''
+            chunks.append(sentence[:max_chars]); sentence = sentence[max_chars:]
+        if len(current) + len(sentence) > max_chars:
+            chunks.append(current); current = ''
+        current += sentence
+    if current.strip():
+        chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+def wrap_caption(chunk: str) -> str:
+    """字幕1枚分を、句読点が行頭に来ないようにして半分ずつの2行に折り返す"""
+    if len(chunk) <= CAPTION_LINE_CHARS:
+        return chunk
+    cut = (len(chunk) + 1) // 2
+    while cut < len(chunk) and chunk[cut] in LINE_START_FORBIDDEN:
+        cut += 1
+    return chunk[:cut] + "\n" + chunk[cut:] if cut < len(chunk) else chunk
+
+def segment_cues(segment: Dict) -> Iterator[tuple]:
+    """1行分の字幕（開始秒, 終了秒, 表示する文）を、文字数の割合で時間を分けて返す"""
+    chunks = caption_chunks(segment['text'])
+    total = sum(len(chunk) for chunk in chunks)
+    start, length = segment['start'], segment['end'] - segment['start']
+    for chunk in chunks:
+        end = start + length * len(chunk) / total
+        yield start, end, wrap_caption(chunk)
+        start = end
+
+def format_timestamp(seconds: float, separator: str) -> str:
+    """秒数を「hh:mm:ss,mmm」（VTTは「.」）にする"""
+    millis = int(round(seconds * 1000))
+    return f"{millis // 3_600_000:02d}:{millis // 60_000 % 60:02d}:{millis // 1000 % 60:02d}{separator}{millis % 1000:03d}"
+
+def escape_vtt(text: str) -> str:
+    """WebVTTの字幕文で特別な意味を持つ文字を置き換える"""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+# ===============================================================================
+# 形式ごとの書き出し（開いた出力先に1行ずつ書き込む）
+# ===============================================================================
+class SrtWriter:
+    """SRT字幕"""
+
+    def __init__(self, out):
+        self.out = out
+        self.count = 0
+
+    def write(self, segment: Dict):
+        for start, end, text in segment_cues(segment):
+            self.count += 1
+            self.out.write(f"{self.count}\n{format_timestamp(start, ',')} --> {format_timestamp(end, ',')}\n{text}\n\n")
+
+class VttWriter:
+    """WebVTT字幕（話者は<v>タグで付ける。話者不明のセリフには付けない）"""
+
+    def __init__(self, out):
+        self.out = out
+        self.out.write("WEBVTT\n\n")
+
+    def write(self, segment: Dict):
+        voice = f"<v {escape_vtt(segment['speaker'])}>" if segment['kind'] == 'dialogue' and segment['speaker'] != UNKNOWN_SPEAKER else ''
+        for start, end, text in segment_cues(segment):
+            self.out.write(f"{format_timestamp(start, '.')} --> {format_timestamp(end, '.')}\n{voice}{escape_vtt(text)}\n\n")
+
+class JsonlWriter:
+    """TTS用のJSONL（1行に1つの発話。テロップはspeechが空）"""
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, segment: Dict):
+        self.out.write(json.dumps(segment, ensure_ascii=False) + "\n")
+
+class CsvWriter:
+    """話者ごとの行の一覧（表計算ソフト用）"""
+    COLUMNS = ['index', 'speaker', 'role', 'kind', 'section', 'start', 'end', 'text', 'speech']
+
+    def __init__(self, out):
+        self.writer = csv.DictWriter(out, fieldnames=self.COLUMNS)
+        self.writer.writeheader()
+
+    def write(self, segment: Dict):
+        self.writer.writerow(segment)
+
+EXPORT_FORMATS = {
+    'srt': {'label': 'SRT字幕', 'ext': 'srt', 'mime': 'application/x-subrip', 'writer': SrtWriter},
+    'vtt': {'label': 'WebVTT字幕', 'ext': 'vtt', 'mime': 'text/vtt', 'writer': VttWriter},
+    'jsonl': {'label': 'TTS用JSONL', 'ext': 'jsonl', 'mime': 'application/x-ndjson', 'writer': JsonlWriter},
+    'csv': {'label': '話者ごとの行（CSV）', 'ext': 'csv', 'mime': 'text/csv', 'writer': CsvWriter},
+}
+
+def export_script(lines: Iterable[str], outputs: Dict[str, object], chars_per_minute: int = NARRATION_CHARS_PER_MINUTE) -> Dict:
+    """台本を1回走査して、形式ごとの出力先（{'srt': ファイル, ...}）に同時に書き出し、行数・長さ・話者ごとの行数を返す"""
+    writers = [EXPORT_FORMATS[fmt]['writer'](out) for fmt, out in outputs.items()]
+    count, duration, speakers = 0, 0.0, Counter()
+    for segment in iter_segments(lines, chars_per_minute):
+        for writer in writers:
+            writer.write(segment)
+        count, duration = count + 1, segment['end']
+        speakers[segment['speaker']] += 1
+    return {'segments': count, 'duration_sec': round(duration, 1), 'speakers': dict(speakers.most_common())}
+
+def export_text(text: str, fmt: str, chars_per_minute: int = NARRATION_CHARS_PER_MINUTE) -> str:
+    """1つの台本を1つの形式で書き出した文字列"""
+    out = io.StringIO(newline='')
+    export_script(io.StringIO(text), {fmt: out}, chars_per_minute)
+    return out.getvalue()
+
+def write_script_exports(archive: zipfile.ZipFile, name: str, text: str, formats: Iterable[str],
+                         chars_per_minute: int = NARRATION_CHARS_PER_MINUTE) -> Dict:
+    """1つの台本を指定した形式でzipに追加する（台本1本分ずつ書き出すため、本数が多くてもメモリは増えない）"""
+    buffers = {fmt: io.StringIO(newline='') for fmt in formats}
+    summary = export_script(io.StringIO(text), buffers, chars_per_minute)
+    for fmt, buffer in buffers.items():
+        archive.writestr(f"{name}.{EXPORT_FORMATS[fmt]['ext']}", buffer.getvalue())
+    return summary
+
+def write_export_zip(scripts: Iterable[tuple], formats: Iterable[str], fileobj, chars_per_minute: int = NARRATION_CHARS_PER_MINUTE) -> list:
+    """(名前, 本文)の組を順に読み、形式ごとのファイルとmanifest.jsonをzipに書き出す（fileobjはファイルまたはバッファ）"""
+    formats, manifest = list(formats), []
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, text in scripts:
+            manifest.append({'name': name, 'files': [f"{name}.{EXPORT_FORMATS[fmt]['ext']}" for fmt in formats],
+                             **write_script_exports(archive, name, text, formats, chars_per_minute)})
+        archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
@@ -0,0 +1,95 @@
+"""生成履歴のSQLiteストア（本文はzlib圧縮、FTS5のtrigramで日本語全文検索）"""
+import os
+import time
+import zlib
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Optional
+
+HISTORY_PATH = os.environ.get("STORY_HISTORY_PATH", os.path.join(".story_cache", "history.sqlite3"))
+PREVIEW_CHARS = 200
+SUMMARY_COLUMNS = "id, session_id, type, timestamp, preview, size"
+
+class HistoryStore:
+    """生成履歴を種類・日時・セッションで索引付けして保存する（一覧はプレビューのみ、本文は必要な時に取得）"""
+
+    def __init__(self, path: str = HISTORY_PATH):
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, type TEXT NOT NULL,
+            created_at REAL NOT NULL, timestamp TEXT NOT NULL, preview TEXT NOT NULL, size INTEGER NOT NULL, content BLOB NOT NULL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_session ON history (session_id, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_type ON history (type, created_at)")
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(body, content='', tokenize='trigram')")
+            self.full_text_search = True
+        except sqlite3.OperationalError:
+            # FTS5・trigramが使えないSQLiteではプレビューの部分一致検索で代用する
+            self.full_text_search = False
+        self._conn.commit()
+
+    def add(self, session_id: str, content_type: str, content: str) -> int:
+        """履歴を追加してIDを返す"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO history (session_id, type, created_at, timestamp, preview, size, content) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, content_type, time.time(), datetime.now().strftime("%Y/%m/%d %H:%M"), content[:PREVIEW_CHARS],
+                 len(content), zlib.compress(content.encode('utf-8'))))
+            if self.full_text_search:
+                self._conn.execute("INSERT INTO history_fts (rowid, body) VALUES (?, ?)", (cursor.lastrowid, content))
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def recent(self, session_id: Optional[str] = None, content_type: Optional[str] = None, limit: int = 5, offset: int = 0) -> list:
+        """新しい順に履歴の概要（本文なし）を取得"""
+        conditions, values = [], []
+        if session_id:
+            conditions.append("session_id = ?"); values.append(session_id)
+        if content_type:
+            conditions.append("type = ?"); values.append(content_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {SUMMARY_COLUMNS} FROM history {where} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+                                      (*values, limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, session_id: Optional[str] = None) -> int:
+        """履歴の件数を取得"""
+        with self._lock:
+            if session_id:
+                return self._conn.execute("SELECT COUNT(*) FROM history WHERE session_id = ?", (session_id,)).fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def get_content(self, history_id: int) -> Optional[str]:
+        """履歴の本文を取得"""
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM history WHERE id = ?", (history_id,)).fetchone()
+        return zlib.decompress(row['content']).decode('utf-8') if row else None
+
+    def latest_content(self, content_type: str, session_id: Optional[str] = None) -> Optional[str]:
+        """指定した種類の最新の本文を取得"""
+        items = self.recent(session_id, content_type, limit=1)
+        return self.get_content(items[0]['id']) if items else None
+
+    def search(self, query: str, session_id: Optional[str] = None, limit: int = 20) -> list:
+        """本文を全文検索して概要を新しい順に取得（trigramのため3文字未満はプレビューの部分一致）"""
+        query = query.strip()
+        if not query:
+            return []
+        session_filter, values = ("AND h.session_id = ?", [session_id]) if session_id else ("", [])
+        with self._lock:
+            if self.full_text_search and len(query) >= 3:
+                phrase = '"' + query.replace('"', '""') + '"'
+                rows = self._conn.execute(
+                    f"SELECT {', '.join('h.' + c.strip() for c in SUMMARY_COLUMNS.split(','))} FROM history_fts f JOIN history h ON h.id = f.rowid "
+                    f"WHERE history_fts MATCH ? {session_filter} ORDER BY h.created_at DESC LIMIT ?", (phrase, *values, limit)).fetchall()
+            else:
+                rows = self._conn.execute(
+                    f"SELECT {SUMMARY_COLUMNS} FROM history h WHERE preview LIKE ? {session_filter} ORDER BY created_at DESC LIMIT ?",
+                    (f"%{query}%", *values, limit)).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,379 @@
+"""プロセス全体で共有するジョブキュー（RPM・TPMのトークンバケット、優先度クラス、ユーザーごとの公平な順番、ワーカープール）
+
+JobStoreを渡すとジョブの状態と結果をSQLiteに保存し、再読み込み・再接続後も同じIDで結果を受け取れる。
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+QUEUE_WORKERS = int(os.environ.get("STORY_QUEUE_WORKERS", "4"))
+QUEUE_RPM = int(os.environ.get("STORY_QUEUE_RPM", "30"))
+QUEUE_TPM = int(os.environ.get("STORY_QUEUE_TPM", "1000000"))
+JOBS_PATH = os.environ.get("STORY_JOBS_PATH", os.path.join(".story_cache", "jobs.sqlite3"))
+# 受け取り済み・終了したジョブの記録を残す期間
+JOBS_RETENTION_SECONDS = 7 * 24 * 60 * 60
+# 優先度クラス（値が小さいほど先に実行。同じクラスの中ではユーザーごとに順番に取り出す）
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_LABELS = {INTERACTIVE: '対話', BATCH: '一括'}
+UNFINISHED_STATUSES = ('待機中', 'レート制限待ち', '実行中')
+USAGE_KEYS = ('tokens', 'input_tokens', 'output_tokens', 'cost')
+
+class JobCancelled(Exception):
+    """中止されたジョブ（実行前、または分割生成の呼び出しの合間に中止された）"""
+
+def raise_if_cancelled(cancelled: Optional[threading.Event]):
+    """中止が要求されていればJobCancelledを送出（分割生成の各呼び出しの前と、各呼び出しの完了時に呼ぶ）"""
+    if cancelled is not None and cancelled.is_set():
+        raise JobCancelled("生成中に中止されました")
+
+def cancellable(func: Callable, cancelled: Optional[threading.Event]) -> Callable:
+    """呼び出す前に中止を確認する関数にする（並列に投入した呼び出しのうち、まだ始まっていないものを打ち切る）"""
+    def run(*args, **kwargs):
+        raise_if_cancelled(cancelled)
+        return func(*args, **kwargs)
+    return run
+
+class TokenBucket:
+    """1分あたりのリクエスト数（RPM）とトークン数（TPM）を制限するトークンバケット（0は無制限、複数スレッドから共有可能）
+
+    実際の使用量が見積もりより多かった場合はadjust()で差分を引き、以後の取得を遅らせる。
+    """
+
+    def __init__(self, requests_per_minute: int = QUEUE_RPM, tokens_per_minute: int = QUEUE_TPM,
+                 clock: Optional[Callable[[], float]] = None, sleep: Optional[Callable[[float], None]] = None):
+        self.capacity = {'requests': float(requests_per_minute), 'tokens': float(tokens_per_minute)}
+        self._clock = clock or time.monotonic
+        self._sleep = sleep or time.sleep
+        self._lock = threading.Lock()
+        self._levels = dict(self.capacity)
+        self._updated = self._clock()
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._updated
+        self._updated = now
+        for name, capacity in self.capacity.items():
+            if capacity > 0:
+                self._levels[name] = min(capacity, self._levels[name] + elapsed * capacity / 60)
+
+    def _wait_seconds(self, amounts: Dict[str, float]) -> float:
+        """amountsを取得できるまでの秒数（呼び出し側でロックを取得済み）"""
+        wait = 0.0
+        for name, amount in amounts.items():
+            capacity = self.capacity[name]
+            if capacity > 0 and self._levels[name] < amount:
+                wait = max(wait, (amount - self._levels[name]) * 60 / capacity)
+        return wait
+
+    def try_acquire(self, requests: int = 1, tokens: int = 0) -> float:
+        """待たずに取得を試みる（取得できたら消費して0、できなければ取得できるまでの秒数を返す）"""
+        # 1回で容量を超える要求は、容量いっぱいまで貯まるのを待てば通す
+        amounts = {name: min(float(amount), self.capacity[name]) if self.capacity[name] > 0 else 0.0
+                   for name, amount in (('requests', requests), ('tokens', tokens))}
+        with self._lock:
+            self._refill()
+            wait = self._wait_seconds(amounts)
+            if wait <= 0:
+                for name, amount in amounts.items():
+                    self._levels[name] -= amount
+            return max(wait, 0.0)
+
+    def acquire(self, requests: int = 1, tokens: int = 0, cancelled: Optional[threading.Event] = None) -> bool:
+        """取得できるまで待機して消費（cancelledがセットされたらFalseを返して中止）"""
+        while True:
+            wait = self.try_acquire(requests, tokens)
+            if wait <= 0:
+                return True
+            if cancelled is not None and cancelled.is_set():
+                return False
+            self._sleep(min(wait, 1.0))
+
+    def adjust(self, tokens: int):
+        """見積もりと実際の使用量の差分（正なら追加で消費、負なら返却）を反映"""
+        with self._lock:
+            self._refill()
+            if self.capacity['tokens'] > 0:
+                self._levels['tokens'] = min(self.capacity['tokens'], self._levels['tokens'] - tokens)
+
+    def levels(self) -> Dict:
+        """現在の残量"""
+        with self._lock:
+            self._refill()
+            return {name: round(level, 1) for name, level in self._levels.items()}
+
+class Job:
+    """キューに投入された1件の処理（futureで結果を受け取り、partial・progressで途中経過を共有する）"""
+
+    def __init__(self, func: Callable, user: str, priority: int, requests: int, tokens: int, label: str = '', persist: bool = False):
+        self.id = uuid.uuid4().hex
+        self.persist = persist
+        self.func = func
+        self.user = user
+        self.priority = priority
+        self.requests = requests
+        self.tokens = tokens
+        self.label = label
+        self.future = Future()
+        self.cancelled = threading.Event()
+        self.status = '待機中'
+        self.partial = ""
+        self.progress = None
+        self.submitted_at = time.time()
+        self.started_at = None
+
+    def update(self, partial: Optional[str] = None, progress: Optional[tuple] = None):
+        """途中経過（ストリーミング中の本文・(完了数, 全体数)）を更新（ワーカースレッドから呼ぶ）"""
+        if partial is not None:
+            self.partial = partial
+        if progress is not None:
+            self.progress = progress
+
+    def cancel(self):
+        """中止を要求（待機中なら実行せず、実行中なら処理側がcancelledを見て打ち切る）"""
+        self.cancelled.set()
+
+    def result(self, timeout: Optional[float] = None):
+        """完了まで待って結果を返す（失敗した場合は例外を送出）"""
+        return self.future.result(timeout)
+
+class JobStore:
+    """ジョブの状態と結果（JSON）をSQLiteに保存する（ブラウザの再接続後に結果を受け取るため）"""
+
+    def __init__(self, path: str = JOBS_PATH, retention_seconds: int = JOBS_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, user TEXT NOT NULL, label TEXT NOT NULL, status TEXT NOT NULL, submitted_at REAL NOT NULL,
+            updated_at REAL NOT NULL, result TEXT, error TEXT, delivered INTEGER NOT NULL DEFAULT 0)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user, delivered, submitted_at)")
+        self._conn.commit()
+
+    def save(self, job: Job, result=None, error: Optional[str] = None):
+        """ジョブの状態（完了時は結果・エラー）を保存"""
+        with self._lock:
+            self._conn.execute("""INSERT INTO jobs (id, user, label, status, submitted_at, updated_at, result, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at,
+                result = COALESCE(excluded.result, jobs.result), error = COALESCE(excluded.error, jobs.error)""",
+                               (job.id, job.user, job.label, job.status, job.submitted_at, time.time(),
+                                json.dumps(result, ensure_ascii=False) if result is not None else None, error))
+            self._conn.commit()
+
+    def load(self, job_id: str) -> Optional[Dict]:
+        """ジョブの記録を取得（resultは復元済み）"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record['result'] = json.loads(record['result']) if record['result'] else None
+        return record
+
+    def pending(self, user: str) -> list:
+        """まだ結果を受け取っていないユーザーのジョブを新しい順に取得（結果は含まない）"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, label, status, submitted_at FROM jobs WHERE user = ? AND delivered = 0 ORDER BY submitted_at DESC",
+                                      (user,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_delivered(self, job_id: str):
+        """結果を画面に反映済みにする"""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET delivered = 1 WHERE id = ?", (job_id,))
+            self._conn.commit()
+
+    def interrupt_unfinished(self):
+        """前のプロセスで待機中・実行中のまま残ったジョブを中断扱いにする（起動時に呼ぶ）"""
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET status = '中断', error = 'サーバーの再起動で中断されました', updated_at = ? "
+                               f"WHERE status IN ({', '.join('?' * len(UNFINISHED_STATUSES))})", (time.time(), *UNFINISHED_STATUSES))
+            self._conn.commit()
+
+    def prune(self) -> int:
+        """受け取り済み・終了してから保存期間を過ぎたジョブの記録を削除し、削除した件数を返す（起動時に呼ぶ）"""
+        with self._lock:
+            cursor = self._conn.execute(f"DELETE FROM jobs WHERE updated_at < ? AND (delivered = 1 OR status NOT IN ({', '.join('?' * len(UNFINISHED_STATUSES))}))",
+                                        (time.time() - self.retention_seconds, *UNFINISHED_STATUSES))
+            self._conn.commit()
+        return cursor.rowcount
+
+class JobQueue:
+    """優先度クラスとユーザーごとのラウンドロビンで順番を決め、トークンバケットで流量を制限してワーカープールで実行するキュー
+
+    トークンバケットはジョブを取り出す前に確保する。先頭のジョブが確保できるまで後ろのジョブも取り出さないため、
+    レート制限中もワーカーが一括のジョブを抱えて待つことはなく、後から来た対話のジョブが先に実行される。
+    """
+
+    def __init__(self, workers: int = QUEUE_WORKERS, bucket: Optional[TokenBucket] = None, store: Optional[JobStore] = None):
+        self.bucket = bucket or TokenBucket()
+        self.store = store
+        if store is not None:
+            store.interrupt_unfinished()
+            store.prune()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        # 優先度 → ユーザー → ジョブの列。ユーザーの順番はdequeを回して公平にする
+        self._queues = {INTERACTIVE: {}, BATCH: {}}
+        self._turns = {INTERACTIVE: deque(), BATCH: deque()}
+        self._jobs = {}
+        self._running = 0
+        self._threads = [threading.Thread(target=self._worker, name=f"story-job-{i}", daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, func: Callable[[Job], object], user: str = '', priority: int = INTERACTIVE, requests: int = 1,
+               tokens: int = 0, label: str = '', persist: bool = False) -> Job:
+        """ジョブを投入（funcはJobを受け取って結果を返す。requests・tokensはトークンバケットから消費する量の見積もり）
+
+        persist=Trueならstoreに状態と結果（JSONにできる値）を保存する。
+        """
+        job = Job(func, user, priority, requests, tokens, label, persist)
+        self._set_status(job, '待機中')
+        with self._ready:
+            self._jobs[job.id] = job
+            if user not in self._queues[priority]:
+                self._queues[priority][user] = deque()
+                self._turns[priority].append(user)
+            self._queues[priority][user].append(job)
+            # レート制限待ちのワーカーにも先頭のジョブが変わったことを知らせる
+            self._ready.notify_all()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """IDからジョブを取得"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        """ジョブを中止（待機中ならキューから外し、実行中なら処理側に中止を伝える）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.cancel()
+            jobs = self._queues[job.priority].get(job.user)
+            if jobs is None or job not in jobs:
+                return
+            jobs.remove(job)
+            if not jobs:
+                del self._queues[job.priority][job.user]
+                self._turns[job.priority].remove(job.user)
+            self._ready.notify_all()
+        self._set_status(job, '中止', error="実行前に中止されました")
+        job.future.set_exception(JobCancelled("実行前に中止されました"))
+
+    def _order(self) -> list:
+        """待機中のジョブを実行される順に並べる（呼び出し側でロックを取得済み）"""
+        order = []
+        for priority in sorted(self._queues):
+            queues = {user: list(jobs) for user, jobs in self._queues[priority].items()}
+            turns = [user for user in self._turns[priority] if queues.get(user)]
+            depth = 0
+            while turns:
+                turns = [user for user in turns if len(queues[user]) > depth]
+                order += [queues[user][depth] for user in turns]
+                depth += 1
+        return order
+
+    def position(self, job: Job) -> Optional[int]:
+        """待機中のジョブの順番（1始まり、待機中でなければNone）"""
+        with self._lock:
+            order = self._order()
+        return order.index(job) + 1 if job in order else None
+
+    def _take(self) -> tuple:
+        """次に実行するジョブを、トークンバケットを確保できた場合だけ取り出す（呼び出し側でロックを取得済み）
+
+        (ジョブ, 0)、確保できなければ(None, 確保できるまでの秒数)、待機中のジョブがなければ(None, None)を返す。
+        """
+        for priority in sorted(self._queues):
+            turns = self._turns[priority]
+            if turns:
+                user = turns[0]
+                jobs = self._queues[priority][user]
+                job = jobs[0]
+                wait = self.bucket.try_acquire(job.requests, job.tokens)
+                if wait > 0:
+                    if job.status != 'レート制限待ち':
+                        self._set_status(job, 'レート制限待ち')
+                    return None, wait
+                turns.popleft()
+                jobs.popleft()
+                if jobs:
+                    turns.append(user)
+                else:
+                    del self._queues[priority][user]
+                return job, 0.0
+        return None, None
+
+    def _worker(self):
+        while True:
+            with self._ready:
+                job, wait = self._take()
+                while job is None:
+                    self._ready.wait(wait)
+                    job, wait = self._take()
+                self._running += 1
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    # 完了したジョブは一定数だけ残し、古いものから参照を外す
+                    finished = [j for j in self._jobs.values() if j.future.done()]
+                    for old in sorted(finished, key=lambda j: j.submitted_at)[:max(0, len(finished) - 200)]:
+                        del self._jobs[old.id]
+
+    def _set_status(self, job: Job, status: str, result=None, error: Optional[str] = None):
+        """状態を更新し、保存対象のジョブならstoreにも記録"""
+        job.status = status
+        if job.persist and self.store is not None:
+            self.store.save(job, result, error)
+
+    def _run(self, job: Job):
+        if job.cancelled.is_set():
+            # 取り出す時に確保したトークンは使わないので返す
+            self.bucket.adjust(-job.tokens)
+            self._set_status(job, '中止', error="実行前に中止されました")
+            job.future.set_exception(JobCancelled("実行前に中止されました"))
+            return
+        job.future.set_running_or_notify_cancel()
+        job.started_at = time.time()
+        self._set_status(job, '実行中')
+        try:
+            result = job.func(job)
+        except JobCancelled as e:
+            self._set_status(job, '中止', error=str(e))
+            job.future.set_exception(e)
+            return
+        except Exception as e:
+            self._set_status(job, 'エラー', error=str(e))
+            job.future.set_exception(e)
+            return
+        if isinstance(result, dict) and 'tokens' in result:
+            self.bucket.adjust(result['tokens'] - job.tokens)
+        if job.cancelled.is_set():
+            # 途中までの本文は中止した時点でpartialから受け取っているので、保存するのは使用量だけにする
+            usage = {key: result[key] for key in USAGE_KEYS if key in result} if isinstance(result, dict) else {}
+            self._set_status(job, '中止', result=usage or None, error="生成中に中止されました")
+            job.future.set_exception(JobCancelled("生成中に中止されました"))
+            return
+        self._set_status(job, '完了', result=result)
+        job.future.set_result(result)
+
+    def stats(self) -> Dict:
+        """待機中（優先度別）・実行中のジョブ数とバケットの残量"""
+        with self._lock:
+            waiting = {PRIORITY_LABELS[p]: sum(len(jobs) for jobs in users.values()) for p, users in self._queues.items()}
+            running = self._running
+        return {'waiting': waiting, 'running': running, 'bucket': self.bucket.levels()}
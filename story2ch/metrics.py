@@ -0,0 +1,239 @@
+"""モデル呼び出しごとの計測（プロンプト作成時間・待ち時間・レイテンシ・最初のチャンクまでの時間・トークン数・finish_reason）とPrometheus形式の出力"""
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+from .client import partial_usage, response_usage
+
+METRICS_PATH = os.environ.get("STORY_METRICS_PATH", os.path.join(".story_cache", "metrics.sqlite3"))
+METRIC_FIELDS = ['tab', 'content_type', 'model', 'prompt_chars', 'build_ms', 'queue_ms', 'latency_ms', 'ttft_ms',
+                 'input_tokens', 'output_tokens', 'cost', 'cache_hit', 'finish_reason', 'error']
+LATENCY_BUCKETS = [0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+# 呼び出し結果の分類（エラー → キャッシュヒット → 成功の順に判定）
+STATUS_SQL = "CASE WHEN COALESCE(error, '') != '' THEN 'error' WHEN cache_hit THEN 'cache_hit' ELSE 'ok' END"
+
+def percentile(values: list, q: float) -> Optional[float]:
+    """線形補間でパーセンタイルを計算（値がなければNone）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def finish_reason_name(response) -> Optional[str]:
+    """レスポンスのfinish_reason（STOP / MAX_TOKENS / SAFETYなど）を取得"""
+    candidates = getattr(response, 'candidates', None) or []
+    if not candidates:
+        return None
+    reason = getattr(candidates[0], 'finish_reason', None)
+    return getattr(reason, 'name', None) or (str(reason) if reason is not None else None)
+
+class MetricsStore:
+    """モデル呼び出しの計測結果をSQLiteに記録する（タブ・内容の種類ごとに集計する）"""
+
+    def __init__(self, path: str = METRICS_PATH):
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS model_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, tab TEXT, content_type TEXT, model TEXT,
+            prompt_chars INTEGER, build_ms REAL, queue_ms REAL, latency_ms REAL, ttft_ms REAL, input_tokens INTEGER,
+            output_tokens INTEGER, cost REAL, cache_hit INTEGER NOT NULL DEFAULT 0, finish_reason TEXT, error TEXT)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_model_calls_created ON model_calls (created_at)")
+        self._conn.commit()
+
+    def record(self, **fields):
+        """呼び出し1回分を記録（METRIC_FIELDS以外の項目は無視）"""
+        values = [fields.get(name) for name in METRIC_FIELDS]
+        values[METRIC_FIELDS.index('cache_hit')] = int(bool(fields.get('cache_hit')))
+        with self._lock:
+            self._conn.execute(f"INSERT INTO model_calls (created_at, {', '.join(METRIC_FIELDS)}) VALUES ({', '.join('?' * (len(METRIC_FIELDS) + 1))})",
+                               (time.time(), *values))
+            self._conn.commit()
+
+    def rows(self, since_seconds: Optional[float] = None) -> list:
+        """記録を古い順に取得（since_secondsを指定すると直近のみ）"""
+        with self._lock:
+            if since_seconds is None:
+                rows = self._conn.execute("SELECT * FROM model_calls ORDER BY id").fetchall()
+            else:
+                rows = self._conn.execute("SELECT * FROM model_calls WHERE created_at >= ? ORDER BY id", (time.time() - since_seconds,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def totals(self) -> list:
+        """タブ・内容の種類・モデル・結果ごとの回数・トークン数・料金・レイテンシのヒストグラムをSQLで集計する（全行を読み込まない）"""
+        buckets = ", ".join("SUM(CASE WHEN latency_ms <= ? THEN 1 ELSE 0 END)" for _ in LATENCY_BUCKETS)
+        with self._lock:
+            rows = self._conn.execute(f"""SELECT COALESCE(tab, ''), COALESCE(content_type, ''), COALESCE(model, ''), {STATUS_SQL},
+                COUNT(*), COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0), COALESCE(SUM(cost), 0.0),
+                COUNT(latency_ms), COALESCE(SUM(latency_ms), 0.0), {buckets}
+                FROM model_calls GROUP BY 1, 2, 3, 4 ORDER BY MIN(id), 4""", [bound * 1000 for bound in LATENCY_BUCKETS]).fetchall()
+        return [{'tab': r[0], 'content_type': r[1], 'model': r[2], 'status': r[3], 'calls': r[4], 'input_tokens': r[5], 'output_tokens': r[6],
+                 'cost': r[7], 'latency_count': r[8], 'latency_sum': r[9] / 1000, 'latency_buckets': list(r[10:])} for r in rows]
+
+    def summary(self, group_by: str = 'tab', since_seconds: Optional[float] = None) -> list:
+        """tab / content_type / model ごとの回数・エラー・キャッシュヒット率・レイテンシとTTFTのp50/p95・トークン数・料金"""
+        groups = {}
+        for row in self.rows(since_seconds):
+            groups.setdefault(row[group_by] or '（不明）', []).append(row)
+        result = []
+        for key, items in sorted(groups.items(), key=lambda item: -len(item[1])):
+            called = [r for r in items if not r['cache_hit'] and not r['error']]
+            latencies = [r['latency_ms'] for r in called if r['latency_ms'] is not None]
+            ttfts = [r['ttft_ms'] for r in called if r['ttft_ms'] is not None]
+            result.append({
+                group_by: key, 'calls': len(items), 'errors': sum(1 for r in items if r['error']),
+                'cache_hit_rate': round(sum(1 for r in items if r['cache_hit']) / len(items), 3),
+                'latency_p50_ms': round_or_none(percentile(latencies, 50)), 'latency_p95_ms': round_or_none(percentile(latencies, 95)),
+                'ttft_p50_ms': round_or_none(percentile(ttfts, 50)), 'ttft_p95_ms': round_or_none(percentile(ttfts, 95)),
+                'input_tokens': sum(r['input_tokens'] or 0 for r in items), 'output_tokens': sum(r['output_tokens'] or 0 for r in items),
+                'cost': round(sum(r['cost'] or 0 for r in items), 6),
+            })
+        return result
+
+def round_or_none(value: Optional[float], digits: int = 1) -> Optional[float]:
+    """Noneはそのまま、数値は丸める"""
+    return None if value is None else round(value, digits)
+
+def prometheus_text(store: MetricsStore) -> str:
+    """記録全体をPrometheusのテキスト形式（カウンターとレイテンシのヒストグラム）にする（集計はSQLで行う）"""
+    calls, tokens, cost, histogram = {}, {}, {}, {}
+    for total in store.totals():
+        labels = (('tab', total['tab']), ('content_type', total['content_type']), ('model', total['model']))
+        calls[labels + (('status', total['status']),)] = total['calls']
+        for direction in ('input', 'output'):
+            key = labels + (('direction', direction),)
+            tokens[key] = tokens.get(key, 0) + total[f'{direction}_tokens']
+        cost[labels] = cost.get(labels, 0.0) + total['cost']
+        if total['status'] == 'ok' and total['latency_count']:
+            histogram[labels] = {'buckets': total['latency_buckets'], 'sum': total['latency_sum'], 'count': total['latency_count']}
+
+    def label_text(labels) -> str:
+        return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+    lines = ["# HELP story_model_calls_total モデル呼び出し回数（status: ok / error / cache_hit）", "# TYPE story_model_calls_total counter"]
+    lines += [f"story_model_calls_total{label_text(k)} {v}" for k, v in calls.items()]
+    lines += ["# HELP story_tokens_total 入力・出力トークン数", "# TYPE story_tokens_total counter"]
+    lines += [f"story_tokens_total{label_text(k)} {v}" for k, v in tokens.items()]
+    lines += ["# HELP story_cost_usd_total 概算料金（USD）", "# TYPE story_cost_usd_total counter"]
+    lines += [f"story_cost_usd_total{label_text(k)} {v:.6f}" for k, v in cost.items()]
+    lines += ["# HELP story_model_call_latency_seconds モデル呼び出しのレイテンシ（キャッシュヒット・エラーを除く）", "# TYPE story_model_call_latency_seconds histogram"]
+    for labels, data in histogram.items():
+        for bound, count in zip(LATENCY_BUCKETS, data['buckets']):
+            lines.append(f"story_model_call_latency_seconds_bucket{label_text(labels + (('le', str(bound)),))} {count}")
+        lines.append(f"story_model_call_latency_seconds_bucket{label_text(labels + (('le', '+Inf'),))} {data['count']}")
+        lines.append(f"story_model_call_latency_seconds_sum{label_text(labels)} {data['sum']:.6f}")
+        lines.append(f"story_model_call_latency_seconds_count{label_text(labels)} {data['count']}")
+    return "\n".join(lines) + "\n"
+
+def escape_label(value: str) -> str:
+    """Prometheusのラベル値をエスケープ"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# ===============================================================================
+# モデルの計測用ラッパー
+# ===============================================================================
+class InstrumentedStream:
+    """ストリーミングのレスポンスを包み、最初のチャンクまでの時間と終了時の使用量を記録する
+
+    途中で打ち切られた場合（中止でGeneratorExit）や例外の場合も、受信した本文から使用量を概算して記録する。
+    """
+
+    def __init__(self, response, model: 'InstrumentedModel', fields: Dict, started: float, prompt=''):
+        self._response = response
+        self._model = model
+        self._fields = fields
+        self._started = started
+        self._prompt = prompt
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __iter__(self):
+        ttft_ms = None
+        text = ""
+        error = None
+        completed = False
+        try:
+            for chunk in self._response:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - self._started) * 1000
+                if getattr(chunk, 'parts', None):
+                    text += chunk.text
+                yield chunk
+            completed = True
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if completed:
+                self._model.finish(self._fields, self._started, self._response, ttft_ms=ttft_ms)
+            else:
+                # 中止の場合は送信したプロンプト分も課金されるので、本文を受信していなくても記録する
+                usage = partial_usage(self._response, getattr(self._model.model, 'model_name', ''), self._prompt, text) if text or error is None else {}
+                self._model.finish(self._fields, self._started, self._response, error=error, ttft_ms=ttft_ms,
+                                   usage=usage, finish_reason=None if error else 'CANCELLED')
+
+class InstrumentedModel:
+    """generate_contentの呼び出しごとに計測結果をMetricsStoreに記録するラッパー（labelsはtab・content_typeなど）
+
+    プロンプト作成時間や待ち時間は、呼び出し前にnote()で渡すと同じスレッドの次の呼び出しに記録される。
+    """
+
+    def __init__(self, model, store: MetricsStore, **labels):
+        self.model = model
+        self.store = store
+        self.labels = labels
+        self._pending = threading.local()
+
+    def __getattr__(self, name):
+        attr = getattr(self.model, name)
+        if name == 'for_task':
+            # ModelRouterを包んだ場合は、振り分け後のモデルも同じラベルで計測する
+            return lambda task: InstrumentedModel(attr(task), self.store, **self.labels)
+        return attr
+
+    def note(self, **fields):
+        """次の呼び出しに付ける計測値（build_ms・queue_ms）を設定"""
+        self._pending.fields = dict(getattr(self._pending, 'fields', {}), **fields)
+
+    def _take_fields(self, prompt) -> Dict:
+        fields = dict(self.labels, prompt_chars=len(prompt), **getattr(self._pending, 'fields', {}))
+        self._pending.fields = {}
+        return fields
+
+    def record_cache_hit(self, prompt):
+        """レスポンスキャッシュから返した呼び出しを記録"""
+        self.store.record(**self._take_fields(prompt), model=getattr(self.model, 'model_name', ''), cache_hit=1, latency_ms=0)
+
+    def finish(self, fields: Dict, started: float, response, error: Optional[str] = None, ttft_ms: Optional[float] = None,
+               usage: Optional[Dict] = None, finish_reason: Optional[str] = None):
+        """呼び出しの終了時に記録（usage・finish_reasonを渡すとレスポンスから読む代わりに使う）"""
+        model_name = getattr(response, 'served_model', None) or getattr(self.model, 'model_name', '')
+        if usage is None:
+            usage = response_usage(response, model_name) if response is not None else {}
+        if finish_reason is None and response is not None:
+            finish_reason = finish_reason_name(response)
+        self.store.record(**fields, model=model_name, latency_ms=(time.perf_counter() - started) * 1000, ttft_ms=ttft_ms,
+                          input_tokens=usage.get('input_tokens'), output_tokens=usage.get('output_tokens'), cost=usage.get('cost'),
+                          finish_reason=finish_reason, error=error)
+
+    def generate_content(self, prompt, **kwargs):
+        """計測しながら生成（stream=Trueの場合は反復の終了時に記録）"""
+        fields = self._take_fields(prompt)
+        started = time.perf_counter()
+        try:
+            response = self.model.generate_content(prompt, **kwargs)
+        except Exception as e:
+            self.finish(fields, started, None, error=type(e).__name__)
+            raise
+        if kwargs.get('stream'):
+            return InstrumentedStream(response, self, fields, started, prompt)
+        self.finish(fields, started, response, ttft_ms=(time.perf_counter() - started) * 1000)
+        return response
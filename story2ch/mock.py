@@ -0,0 +1,174 @@
+"""オフライン計測用のGemini互換スタブ（遅延・ストリーミングの間隔・トークン数・429エラー・出力の途中切れを設定可能）"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from .budget import approximate_tokens
+from .prompts import CHAPTER_TITLES
+
+MOCK_OPTIONS_ENV = "STORY_MOCK_OPTIONS"
+DEFAULT_MOCK_OPTIONS = {
+    'latency_sec': 0.3,         # 最初のチャンクが届くまでの時間
+    'chunk_interval_sec': 0.02, # 2つ目以降のチャンクの間隔
+    'chunk_chars': 40,          # 1チャンクあたりの文字数
+    'output_chars': 1500,       # 通常の出力の文字数
+    'error_rate': 0.0,          # 429（ResourceExhausted）を返す割合
+    'truncate_rate': 0.0,       # 出力を途中で打ち切る（finish_reason=MAX_TOKENS）割合
+    'seed': None,
+}
+FILLER_SENTENCES = [
+    "その日、私はいつもより少しだけ早く家を出た。", "「ちょっと、話があるんだけど」と彼女は言った。", "空は重たい灰色で、今にも雨が降り出しそうだった。",
+    "「そんなこと、聞いてないですよ！」", "私は深く息を吸い込み、ゆっくりと振り返った。", "誰もがその言葉の意味をすぐには理解できなかった。",
+    "「いいから、最後まで聞いてくれ」", "数日後、事態は思いもよらない方向へ動き出した。",
+]
+THEME_COUNT_PATTERN = re.compile(r'(\d+)個のテーマ案')
+PROOFREAD_TARGET_PATTERN = re.compile(r'<<<\n(.*?)\n>>>', re.S)
+JUDGE_CANDIDATE_PATTERN = re.compile(r'【候補(\d+)】')
+BEAT_PAGES_PATTERN = re.compile(r'全(\d+)ページの.*ビートシートだけを作成')
+NAME_RANGE_PATTERN = re.compile(r'【担当ページ】: (\d+)～(\d+)ページ')
+
+def load_mock_options(overrides: Optional[Dict] = None) -> Dict:
+    """既定値に環境変数STORY_MOCK_OPTIONS（JSON）と引数の指定を重ねたスタブの設定"""
+    options = dict(DEFAULT_MOCK_OPTIONS)
+    if os.environ.get(MOCK_OPTIONS_ENV):
+        options.update(json.loads(os.environ[MOCK_OPTIONS_ENV]))
+    options.update(overrides or {})
+    return options
+
+class ResourceExhausted(Exception):
+    """スタブが返す429エラー（google.api_core.exceptions.ResourceExhaustedと同じ名前・code）"""
+    code = 429
+
+class MockUsage:
+    """usage_metadata互換"""
+
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+        self.cached_content_token_count = 0
+
+class MockCandidate:
+    """candidates[0]互換（finish_reasonはSTOPまたはMAX_TOKENS）"""
+
+    def __init__(self, finish_reason: str):
+        self.finish_reason = finish_reason
+
+class MockChunk:
+    """ストリーミングの1チャンク"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.parts = [text] if text else []
+
+class MockResponse:
+    """GenerateContentResponse互換（stream=Trueの場合は反復するとチャンクが設定どおりの間隔で届く）"""
+
+    def __init__(self, text: str, prompt_tokens: int, finish_reason: str, options: Dict, stream: bool):
+        self._full_text = text
+        self._options = options
+        self._stream = stream
+        self.candidates = [MockCandidate(finish_reason)]
+        self.usage_metadata = None if stream else MockUsage(prompt_tokens, approximate_tokens(text))
+        self._prompt_tokens = prompt_tokens
+        self.parts = [text] if text else []
+
+    @property
+    def text(self) -> str:
+        return self._full_text
+
+    def _chunks(self) -> list:
+        size = max(1, int(self._options['chunk_chars']))
+        return [self._full_text[i:i + size] for i in range(0, len(self._full_text), size)] or [""]
+
+    def __iter__(self):
+        if not self._stream:
+            yield MockChunk(self._full_text)
+            return
+        for i, chunk in enumerate(self._chunks()):
+            time.sleep(self._options['latency_sec'] if i == 0 else self._options['chunk_interval_sec'])
+            yield MockChunk(chunk)
+        self.usage_metadata = MockUsage(self._prompt_tokens, approximate_tokens(self._full_text))
+
+class MockCountResult:
+    """count_tokensの結果互換"""
+
+    def __init__(self, total_tokens: int):
+        self.total_tokens = total_tokens
+
+class MockModel:
+    """GenerativeModel互換のスタブ（APIを呼ばずに、プロンプトの種類に応じた形式の出力を返す）"""
+
+    def __init__(self, model_name: str = 'gemini-2.0-flash-exp', options: Optional[Dict] = None):
+        self.model_name = model_name
+        self._generation_config = None
+        self.options = load_mock_options(options)
+        self._lock = threading.Lock()
+        self._random = random.Random(self.options['seed'])
+        self.calls = 0
+
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def reply(self, prompt: str, temperature: Optional[float] = None) -> str:
+        """プロンプトの種類（チャンク校正・変更部分の二次チェック・アウトライン・ビートシート・ページ範囲のネーム・候補の採点・テーマ案・その他）に合わせた出力を作る（温度を指定すると文の並びと長さが変わる）"""
+        target = PROOFREAD_TARGET_PATTERN.search(prompt)
+        if target and '"corrected"' in prompt:
+            return json.dumps({'corrected': target.group(1), 'corrections': []}, ensure_ascii=False)
+        if target and '"findings"' in prompt:
+            first = target.group(1).strip().split('\n')[0][:20]
+            return json.dumps({'findings': [{'quote': first, 'problem': '（スタブの指摘）', 'suggestion': '（スタブの改善案）'}] if first else []}, ensure_ascii=False)
+        if 'アウトラインだけを作成' in prompt:
+            return "登場人物: 主人公（会社員）、義母（同居人）\n" + "\n".join(f"{title}: {FILLER_SENTENCES[i % len(FILLER_SENTENCES)]}" for i, title in enumerate(CHAPTER_TITLES))
+        beat_pages = BEAT_PAGES_PATTERN.search(prompt)
+        if beat_pages:
+            return "登場人物: 主人公（会社員・落ち着いた口調）、義母（派手な服装・強い口調）\n舞台: 現代の郊外の一軒家\n" + "\n".join(
+                f"{page}ページ: {FILLER_SENTENCES[page % len(FILLER_SENTENCES)]}" for page in range(1, int(beat_pages.group(1)) + 1))
+        name_range = NAME_RANGE_PATTERN.search(prompt)
+        if name_range and '"panels"' in prompt:
+            return json.dumps({'pages': [{'page': page, 'panels': [{'layout': f"{i}段目", 'characters': '主人公', 'dialogue': FILLER_SENTENCES[(page + i) % len(FILLER_SENTENCES)],
+                                                                      'action': '振り返る', 'background': '居間'} for i in range(1, 4)]}
+                                         for page in range(int(name_range.group(1)), int(name_range.group(2)) + 1)]}, ensure_ascii=False)
+        judged = JUDGE_CANDIDATE_PATTERN.findall(prompt)
+        if judged and '"index"' in prompt:
+            return json.dumps([{'index': int(i), 'score': 5 + int(hashlib.sha256(f"{prompt}{i}".encode('utf-8')).hexdigest()[:2], 16) % 5, 'reason': '（スタブの採点）'}
+                               for i in judged], ensure_ascii=False)
+        count = THEME_COUNT_PATTERN.search(prompt)
+        if count:
+            return "\n\n".join(f"{i}. **タイトル**: テーマ案{i}\n   **概要**: {FILLER_SENTENCES[i % len(FILLER_SENTENCES)]}" for i in range(1, int(count.group(1)) + 1))
+        # プロンプトと温度のハッシュから文の並びを決める（同じプロンプト・温度なら同じ出力）
+        seed = int(hashlib.sha256(f"{prompt}\n{temperature}".encode('utf-8')).hexdigest()[:8], 16)
+        output_chars = self.options['output_chars'] * (0.5 + temperature / 2 if temperature is not None else 1)
+        lines, length = [], 0
+        while length < output_chars:
+            sentence = FILLER_SENTENCES[(seed + len(lines)) % len(FILLER_SENTENCES)]
+            lines.append(sentence + ("\n\n" if len(lines) % 4 == 3 else "\n"))
+            length += len(lines[-1])
+        return "".join(lines)
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs) -> MockResponse:
+        """設定に従って429・途中切れを起こしつつ、通常は遅延の後に応答を返す"""
+        with self._lock:
+            self.calls += 1
+        if self._roll(self.options['error_rate']):
+            time.sleep(self.options['latency_sec'] / 2)
+            raise ResourceExhausted("429 Resource has been exhausted (mock)")
+        temperature = (kwargs.get('generation_config') or {}).get('temperature')
+        text, finish_reason = self.reply(str(prompt), temperature), 'STOP'
+        if self._roll(self.options['truncate_rate']):
+            text, finish_reason = text[:len(text) // 2], 'MAX_TOKENS'
+        response = MockResponse(text, approximate_tokens(str(prompt)), finish_reason, self.options, stream)
+        if not stream:
+            chunks = max(1, -(-len(text) // max(1, int(self.options['chunk_chars']))))
+            time.sleep(self.options['latency_sec'] + (chunks - 1) * self.options['chunk_interval_sec'])
+        return response
+
+    def count_tokens(self, prompt) -> MockCountResult:
+        """文字数からトークン数を概算"""
+        return MockCountResult(approximate_tokens(str(prompt)))
@@ -0,0 +1,48 @@
+"""大きな生成結果の分割表示とダウンロード（章・見出しの区切りで、1ページがPAGE_CHARS文字以内になるように分ける）"""
+import io
+import re
+
+from .proofread import split_into_chunks
+from .stats import ContentMemo
+
+PAGE_CHARS = 6000
+DOWNLOAD_CHUNK_CHARS = 64 * 1024
+# 章・話・ページ・Markdownの見出し・【】だけの行を区切りにする
+SECTION_HEADING_PATTERN = re.compile(r'^[ \t　]*(?:#{1,3}[ \t]+\S.*|\**第[一二三四五六七八九十百千\d０-９]+[章話部幕節].*|■[ \t　]*\d+ページ.*|【[^】\n]{1,30}】[ \t　]*)$', re.M)
+
+_pages_memo = ContentMemo()
+
+def section_title(text: str, start: int) -> str:
+    """区切りの見出し行（先頭の区切りでなければ「冒頭」）"""
+    match = SECTION_HEADING_PATTERN.match(text, start)
+    return match.group(0).strip(' \t　#*') if match else '冒頭'
+
+def split_pages(text: str, page_chars: int = PAGE_CHARS) -> list:
+    """見出しの区切りで分け、短い部分はPAGE_CHARS文字まで前とまとめ、長い部分は段落・文の区切りでさらに分ける（各ページは開始・終了・見出し）"""
+    bounds = sorted({0, *(m.start() for m in SECTION_HEADING_PATTERN.finditer(text))})
+    sections = [(start, end) for start, end in zip(bounds, bounds[1:] + [len(text)]) if end > start]
+    pages = []
+    for start, end in sections:
+        if pages and (end - pages[-1]['start']) <= page_chars:
+            pages[-1]['end'] = end
+            continue
+        for piece in split_into_chunks(text[start:end], page_chars, 0):
+            pages.append({'start': start + piece['start'], 'end': start + piece['end'], 'title': section_title(text, start) if piece['index'] == 0 else f"{section_title(text, start)}（続き）"})
+    return pages or [{'start': 0, 'end': 0, 'title': '冒頭'}]
+
+def text_pages(text: str) -> list:
+    """分割表示のページ（内容のハッシュごとにキャッシュし、再実行のたびに分け直さない）"""
+    return _pages_memo.get(text, split_pages)
+
+def page_label(pages: list, index: int) -> str:
+    """ページ選択の表示名"""
+    page = pages[index]
+    return f"{index + 1}/{len(pages)}: {page['title'][:30]}（{page['end'] - page['start']:,}文字）"
+
+def download_buffer(text: str, chunk_chars: int = DOWNLOAD_CHUNK_CHARS) -> io.BytesIO:
+    """ダウンロード用のUTF-8のバッファを、全文を一度にエンコードせず少しずつ書き込んで作る"""
+    buffer = io.BytesIO()
+    for start in range(0, len(text), chunk_chars):
+        buffer.write(text[start:start + chunk_chars].encode('utf-8'))
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,250 @@
+"""テーマ → プロット → 台本 → 校正 → 二次チェックを1回で実行するパイプライン（依存関係のない段階は並列、段階ごとに保存して途中から再開）"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+from .budget import TokenEstimator, expected_output_chars
+from .client import cached_generate
+from .jobqueue import BATCH, cancellable
+from .proofread import format_proofread_report, proofread_chunked, split_into_chunks
+from .prompts import (
+    SECONDARY_CHECK_LABELS, create_chunk_error_check_prompt, create_plot_prompt, create_script_prompt,
+    create_secondary_check_prompt, create_theme_generation_prompt,
+)
+from .routing import classify_task
+
+PIPELINE_PATH = os.environ.get("STORY_PIPELINE_PATH", os.path.join(".story_cache", "pipeline.sqlite3"))
+IDEA_PATTERN = re.compile(r'\*\*タイトル\*\*[:：]\s*(?P<title>[^\n]+)\s*\n\s*\*\*概要\*\*[:：]\s*(?P<summary>.+?)(?=\n\s*\d+\.\s|\Z)', re.S)
+FINISHED_STATUSES = ('完了', '再利用')
+FAILED_STATUSES = ('エラー', 'スキップ')
+
+def parse_theme_ideas(text: str) -> list:
+    """テーマ案の出力から「タイトル」と「概要」の組を取り出す"""
+    return [{'title': m.group('title').strip(), 'summary': m.group('summary').strip()} for m in IDEA_PATTERN.finditer(text)]
+
+def select_theme(config: Dict, outputs: Dict) -> Dict:
+    """入力されたテーマ、またはテーマ案からidea_index番目（0始まり）を選ぶ"""
+    if config.get('theme'):
+        return {'title': config.get('title') or config['theme'], 'summary': config['theme']}
+    ideas = parse_theme_ideas(outputs['theme'])
+    if not ideas:
+        raise ValueError("テーマ案を読み取れませんでした")
+    return ideas[min(int(config.get('idea_index') or 0), len(ideas) - 1)]
+
+# ===============================================================================
+# 各段階の処理（ワーカースレッドで実行し、後続に渡す本文と表示用テキストを返す）
+# ===============================================================================
+def theme_params(config, outputs) -> Dict:
+    """テーマ案のプロンプトのパラメータ"""
+    return {'generation_type': 'keyword' if config.get('keyword') else 'genre', 'genre': config.get('genre', ''),
+            'keyword': config.get('keyword', ''), 'num_ideas': config.get('num_ideas', 5), 'bible': config.get('bible')}
+
+def plot_params(config, outputs) -> Dict:
+    """選んだテーマからプロットを作るプロンプトのパラメータ"""
+    theme = select_theme(config, outputs)
+    return {'genre': config.get('genre') or '未指定', 'title': theme['title'], 'protagonist': config.get('protagonist') or '未設定',
+            'worldview': config.get('worldview') or '未設定', 'existing_plot': f"【テーマ】{theme['title']}\n{theme['summary']}",
+            'mode': config.get('mode', 'full-auto'), 'bible': config.get('bible')}
+
+def script_params(config, outputs) -> Dict:
+    """プロットを台本に変換するプロンプトのパラメータ"""
+    return {'plot': outputs['plot'], 'format': config.get('format', 'standard'), 'mode': config.get('mode', 'full-auto'), 'bible': config.get('bible')}
+
+def proofread_params(config, outputs) -> Dict:
+    """分割校正のパラメータ（見積もりでは台本全体を1チャンクとして数える）"""
+    return {'text': outputs['script'], 'level': config.get('level', 'basic'), 'bible': config.get('bible')}
+
+def run_theme_stage(model, config, outputs, cache, read_cache):
+    """テーマ案を生成"""
+    text, usage, hit = cached_generate(model, create_theme_generation_prompt(theme_params(config, outputs)), cache, read_cache)
+    return {'text': text, **usage, 'cache_hits': int(hit), 'cache_misses': int(not hit)}
+
+def run_plot_stage(model, config, outputs, cache, read_cache):
+    """選んだテーマからプロットを生成"""
+    text, usage, hit = cached_generate(model, create_plot_prompt(plot_params(config, outputs)), cache, read_cache)
+    return {'text': text, **usage, 'cache_hits': int(hit), 'cache_misses': int(not hit)}
+
+def run_script_stage(model, config, outputs, cache, read_cache):
+    """プロットを台本に変換"""
+    text, usage, hit = cached_generate(model, create_script_prompt(script_params(config, outputs)), cache, read_cache)
+    return {'text': text, **usage, 'cache_hits': int(hit), 'cache_misses': int(not hit)}
+
+def run_proofread_stage(model, config, outputs, cache, read_cache):
+    """台本を分割校正し、修正済みの台本を後続の二次チェックに渡す"""
+    result = proofread_chunked(model, outputs['script'], config.get('level', 'basic'), cache, read_cache, bible=config.get('bible'))
+    return {'text': result['corrected'], 'display': format_proofread_report(result),
+            **{key: result[key] for key in ('tokens', 'input_tokens', 'output_tokens', 'cost', 'cache_hits', 'cache_misses')}}
+
+def make_check_params(check_type: str) -> Callable:
+    """指定した観点の二次チェックのプロンプトのパラメータを作る関数"""
+    def check_params(config, outputs) -> Dict:
+        return {'text_to_check': outputs['proofread'], 'check_type': check_type, 'bible': config.get('bible')}
+    return check_params
+
+def make_check_stage(check_type: str) -> Callable:
+    """指定した観点の二次チェックを行う段階を作成"""
+    def run_check_stage(model, config, outputs, cache, read_cache):
+        params = make_check_params(check_type)(config, outputs)
+        text, usage, hit = cached_generate(model, create_secondary_check_prompt(params), cache, read_cache)
+        return {'text': text, **usage, 'cache_hits': int(hit), 'cache_misses': int(not hit)}
+    return run_check_stage
+
+def build_pipeline(config: Dict) -> list:
+    """設定から段階の一覧（名前・表示名・依存先・処理・振り分けと見積もり用のプロンプト関数とパラメータ）を作成"""
+    stages = []
+    if not config.get('theme'):
+        stages.append({'name': 'theme', 'label': 'テーマ案', 'depends': [], 'run': run_theme_stage,
+                       'prompt_func': create_theme_generation_prompt, 'params': theme_params})
+    stages += [
+        {'name': 'plot', 'label': 'プロット', 'depends': [s['name'] for s in stages], 'run': run_plot_stage,
+         'prompt_func': create_plot_prompt, 'params': plot_params},
+        {'name': 'script', 'label': '台本', 'depends': ['plot'], 'run': run_script_stage, 'prompt_func': create_script_prompt, 'params': script_params},
+        {'name': 'proofread', 'label': '校正', 'depends': ['script'], 'run': run_proofread_stage,
+         'prompt_func': create_chunk_error_check_prompt, 'params': proofread_params},
+    ]
+    for check_type in config.get('check_types', list(SECONDARY_CHECK_LABELS)):
+        stages.append({'name': f'check:{check_type}', 'label': f"二次チェック（{SECONDARY_CHECK_LABELS[check_type]}）", 'depends': ['proofread'],
+                       'run': make_check_stage(check_type), 'prompt_func': create_secondary_check_prompt, 'params': make_check_params(check_type)})
+    return stages
+
+def estimate_stage_tokens(stage: Dict, config: Dict, outputs: Dict, estimator: TokenEstimator) -> int:
+    """段階の見積もりトークン数（キューのTPMの予約に使う。前の段階の出力からパラメータを作れない場合は0とし、実行時にエラーにする）"""
+    try:
+        params = stage['params'](config, outputs)
+    except (KeyError, ValueError):
+        return 0
+    return estimator.estimate(stage['prompt_func'](params), params, '')['tokens']
+
+def pipeline_stage_params(config: Dict) -> list:
+    """実行前の見積もり用に、各段階の(段階, パラメータ)を返す（前の段階の出力は想定の長さの仮の本文で代用する）"""
+    placeholder = dict(config, theme=config.get('theme') or 'テーマ案')
+    outputs, result = {}, []
+    for stage in build_pipeline(config):
+        params = stage['params'](placeholder, outputs)
+        result.append((stage, params))
+        outputs[stage['name']] = 'あ' * expected_output_chars(params)
+    return result
+
+def stage_calls(stage: Dict, config: Dict, outputs: Dict) -> int:
+    """段階のモデル呼び出し回数（校正はチャンクごとに1回。台本がまだなければ1回として数える）"""
+    if stage['name'] == 'proofread' and 'script' in outputs:
+        return len(split_into_chunks(outputs['script']))
+    return 1
+
+def pipeline_run_id(config: Dict) -> str:
+    """設定から実行IDを作成（同じ設定で実行すると保存済みの段階を再利用できる）"""
+    return hashlib.sha256(json.dumps(config, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+# ===============================================================================
+# 段階ごとの保存（チェックポイント）
+# ===============================================================================
+class PipelineStore:
+    """パイプラインの段階ごとの結果をSQLiteに保存する（失敗した段階から再開するため）"""
+
+    def __init__(self, path: str = PIPELINE_PATH):
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS pipeline_stages (
+            run_id TEXT NOT NULL, stage TEXT NOT NULL, created_at REAL NOT NULL, result TEXT NOT NULL, PRIMARY KEY (run_id, stage))""")
+        self._conn.commit()
+
+    def save(self, run_id: str, stage: str, result: Dict):
+        """段階の結果を保存"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO pipeline_stages (run_id, stage, created_at, result) VALUES (?, ?, ?, ?)",
+                               (run_id, stage, time.time(), json.dumps(result, ensure_ascii=False)))
+            self._conn.commit()
+
+    def load(self, run_id: str) -> Dict:
+        """保存済みの段階の結果を取得"""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, result FROM pipeline_stages WHERE run_id = ?", (run_id,)).fetchall()
+        return {stage: json.loads(result) for stage, result in rows}
+
+    def clear(self, run_id: str):
+        """実行IDの保存済み結果を削除（最初からやり直す場合）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM pipeline_stages WHERE run_id = ?", (run_id,))
+            self._conn.commit()
+
+# ===============================================================================
+# 実行
+# ===============================================================================
+def run_stage(model, stage: Dict, config: Dict, outputs: Dict, cache, read_cache: bool) -> Dict:
+    """1段階を実行（ワーカースレッドで実行、modelにModelRouterを渡すと段階ごとに振り分け）"""
+    started = time.monotonic()
+    if hasattr(model, 'for_task'):
+        model = model.for_task(classify_task(stage['prompt_func'], stage['params'](config, outputs)))
+    result = stage['run'](model, config, outputs, cache, read_cache)
+    return {**result, 'latency_sec': round(time.monotonic() - started, 2)}
+
+def run_pipeline(model, config: Dict, store: Optional[PipelineStore] = None, cache=None, read_cache: bool = True, resume: bool = True,
+                 max_workers: int = 4, on_update: Optional[Callable[[list], None]] = None, job_queue=None, user: str = '',
+                 estimator: Optional[TokenEstimator] = None, cancelled: Optional[threading.Event] = None) -> Dict:
+    """依存先が完了した段階から順に並列実行し、段階ごとの結果を返す
+
+    storeを渡すと各段階の結果を保存し、resume=Trueなら同じ設定の保存済みの段階は再利用する。
+    失敗した段階に依存する段階はスキップされる。on_updateは状態の変化時に呼び出し元スレッドで呼ばれる。
+    job_queue（jobqueue.JobQueue）を渡すと、各段階を呼び出し回数と見積もりトークン数を添えて一括の優先度でプロセス共有のキューに投入して実行する。
+    cancelledがセットされると、まだ始まっていない段階は実行せずにエラーにする（後続の段階はスキップ）。
+    """
+    run_id = pipeline_run_id(config)
+    estimator = estimator or TokenEstimator()
+    stages = build_pipeline(config)
+    saved = store.load(run_id) if store and resume else {}
+    if store and not resume:
+        store.clear(run_id)
+    entries = {s['name']: {'name': s['name'], 'label': s['label'], 'status': '待機中', 'text': '', 'display': '', 'tokens': 0, 'input_tokens': 0,
+                           'output_tokens': 0, 'cost': 0.0, 'cache_hits': 0, 'cache_misses': 0, 'latency_sec': None, 'error': ''} for s in stages}
+    outputs = {}
+    for name, result in saved.items():
+        if name in entries:
+            entries[name].update(result, status='再利用', tokens=0, input_tokens=0, output_tokens=0, cost=0.0)
+            outputs[name] = result['text']
+
+    pending = {s['name']: s for s in stages if s['name'] not in outputs}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if any(entries[d]['status'] in FAILED_STATUSES for d in stage['depends']):
+                    entries[name].update(status='スキップ', error='前の段階が失敗しました')
+                    del pending[name]
+                elif all(d in outputs for d in stage['depends']):
+                    if job_queue is not None:
+                        future = job_queue.submit(lambda _, stage=stage, outputs=dict(outputs): run_stage(model, stage, config, outputs, cache, read_cache),
+                                                  user, BATCH, stage_calls(stage, config, outputs), estimate_stage_tokens(stage, config, outputs, estimator),
+                                                  label=stage['label']).future
+                    else:
+                        future = executor.submit(cancellable(run_stage, cancelled), model, stage, config, dict(outputs), cache, read_cache)
+                    running[future] = name
+                    entries[name]['status'] = '実行中'
+                    del pending[name]
+            if on_update: on_update(list(entries.values()))
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    entries[name].update(status='エラー', error=str(e))
+                    continue
+                result.setdefault('display', result['text'])
+                entries[name].update(result, status='完了')
+                outputs[name] = result['text']
+                if store:
+                    store.save(run_id, name, result)
+    for name in pending:
+        entries[name].update(status='スキップ', error='前の段階が失敗しました')
+    if on_update: on_update(list(entries.values()))
+    return {'run_id': run_id, 'stages': list(entries.values())}
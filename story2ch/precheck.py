@@ -0,0 +1,127 @@
+"""LLMを呼ぶ前のローカル校正チェック（助詞の重複・括弧の対応・全角半角の混在・重複行・文体の混在）"""
+import re
+from typing import Dict, Optional
+
+from .client import cached_generate, make_usage
+from .prompts import create_region_error_check_prompt
+
+DOUBLED_PARTICLE_PATTERN = re.compile(r'([のをにがはでとへ])\1')
+DOUBLED_PARTICLE_EXCEPTIONS = ('ののし', 'ははは', 'はは上', 'ははお', 'ととの', 'っとと思', 'ことと', 'ひととき', 'おとと', 'ででん')
+BRACKET_PAIRS = {'「': '」', '『': '』', '（': '）', '【': '】', '(': ')'}
+DIALOGUE_PATTERN = re.compile(r'「[^「」]*」|『[^『』]*』')
+SENTENCE_END_PATTERN = re.compile(r'[^。！？\n]*[。！？]')
+POLITE_ENDING_PATTERN = re.compile(r'(です|ます|でした|ました|ません|ましょう|ください)[。！？]$')
+PLAIN_ENDING_PATTERN = re.compile(r'(だ|である|だった|であった|ない|た)[。！？]$')
+WIDTH_GROUPS = [
+    ('数字', re.compile(r'[0-9]+'), re.compile(r'[０-９]+')),
+    ('感嘆符・疑問符', re.compile(r'[!?]+'), re.compile(r'[！？]+')),
+    ('句読点', re.compile(r'[，．]'), re.compile(r'[、。]')),
+]
+CONTEXT_CHARS = 80
+
+def finding(kind: str, offset: int, length: int, message: str, text: str) -> Dict:
+    """チェック結果1件を作成"""
+    return {'kind': kind, 'offset': offset, 'length': length, 'message': message,
+            'excerpt': text[max(0, offset - 10):offset + length + 10].replace('\n', ' ')}
+
+def check_doubled_particles(text: str) -> list:
+    """「のの」「をを」などの助詞の重複を検出"""
+    results = []
+    for m in DOUBLED_PARTICLE_PATTERN.finditer(text):
+        if any(m.start() >= i and text.startswith(word, m.start() - i) for word in DOUBLED_PARTICLE_EXCEPTIONS for i in range(len(word) - 1)):
+            continue
+        results.append(finding('助詞の重複', m.start(), 2, f"助詞「{m.group(1)}」が重複しています", text))
+    return results
+
+def check_brackets(text: str) -> list:
+    """「」『』（）【】の対応の崩れを検出"""
+    closers = {close: open_ for open_, close in BRACKET_PAIRS.items()}
+    stack, results = [], []
+    for i, char in enumerate(text):
+        if char in BRACKET_PAIRS:
+            stack.append((char, i))
+        elif char in closers:
+            if stack and stack[-1][0] == closers[char]:
+                stack.pop()
+            else:
+                results.append(finding('括弧の対応', i, 1, f"対応する「{closers[char]}」がない「{char}」です", text))
+    for char, i in stack:
+        results.append(finding('括弧の対応', i, 1, f"「{char}」が閉じられていません", text))
+    return results
+
+def check_width_mixture(text: str) -> list:
+    """全角・半角の混在（数字・記号・句読点）を検出し、少数派の側を指摘"""
+    results = []
+    for label, half, full in WIDTH_GROUPS:
+        half_matches, full_matches = list(half.finditer(text)), list(full.finditer(text))
+        if not half_matches or not full_matches:
+            continue
+        minority, width = (half_matches, '半角') if len(half_matches) <= len(full_matches) else (full_matches, '全角')
+        for m in minority:
+            results.append(finding('全角半角の混在', m.start(), len(m.group(0)), f"{label}に{width}が混在しています", text))
+    return results
+
+def check_repeated_lines(text: str) -> list:
+    """同じ行が連続している箇所を検出"""
+    results = []
+    offset, previous = 0, None
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped and stripped == previous:
+            results.append(finding('重複行', offset, len(line.rstrip('\n')), "直前と同じ行が繰り返されています", text))
+        previous = stripped if stripped else previous
+        offset += len(line)
+    return results
+
+def check_style_mixture(text: str) -> list:
+    """地の文のです・ます調とだ・である調の混在を検出し、少数派の文を指摘（セリフは対象外）"""
+    narration = DIALOGUE_PATTERN.sub(lambda m: '　' * len(m.group(0)), text)
+    polite, plain = [], []
+    for m in SENTENCE_END_PATTERN.finditer(narration):
+        sentence = m.group(0).strip()
+        if POLITE_ENDING_PATTERN.search(sentence):
+            polite.append(m)
+        elif PLAIN_ENDING_PATTERN.search(sentence):
+            plain.append(m)
+    if not polite or not plain:
+        return []
+    minority, style = (polite, 'です・ます調') if len(polite) < len(plain) else (plain, 'だ・である調')
+    return [finding('文体の混在', m.start(), len(m.group(0)), f"地の文に{style}が混在しています", text) for m in minority]
+
+CHECKS = [check_doubled_particles, check_brackets, check_width_mixture, check_repeated_lines, check_style_mixture]
+
+def run_precheck(text: str) -> list:
+    """すべてのローカルチェックを実行し、位置順に並べた結果を返す"""
+    return sorted((f for check in CHECKS for f in check(text)), key=lambda f: f['offset'])
+
+def build_flagged_regions(text: str, findings: list, context: int = CONTEXT_CHARS) -> list:
+    """指摘箇所の前後context文字を含む範囲を作り、重なる範囲はまとめる"""
+    regions = []
+    for f in findings:
+        start, end = max(0, f['offset'] - context), min(len(text), f['offset'] + f['length'] + context)
+        if regions and start <= regions[-1]['end']:
+            regions[-1]['end'] = max(regions[-1]['end'], end)
+            regions[-1]['findings'].append(f['message'])
+        else:
+            regions.append({'start': start, 'end': end, 'findings': [f['message']]})
+    for region in regions:
+        region['text'] = text[region['start']:region['end']]
+    return regions
+
+def format_precheck_report(findings: list) -> str:
+    """ローカルチェック結果を一覧テキストにする"""
+    if not findings:
+        return "ローカルチェックでは問題は見つかりませんでした。"
+    return "\n".join(f"{i}. [{f['offset'] + 1:,}文字目] {f['kind']}: {f['message']}（…{f['excerpt']}…）" for i, f in enumerate(findings, start=1))
+
+def proofread_with_precheck(model, text: str, level: str = 'basic', cache=None, read_cache: bool = True, bible: Optional[str] = None) -> Dict:
+    """ローカルチェックの指摘箇所とその前後だけをLLMで校正する（指摘がなければLLMを呼ばない。bibleは設定資料の要約）"""
+    findings = run_precheck(text)
+    report = ["1. ローカルチェック結果", format_precheck_report(findings)]
+    if not findings:
+        return {'text': "\n".join(report), 'findings': findings, **make_usage(), 'cache_hit': None}
+    regions = build_flagged_regions(text, findings)
+    result, usage, hit = cached_generate(model, create_region_error_check_prompt({'regions': regions, 'level': level, 'bible': bible}), cache, read_cache)
+    sent = sum(len(region['text']) for region in regions)
+    report += ["", f"2. AIチェック（指摘箇所の前後 {sent:,}/{len(text):,}文字のみ）", result.strip()]
+    return {'text': "\n".join(report), 'findings': findings, **usage, 'cache_hit': hit}
@@ -0,0 +1,471 @@
+"""台本・プロット作成用のプロンプト生成関数群（Streamlitに依存しない）"""
+import re
+from typing import Dict
+
+# ===============================================================================
+# 固定部分（prefix）付きのプロンプト
+# ===============================================================================
+class PromptText(str):
+    """strとしてそのまま使えるプロンプト（prefixは同じ原稿・設定で繰り返し送られる先頭の固定部分）"""
+
+    def __new__(cls, prefix: str, suffix: str = ''):
+        text = super().__new__(cls, prefix + suffix)
+        text.prefix = prefix
+        return text
+
+# ===============================================================================
+# 設定資料の要約
+# ===============================================================================
+def create_bible_context(params: Dict) -> str:
+    """設定資料（params['bible']の要約）をプロンプトに差し込むブロック（設定資料がなければ空文字）"""
+    if not params.get('bible'):
+        return ""
+    return f"""
+【設定資料】
+このシリーズの設定資料です。登場人物の名前・役割・口調や世界観は、この設定資料と食い違わないようにしてください。
+{params['bible']}
+"""
+
+# ===============================================================================
+# プロンプト生成関数群
+# ===============================================================================
+def create_theme_generation_prompt(params: Dict) -> str:
+    """テーマ生成用のプロンプト"""
+    if params['generation_type'] == 'genre':
+        source_text = f"【ジャンル】: {params['genre']}"
+        instruction = "このジャンルに沿った、独創的で魅力的な物語や動画のテーマを考えてください。"
+    else:
+        source_text = f"【キーワード】: {params['keyword']}"
+        instruction = "このキーワードから発想を広げ、面白そうな物語や動画のテーマを考えてください。"
+
+    prompt = f"""
+あなたは一流のクリエイティブプロデューサーです。あなたの仕事は、まだ誰も見たことがないような、視聴者の心を掴む物語のアイデアを生み出すことです。
+{instruction}
+
+{source_text}
+{create_bible_context(params)}
+以下の要件に従って、{params['num_ideas']}個のテーマ案を提案してください。
+
+【出力要件】
+- 各テーマは、キャッチーな「タイトル」と、2～3行の「概要」で構成してください。
+- 視聴者が「面白そう！」「続きが見たい！」と思うような、好奇心を刺激する内容にしてください。
+- ありきたりなアイデアではなく、少しひねりのある、独創的な切り口を重視してください。
+
+【出力形式】
+1. **タイトル**: （ここにタイトル）
+   **概要**: （ここに2～3行の概要）
+
+2. **タイトル**: （ここにタイトル）
+   **概要**: （ここに2～3行の概要）
+
+(以下、指定された数まで繰り返す)
+"""
+    return prompt
+
+def create_plot_prompt(params: Dict) -> str:
+    """プロット生成用プロンプト"""
+    mode_instructions = {
+        'full-auto': '完全自動で詳細なプロットを生成してください。','semi-self': 'ユーザーの入力を参考に、AIが補完・改良したプロットを生成してください。','self': 'ユーザーの入力を最大限活用し、最小限の補完でプロットを整理してください。'
+    }
+    prompt = f"""
+あなたはプロの脚本家・小説家です。以下の条件でプロットを作成してください。
+【作成モード】: {mode_instructions.get(params.get('mode', 'full-auto'))}
+【基本情報】- ジャンル: {params.get('genre', '未指定')} - タイトル: {params.get('title', '未設定')}
+【設定詳細】- 主人公: {params.get('protagonist', '未設定')} - 世界観: {params.get('worldview', '未設定')}
+{f"【既存プロット参考】: {params.get('existing_plot')}" if params.get('existing_plot') else ""}{create_bible_context(params)}
+【出力形式】
+1. 作品概要
+2. 主要登場人物
+3. 三幕構成での詳細プロット
+4. 重要シーン詳細
+5. テーマ・メッセージ
+プロの作家が作成したような、感情的な起伏と論理的な構成を持つ完成度の高いプロットを作成してください。"""
+    return prompt
+
+def create_script_prompt(params: Dict) -> str:
+    """台本生成用プロンプト"""
+    format_instructions = {
+        'standard': '標準的な台本形式','screenplay': '映画脚本形式','radio': 'ラジオドラマ形式','youtube': 'YouTube動画台本','2ch-thread': '2ch風スレッド形式','manga-name': 'マンガネーム形式'
+    }
+    prompt = f"""
+あなたはプロの脚本家です。以下のプロットを{format_instructions.get(params.get('format', 'standard'))}の台本に変換してください。
+{create_bible_context(params)}【プロット】
+{params.get('plot')}
+【台本形式】: {params.get('format', 'standard')}
+【出力要件】
+- セリフは自然で感情豊かに
+- ト書きは具体的で映像化しやすく
+- キャラクターの個性を台詞に反映
+プロの脚本家が書いたような、演出意図が明確で実用性の高い台本を作成してください。"""
+    return prompt
+
+PROOFREAD_LEVELS = {
+    'basic': '基本的な誤字脱字、変換ミスをチェック','advanced': '文法、表現の不自然さもチェック','professional': '敬語、専門用語、文体統一まで総合チェック'
+}
+
+def create_error_check_prompt(params: Dict) -> str:
+    """誤字脱字チェック用プロンプト"""
+    level_instructions = PROOFREAD_LEVELS
+    prompt = f"""
+あなたはプロの校正者です。以下のテキストを{level_instructions.get(params.get('level', 'basic'))}してください。
+{create_bible_context(params)}【チェック対象テキスト】
+{params.get('text')}
+【チェックレベル】: {params.get('level', 'basic')}
+【出力形式】
+1. 修正済みテキスト
+2. 修正箇所一覧（原文、修正、理由）
+3. 全体的な改善提案
+プロの校正者として、読みやすさと正確性を両立した修正を行ってください。"""
+    return prompt
+
+def create_chunk_error_check_prompt(params: Dict) -> str:
+    """長文を分割して校正する際の1チャンク分のプロンプト（結果はJSONで受け取る）"""
+    prompt = f"""
+あなたはプロの校正者です。長い原稿を分割して校正しています。以下の【校正対象】だけを{PROOFREAD_LEVELS.get(params.get('level', 'basic'))}してください。
+【前後の文脈】は参考用です。文脈の部分は校正・出力しないでください。
+{create_bible_context(params)}【前の文脈】
+{params.get('context_before') or '（原稿の先頭です）'}
+【校正対象】
+<<<
+{params.get('text')}
+>>>
+【後の文脈】
+{params.get('context_after') or '（原稿の末尾です）'}
+【チェックレベル】: {params.get('level', 'basic')}
+【出力形式】
+次のJSONだけを出力してください（コードブロックや説明文は不要です）。
+{{"corrected": "校正対象を修正した全文（改行もそのまま保持）", "corrections": [{{"original": "原文の該当箇所（校正対象からそのまま抜き出す）", "corrected": "修正後", "reason": "理由"}}]}}
+修正がない場合は corrected に校正対象をそのまま入れ、corrections は空の配列にしてください。"""
+    return prompt
+
+def create_region_error_check_prompt(params: Dict) -> str:
+    """ローカルチェックで指摘された箇所だけを校正するプロンプト"""
+    regions = "\n\n".join(
+        f"【箇所{i}】（原文{region['start'] + 1:,}文字目から / 自動検出: {'、'.join(region['findings'])}）\n{region['text']}"
+        for i, region in enumerate(params['regions'], start=1))
+    prompt = f"""
+あなたはプロの校正者です。原稿のうち、機械的なチェックで問題が見つかった箇所だけを抜き出しました。各箇所を{PROOFREAD_LEVELS.get(params.get('level', 'basic'))}してください。
+自動検出の指摘は誤検出の場合もあります。誤検出であれば「修正不要」としてください。
+{create_bible_context(params)}{regions}
+【チェックレベル】: {params.get('level', 'basic')}
+【出力形式】
+各箇所ごとに：- 箇所番号 - 修正箇所一覧（原文、修正、理由）
+プロの校正者として、読みやすさと正確性を両立した修正を行ってください。"""
+    return prompt
+
+def create_youtube_prompt_base(params: Dict) -> str:
+    """YouTube台本プロンプトの共通ベースを作成する関数"""
+    pov_instruction = ""
+    if params.get('pov_character') == '主人公':
+        pov_instruction = "物語は主人公の一人称（私、俺など）で進行し、モノローグ（心の声）を多めに含めてください。"
+    elif params.get('pov_character') == '悪役・敵役':
+        pov_instruction = "物語は悪役の一人称（私、俺様など）で進行し、その傲慢な思考や誤算を描写してください。"
+    elif params.get('pov_character') == '第三者ナレーター':
+        pov_instruction = "物語を客観的な第三者の視点から、登場人物の行動や状況を冷静に説明してください。"
+    else: # その他の登場人物
+        pov_instruction = f"物語を「{params.get('pov_character')}」の視点から語り、その人物がどう事件に関わったかを描写してください。"
+
+    narrative_framework = ""
+    if params.get('use_advanced_settings'):
+        narrative_framework = f"""
+【物語の詳細な骨子】
+この骨子はユーザーが設定した物語の土台です。必ずこの内容を物語に反映させてください。
+- 主人公の設定: {params.get('protagonist_setting')}
+- 物語の導入（起）: {params.get('story_start')}
+- 物語の展開（承）: {params.get('story_development')}
+- 物語の転機（転）: {params.get('story_turn')}
+- 物語の結末（結）: {params.get('story_ending')}
+"""
+
+    long_story_instruction = ""
+    if params.get('chapter'):
+        long_story_instruction = f"""
+【章別執筆の指示】
+この台本は5つの章に分けて並行して執筆されています。担当する章は最後の【担当する章】で指定します。
+以下の全体アウトラインに沿って、前後の章と矛盾しないように執筆してください。
+【全体アウトライン】
+{params['chapter']['outline']}"""
+    elif params.get('length') in ['long', 'super_long']:
+        long_story_instruction = """
+【超長文生成のための特別指示】
+あなたのモデルには一度に出力できる文章量に上限があることを理解しています。その上限を最大限に活用し、可能な限り長い物語を生成するために、物語を5つの章（第一章: 発端、第二章: 展開、第三章: 転機、第四章: クライマックス、第五章: 結末）に明確に分割して構成してください。
+各章ごとに、最低でも1500文字以上、可能であれば2000文字以上を執筆してください。各章では、情景描写、人物の心理描写、会話のやり取りを詳細かつ豊富に盛り込んでください。
+この指示に従うことで、あなたは自身の能力を最大限に発揮し、ユーザーが求める長大で満足度の高い物語を完成させることができます。"""
+
+    return f"""
+【最重要指示】
+{pov_instruction}
+{create_bible_context(params)}{narrative_framework}
+{long_story_instruction}
+"""
+
+def create_chapter_instruction(params: Dict) -> str:
+    """章別生成で章ごとに異なる指示（章別生成でなければ空文字）"""
+    chapter = params.get('chapter')
+    if not chapter:
+        return ""
+    return f"""
+【担当する章】
+あなたが担当するのは「{chapter['title']}」のみです。他の章は書かないでください。
+【前の章までのあらすじ】
+{chapter['previous_summary']}
+- 出力の先頭行は「【{chapter['title']}】」としてください。
+- この章だけで最低でも1500文字以上、可能であれば2000文字以上を執筆してください。情景描写、人物の心理描写、会話のやり取りを詳細かつ豊富に盛り込んでください。
+- {"物語の冒頭として、視聴者を引き込むオープニングから始めてください。" if chapter['index'] == 0 else "前の章の続きから自然に書き始め、オープニングや挨拶は繰り返さないでください。"}
+- {"物語の結末としてきれいに締めくくってください。" if chapter['is_last'] else "章の終わりで物語を完結させず、次の章へ続く形で終えてください。"}"""
+
+def build_youtube_prompt(role: str, params: Dict, body: str, closing: str) -> PromptText:
+    """役割・最重要指示・設定までを固定部分とし、章ごとの指示と締めの一文を後ろに付けたYouTube台本プロンプトを作成"""
+    prefix = f"""
+{role}
+{create_youtube_prompt_base(params)}
+{body}"""
+    return PromptText(prefix, f"{create_chapter_instruction(params)}\n{closing}")
+
+# 動画の種類ごとのスタイル（先頭が省略時の既定値）
+TWOCH_STYLES = {'love-story': '恋愛','work-life': '職場','school-life': '学校','family': '家族','mystery': '不思議体験','revenge': '復讐','success': '成功体験','heartwarming': 'ほっこり・感動','shuraba': '修羅場','occult': '洒落怖・ホラー','history': '歴史・偉人語り'}
+KAIGAI_STYLES = {'praise': '日本称賛','technology': '技術・経済','moving': '感動・ほっこり','vs': '嫌中・比較','food': '食文化・料理','history': '歴史・伝統','anime': 'アニメ・漫画感想','culture_shock': '日常・カルチャーショック','social': '社会・ニュース'}
+SUKATTO_STYLES = {'revenge': '復讐劇','dqn': 'DQN返し','karma': '因果応報','workplace': '職場の逆転劇','neighbor': 'ご近所トラブル','in_laws': '嫁姑問題','cheating': '浮気・不倫の制裁','manners': 'マナー違反への天罰','monster_parent': 'モンスターペアレント撃退','history': 'スカッと偉人伝'}
+
+def create_2ch_video_prompt(params: Dict) -> str:
+    style_settings = TWOCH_STYLES
+    body = f"""【設定】
+- 動画のテーマ: {params.get('theme')}
+- スレッドの雰囲気: {style_settings.get(params.get('style'))}
+【台本要件】
+- 興味を引くスレッドタイトルを考える。
+- 主人公「スレ主」、反応する「住民A」「住民B」などを登場させる。
+- 物語に山場とオチを作る。
+【出力形式】
+語り手（{params.get('pov_character')}）: 「（オープニングや状況説明、心の声など）」
+【テロップ】: （スレッドタイトル）
+スレ主: 「（投稿内容）」
+住民A: 「（レス）」
+（以下、この形式を繰り返して物語を完成させる）"""
+    return build_youtube_prompt("あなたは人気YouTube動画の台本作家です。", params, body, "以上の要件を厳守し、最高の2ch風動画台本を作成してください。")
+
+def create_kaigai_hanno_prompt(params: Dict) -> str:
+    style_details = KAIGAI_STYLES
+    body = f"""【設定】
+- 動画のテーマ: {params.get('theme')}
+- 動画のスタイル: {style_details.get(params.get('style'))}
+【台本の構成案】
+1. オープニング
+2. テーマの概要説明
+3. 海外の反応（メインパート）
+4. エンディング
+【出力形式】
+- ナレーターのセリフ、引用コメント、テロップ指示を明確に分けて記述してください。"""
+    return build_youtube_prompt("あなたは「海外の反応」系YouTubeチャンネルのプロの台本作家です。", params, body, "最高の台本を作成してください。")
+
+def create_sukatto_prompt(params: Dict) -> str:
+    style_details = SUKATTO_STYLES
+    body = f"""【設定】
+- 物語のテーマ: {params.get('theme')}
+- 物語のスタイル: {style_details.get(params.get('style'))}
+【台本の構成案】
+1. プロローグ（最悪な状況）
+2. 葛藤・我慢
+3. 転機（反撃の狼煙）
+4. クライマックス（スカッとタイム）
+5. エピローグ（悪役の末路と主人公の未来）
+【出力形式】
+- 登場人物の名前を具体的に設定してください。
+- 語り手({params.get('pov_character')})、他の登場人物のセリフ、ト書きを明確に分けて記述してください。"""
+    return build_youtube_prompt("あなたは「スカッと系」YouTubeチャンネルのプロの台本作家です。", params, body, "最高のスカッと系台本を作成してください。")
+
+def create_name_prompt(params: Dict) -> str:
+    format_instructions = {'manga': 'マンガのネーム','4koma': '4コマ漫画のネーム','storyboard': 'アニメの絵コンテ','webtoon': 'ウェブトゥーン形式'}
+    prompt = f"""
+あなたはプロの漫画家・演出家です。以下のストーリーを{format_instructions.get(params.get('format', 'manga'))}に構成してください。
+【ストーリー概要】: {params.get('story')}
+{create_bible_context(params)}【ページ数】: {params.get('pages', 20)}ページ
+【形式】: {params.get('format', 'manga')}
+【出力形式】
+各ページ/コマごとに：- ページ/コマ番号 - コマ割り指示 - 登場人物の配置 - セリフ・モノローグ - 動作・表情指示 - 背景・効果音指示
+読者が映像として想像しやすく、感情移入できるネームを作成してください。"""
+    return prompt
+
+SECONDARY_CHECK_POINTS = {
+    'plot_holes': '物語のプロット（構成）に矛盾や破綻、ご都合主義な点がないか探し、具体的な改善案を提示してください。',
+    'character_consistency': '登場人物の言動や性格に一貫性があるか確認してください。矛盾している点があれば指摘し、キャラクターの魅力を高めるための提案をしてください。',
+    'dialogue_polish': 'セリフが陳腐であったり、説明的すぎたりしないかチェックしてください。よりキャラクターの個性が際立ち、生き生きとした会話になるようにリライト案を提示してください。',
+    'pacing_improvement': '物語のテンポは適切か確認してください。中だるみしている部分や、展開が早すぎる部分を指摘し、緩急のある魅力的な展開にするための改善案を提案してください。'
+}
+SECONDARY_CHECK_LABELS = {'plot_holes': 'プロットの穴・矛盾チェック', 'character_consistency': 'キャラクターの一貫性チェック', 'dialogue_polish': 'セリフの洗練', 'pacing_improvement': '物語のテンポ改善'}
+
+def create_secondary_check_prompt(params: Dict) -> PromptText:
+    """推敲・二次チェック用のプロンプト（元のテキストまでを固定部分とし、観点が違っても同じ原稿なら共通にする）"""
+    check_points = SECONDARY_CHECK_POINTS
+    prefix = f"""
+あなたは超一流の脚本家、または編集者です。
+以下の【元のテキスト】を、最後に指定する【チェック項目】に従って、プロの視点から厳しくチェックし、具体的な改善提案を出してください。
+{create_bible_context(params)}
+【元のテキスト】
+---
+{params.get('text_to_check')}
+---
+"""
+    suffix = f"""
+【チェック項目】
+{check_points.get(params.get('check_type'))}
+
+【出力形式】
+1. **総評**: 全体を読んだ上での良い点と、最も改善が必要な点を簡潔に述べてください。
+2. **具体的な問題点の指摘と改善案**:
+   - (問題箇所1の引用) → (問題点の指摘) → (具体的な改善案やリライト例)
+   - (問題箇所2の引用) → (問題点の指摘) → (具体的な改善案やリライト例)
+   - (以下、問題点を複数挙げる)
+3. **総合的な改善後のプロット/文章の提案**: 可能であれば、指摘事項を反映した改善後の全体の流れや、新しいシーンのアイデアなどを提案してください。
+
+あなたの厳しい視点と的確なアドバイスで、この作品を一段上のレベルに引き上げてください。"""
+    return PromptText(prefix, suffix)
+
+def create_chunk_secondary_check_prompt(params: Dict) -> str:
+    """編集後の再チェックで、変更された部分だけを二次チェックするプロンプト（結果はJSONで受け取る）"""
+    prompt = f"""
+あなたは超一流の脚本家、または編集者です。原稿の一部が書き直されたため、書き直された【チェック対象】だけを、最後に指定する【チェック項目】に従って厳しくチェックしてください。
+【前後の文脈】は参考用です。文脈の部分への指摘は不要です。
+{create_bible_context(params)}【前の文脈】
+{params.get('context_before') or '（原稿の先頭です）'}
+【チェック対象】
+<<<
+{params.get('text')}
+>>>
+【後の文脈】
+{params.get('context_after') or '（原稿の末尾です）'}
+【チェック項目】
+{SECONDARY_CHECK_POINTS.get(params.get('check_type'))}
+【出力形式】
+次のJSONだけを出力してください（コードブロックや説明文は不要です）。
+{{"findings": [{{"quote": "問題箇所（チェック対象からそのまま抜き出す）", "problem": "問題点の指摘", "suggestion": "具体的な改善案やリライト例"}}]}}
+問題がない場合は findings を空の配列にしてください。"""
+    return prompt
+
+def create_judge_prompt(params: Dict) -> str:
+    """同じ依頼から生成した複数の台本候補を採点させるプロンプト（結果はJSONで受け取る）"""
+    candidates = "\n\n".join(f"【候補{i}】\n---\n{text}\n---" for i, text in enumerate(params['candidates'], start=1))
+    prompt = f"""
+あなたはYouTube台本の編集長です。同じ依頼から書かれた{len(params['candidates'])}本の台本候補を読み比べ、それぞれを10点満点で採点してください。
+【依頼内容】
+- テーマ: {params.get('theme') or '未指定'}
+- 台本の種類: {params.get('content_type') or '台本'}
+【採点基準】
+- 冒頭で視聴者を引き込めているか、山場とオチ（スカッと感・感動）が明確か
+- 依頼された構成・形式を守っているか
+- セリフが自然で、登場人物の個性が立っているか
+{candidates}
+【出力形式】
+以下のJSON配列だけを出力してください。説明文やコードブロックは付けないでください。
+[{{"index": 1, "score": 8, "reason": "（一文で採点理由）"}}]"""
+    return prompt
+
+# ===============================================================================
+# 長編台本の章別生成用プロンプト
+# ===============================================================================
+CHAPTER_TITLES = ['第一章: 発端', '第二章: 展開', '第三章: 転機', '第四章: クライマックス', '第五章: 結末']
+
+def create_outline_prompt(params: Dict) -> str:
+    """章別生成の前段となるアウトライン生成用プロンプト"""
+    base_prompt = params['prompt_func'](dict(params['params'], length='standard'))
+    chapter_lines = "\n".join(f"{title}: （この章の出来事を2～3行で要約）" for title in CHAPTER_TITLES)
+    prompt = f"""
+あなたは長編YouTube台本の構成作家です。以下の台本依頼について、本文を書く前に全5章のアウトラインだけを作成してください。
+【台本依頼】
+{base_prompt}
+【出力要件】
+- 登場人物の名前と立場を最初に1行ずつ列挙してください。
+- 各章の要約は、その章の終わりで物語がどういう状態になっているかが分かるように書いてください。
+- 本文やセリフは書かないでください。
+【出力形式】
+登場人物: （名前と立場）
+{chapter_lines}"""
+    return prompt
+
+def split_outline_summaries(outline: str) -> list:
+    """アウトラインから章ごとの要約を取り出す（見つからない章は空文字）"""
+    summaries = []
+    for title in CHAPTER_TITLES:
+        match = re.search(rf"{re.escape(title)}[:：]?\s*(.+)", outline)
+        summaries.append(match.group(1).strip() if match else "")
+    return summaries
+
+def build_chapter_params(params: Dict, outline: str) -> list:
+    """各章の生成パラメータを作成"""
+    summaries = split_outline_summaries(outline)
+    chapter_params = []
+    for i, title in enumerate(CHAPTER_TITLES):
+        previous = "\n".join(f"{CHAPTER_TITLES[j]}: {summaries[j]}" for j in range(i) if summaries[j]) or "（これが最初の章です）"
+        chapter = {'index': i, 'title': title, 'outline': outline, 'previous_summary': previous, 'is_last': i == len(CHAPTER_TITLES) - 1}
+        chapter_params.append(dict(params, chapter=chapter))
+    return chapter_params
+
+# ===============================================================================
+# 長編ネームのページ分割生成用プロンプト
+# ===============================================================================
+NAME_FORMAT_LABELS = {'manga': 'マンガのネーム', '4koma': '4コマ漫画のネーム', 'storyboard': 'アニメの絵コンテ', 'webtoon': 'ウェブトゥーン形式'}
+
+def create_beat_sheet_prompt(params: Dict) -> str:
+    """ページ分割生成の前段となる、ページごとのビートシート生成用プロンプト"""
+    pages = int(params.get('pages', 20))
+    prompt = f"""
+あなたはプロの漫画家・演出家です。以下のストーリーを全{pages}ページの{NAME_FORMAT_LABELS.get(params.get('format', 'manga'))}にするため、コマ割りに入る前のページごとのビートシートだけを作成してください。
+【ストーリー概要】: {params.get('story')}
+{create_bible_context(params)}【ページ数】: {pages}ページ
+【出力要件】
+- 登場人物の名前・外見・口調と、舞台設定を最初に1行ずつ書いてください。
+- 1ページから{pages}ページまで、すべてのページについて、そのページで起きる出来事と見せ場を1行で書いてください。
+- 見開きや引きのページ（次のページへの期待を持たせる終わり方）も意識してください。コマ割りやセリフは書かないでください。
+【出力形式】
+登場人物: （名前・外見・口調）
+舞台: （時代・場所・雰囲気）
+1ページ: （このページの出来事）
+2ページ: （このページの出来事）
+（以下、{pages}ページまで）"""
+    return prompt
+
+def create_name_pages_prompt(params: Dict) -> PromptText:
+    """ビートシートに沿って、指定したページ範囲のネームを作成するプロンプト（登場人物・舞台・ビートシートまでを固定部分として全範囲で共通にする）"""
+    shard = params['shard']
+    prefix = f"""
+あなたはプロの漫画家・演出家です。全{params.get('pages', 20)}ページの{NAME_FORMAT_LABELS.get(params.get('format', 'manga'))}を、ページ範囲ごとに分担して作成しています。
+【ストーリー概要】: {params.get('story')}
+【形式】: {params.get('format', 'manga')}
+{create_bible_context(params)}【登場人物】: {shard['characters'] or '（ストーリー概要から決めてください）'}
+【舞台】: {shard['setting'] or '（ストーリー概要から決めてください）'}
+【ページごとのビートシート】
+{shard['beat_sheet']}
+"""
+    suffix = f"""
+【担当ページ】: {shard['start']}～{shard['end']}ページ
+【直前のページ】: {shard['previous_beat'] or '（これが最初のページです）'}
+【直後のページ】: {shard['next_beat'] or '（これが最後のページです）'}
+担当ページだけを、ビートシートの各ページの出来事に沿って作成してください。前後のページとつながるように、登場人物の外見・口調は上の設定を守ってください。
+【出力形式】
+次のJSONだけを出力してください（コードブロックや説明文は不要です）。コマ（絵コンテの場合はカット）はページ内で読む順に並べてください。
+{{"pages": [{{"page": {shard['start']}, "panels": [{{"layout": "コマ割り指示", "characters": "登場人物の配置", "dialogue": "セリフ・モノローグ", "action": "動作・表情指示", "background": "背景・効果音指示"}}]}}]}}"""
+    return PromptText(prefix, suffix)
+
+# ===============================================================================
+# プロンプト関数の対応表
+# ===============================================================================
+VIDEO_PROMPT_FUNCS = {'sukatto': create_sukatto_prompt, '2ch': create_2ch_video_prompt, 'kaigai': create_kaigai_hanno_prompt}
+VIDEO_TYPE_ALIASES = {'スカッと系動画': 'sukatto', 'スカッと系': 'sukatto', 'スカッと': 'sukatto', '2ch風動画': '2ch', '2ch風': '2ch', '海外の反応動画': 'kaigai', '海外の反応': 'kaigai'}
+VIDEO_LENGTHS = ['super_short', 'short', 'standard', 'long', 'super_long']
+VIDEO_STYLES = {'sukatto': SUKATTO_STYLES, '2ch': TWOCH_STYLES, 'kaigai': KAIGAI_STYLES}
+
+def resolve_video_style(video_type: str, style) -> str:
+    """動画の種類に合ったスタイルを返す（空なら種類ごとの先頭のスタイル、不明な値はValueError）"""
+    styles = VIDEO_STYLES[video_type]
+    if not style:
+        return next(iter(styles))
+    if style not in styles:
+        raise ValueError(f"不明なスタイルです: {style}（{video_type}: {', '.join(styles)}）")
+    return style
+OUTLINE_FIELDS = ['protagonist_setting', 'story_start', 'story_development', 'story_turn', 'story_ending']
+
+PROMPT_FUNCS = {
+    'theme': create_theme_generation_prompt, 'plot': create_plot_prompt, 'script': create_script_prompt,
+    'proofread': create_error_check_prompt, 'name': create_name_prompt, 'check': create_secondary_check_prompt,
+    **VIDEO_PROMPT_FUNCS,
+}
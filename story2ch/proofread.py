@@ -0,0 +1,126 @@
+"""長文原稿の分割・並列校正（チャンクごとに校正して結合し、原文の文字位置付きの修正箇所一覧を作る）"""
+import re
+import json
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional
+
+from .client import add_usage, cached_generate
+from .jobqueue import cancellable, raise_if_cancelled
+from .prompts import create_chunk_error_check_prompt
+
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 200
+MAX_WORKERS = 8
+
+PARAGRAPH_PATTERN = re.compile(r'\n[ \t　]*\n+')
+SENTENCE_PATTERN = re.compile(r'[。！？!?]+[」』）)]*|\n')
+JSON_FENCE_PATTERN = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+def split_into_chunks(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list:
+    """段落（空行）・文末（。！？）の境界でテキストを分割し、前後overlap文字の文脈を付ける
+
+    各チャンクの校正対象範囲（start～end）は重ならずに原文全体を覆うので、修正後のチャンクをそのまま連結できる。
+    """
+    paragraph_ends = sorted({m.end() for m in PARAGRAPH_PATTERN.finditer(text)})
+    ends = sorted(set(paragraph_ends) | {m.end() for m in SENTENCE_PATTERN.finditer(text)})
+    bounds = []
+    start = 0
+    while len(text) - start > chunk_size:
+        limit = start + chunk_size
+        paragraph_cut = paragraph_ends[bisect_right(paragraph_ends, limit) - 1] if bisect_right(paragraph_ends, limit) else 0
+        sentence_cut = ends[bisect_right(ends, limit) - 1] if bisect_right(ends, limit) else 0
+        if paragraph_cut - start >= chunk_size // 2:
+            cut = paragraph_cut
+        elif sentence_cut > start:
+            cut = sentence_cut
+        else:
+            cut = limit
+        bounds.append((start, cut))
+        start = cut
+    if start < len(text) or not bounds:
+        bounds.append((start, len(text)))
+    return [{'index': i, 'start': s, 'end': e, 'text': text[s:e],
+             'context_before': text[max(0, s - overlap):s], 'context_after': text[e:e + overlap]}
+            for i, (s, e) in enumerate(bounds)]
+
+def parse_chunk_result(raw: str) -> Optional[Dict]:
+    """チャンク校正結果のJSONを読み取る（読めない場合はNone）"""
+    cleaned = JSON_FENCE_PATTERN.sub('', raw.strip())
+    match = re.search(r'\{.*\}', cleaned, re.S)
+    try:
+        data = json.loads(match.group(0) if match else cleaned)
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('corrected'), str):
+        return None
+    corrections = [c for c in data.get('corrections') or [] if isinstance(c, dict) and c.get('original')]
+    return {'corrected': data['corrected'], 'corrections': corrections}
+
+def keep_edge_whitespace(original: str, corrected: str) -> str:
+    """チャンク境界の改行・空白を原文どおりに戻す（連結時に段落がつながらないようにする）"""
+    lead = original[:len(original) - len(original.lstrip())]
+    trail = original[len(original.rstrip()):]
+    return lead + corrected.strip() + trail
+
+def locate_corrections(chunk: Dict, corrections: list) -> list:
+    """修正箇所の原文をチャンク内で探し、原文全体での文字位置を付ける（見つからない場合はNone）"""
+    located = []
+    cursor = 0
+    for correction in corrections:
+        position = chunk['text'].find(correction['original'], cursor)
+        if position < 0:
+            position = chunk['text'].find(correction['original'])
+        else:
+            cursor = position + len(correction['original'])
+        located.append({'offset': chunk['start'] + position if position >= 0 else None, 'original': correction['original'],
+                        'corrected': correction.get('corrected', ''), 'reason': correction.get('reason', '')})
+    return located
+
+def proofread_chunk(model, chunk: Dict, level: str, cache, read_cache: bool, bible: Optional[str] = None) -> Dict:
+    """1チャンクを校正する（ワーカースレッドで実行。bibleは設定資料の要約）"""
+    params = {'text': chunk['text'], 'context_before': chunk['context_before'], 'context_after': chunk['context_after'], 'level': level, 'bible': bible}
+    raw, usage, hit = cached_generate(model, create_chunk_error_check_prompt(params), cache, read_cache)
+    parsed = parse_chunk_result(raw)
+    if parsed is None:
+        return {'corrected': chunk['text'], 'corrections': [], 'usage': usage, 'cache_hit': hit, 'failed': True}
+    return {'corrected': keep_edge_whitespace(chunk['text'], parsed['corrected']), 'corrections': locate_corrections(chunk, parsed['corrections']),
+            'usage': usage, 'cache_hit': hit, 'failed': False}
+
+def proofread_chunked(model, text: str, level: str = 'basic', cache=None, read_cache: bool = True,
+                      chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP, max_workers: int = MAX_WORKERS,
+                      on_progress: Optional[Callable[[int, int], None]] = None, cancelled: Optional[threading.Event] = None,
+                      bible: Optional[str] = None) -> Dict:
+    """テキストをチャンクに分けて並列に校正し、修正済み全文と修正箇所一覧を返す
+
+    cancelledがセットされると残りのチャンクは校正せずにJobCancelledを送出する。bible（設定資料の要約）は各チャンクのプロンプトに差し込む。
+    """
+    chunks = split_into_chunks(text, chunk_size, overlap)
+    results = [None] * len(chunks)
+    if on_progress: on_progress(0, len(chunks))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        futures = {executor.submit(cancellable(proofread_chunk, cancelled), model, chunk, level, cache, read_cache, bible): chunk['index'] for chunk in chunks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            raise_if_cancelled(cancelled)
+            results[futures[future]] = future.result()
+            if on_progress: on_progress(done, len(chunks))
+
+    corrections = [c for result in results for c in result['corrections']]
+    hits = sum(1 for result in results if result['cache_hit'])
+    return {'corrected': "".join(result['corrected'] for result in results), 'corrections': corrections,
+            'failed_chunks': [chunks[i]['index'] for i, result in enumerate(results) if result['failed']],
+            'chunk_count': len(chunks), **add_usage(*(result['usage'] for result in results)),
+            'cache_hits': hits, 'cache_misses': len(results) - hits}
+
+def format_proofread_report(result: Dict) -> str:
+    """分割校正の結果を通常の校正結果と同じ見出しのテキストにまとめる"""
+    lines = ["1. 修正済みテキスト", result['corrected'].rstrip(), "", "2. 修正箇所一覧（原文、修正、理由）"]
+    if not result['corrections']:
+        lines.append("修正箇所はありません。")
+    for i, c in enumerate(result['corrections'], start=1):
+        position = f"{c['offset'] + 1:,}文字目" if c['offset'] is not None else "位置不明"
+        lines.append(f"{i}. [{position}] {c['original']} → {c['corrected']}（{c['reason']}）")
+    if result['failed_chunks']:
+        lines += ["", f"※ {len(result['failed_chunks'])}/{result['chunk_count']}個のチャンクは校正結果を読み取れなかったため原文のままです。"]
+    return "\n".join(lines)
@@ -0,0 +1,210 @@
+"""編集後の再チェック（前回チェックした版と段落単位で差分をとり、変更された段落と前後の文脈だけをAIに送って、変更のない段落の前回の指摘と統合する）"""
+import re
+import json
+import threading
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional
+
+from .client import add_usage, cached_generate
+from .jobqueue import cancellable, raise_if_cancelled
+from .proofread import CHUNK_OVERLAP, CHUNK_SIZE, JSON_FENCE_PATTERN, MAX_WORKERS, PARAGRAPH_PATTERN, format_proofread_report, proofread_chunk, split_into_chunks
+from .prompts import create_chunk_secondary_check_prompt
+
+# 二次チェック結果の「- (問題箇所の引用) → (問題点の指摘) → (改善案)」の行
+SECONDARY_FINDING_PATTERN = re.compile(r'^\s*(?:[-*・]|\d+[.．)])\s*(.+?)\s*→\s*(.+?)(?:\s*→\s*(.+))?\s*$', re.M)
+SUMMARY_PATTERN = re.compile(r'総評\**\s*[:：]?\**\s*(.*?)(?=\n\s*\**2\.|\Z)', re.S)
+QUOTE_TRIM = '「」『』()（）"\'“”*: 　'
+
+# ===============================================================================
+# 段落単位の差分
+# ===============================================================================
+def paragraph_spans(text: str) -> list:
+    """段落ごとの(開始, 終了)（段落の後の空行は直前の段落に含め、全体で原文を覆う）"""
+    ends = [m.end() for m in PARAGRAPH_PATTERN.finditer(text)]
+    return [(start, end) for start, end in zip([0] + ends, ends + [len(text)]) if end > start]
+
+def diff_paragraphs(old: str, new: str) -> Dict:
+    """段落単位で差分をとり、変更のない段落の対応（旧開始, 旧終了, 新開始）と、新しい原文で変更された範囲を返す"""
+    old_spans, new_spans = paragraph_spans(old), paragraph_spans(new)
+    # 段落の後の空行の数だけが変わった場合は同じ段落とみなす
+    matcher = SequenceMatcher(None, [old[s:e].rstrip() for s, e in old_spans], [new[s:e].rstrip() for s, e in new_spans], autojunk=False)
+    unchanged, changed = [], []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            unchanged += [(old_spans[i][0], old_spans[i][1], new_spans[j][0]) for i, j in zip(range(i1, i2), range(j1, j2))]
+        elif j2 > j1:
+            changed.append((new_spans[j1][0], new_spans[j2 - 1][1], j2 - j1))
+    return {'unchanged': unchanged, 'changed': [(start, end) for start, end, _ in changed],
+            'changed_paragraphs': sum(count for _, _, count in changed), 'paragraphs': len(new_spans)}
+
+def changed_chunks(text: str, changed: list, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list:
+    """変更された範囲をチェック単位に分け、前後overlap文字の文脈を付ける（長い範囲は段落・文の区切りでさらに分ける）"""
+    chunks = []
+    for start, end in changed:
+        for piece in split_into_chunks(text[start:end], chunk_size, 0):
+            s, e = start + piece['start'], start + piece['end']
+            chunks.append({'index': len(chunks), 'start': s, 'end': e, 'text': text[s:e],
+                           'context_before': text[max(0, s - overlap):s], 'context_after': text[e:e + overlap]})
+    return chunks
+
+def carry_over(items: list, unchanged: list, key: str) -> list:
+    """前回の指摘のうち変更のない段落に収まるものを、新しい原文での位置に移して返す（keyは指摘箇所の原文の項目名）"""
+    carried = []
+    for item in items:
+        if item.get('offset') is None:
+            continue
+        end = item['offset'] + len(item.get(key) or '')
+        for old_start, old_end, new_start in unchanged:
+            if old_start <= item['offset'] and end <= old_end:
+                carried.append(dict(item, offset=new_start + item['offset'] - old_start))
+                break
+    return carried
+
+def offset_order(item: Dict) -> tuple:
+    """位置順（位置不明は最後）"""
+    return (item.get('offset') is None, item.get('offset') or 0)
+
+def run_chunks(func: Callable[[Dict], Dict], chunks: list, max_workers: int, on_progress: Optional[Callable[[int, int], None]],
+               cancelled: Optional[threading.Event] = None) -> list:
+    """チャンクごとのチェックを並列に実行し、チャンク順の結果を返す（cancelledがセットされると残りのチャンクはチェックせずにJobCancelledを送出）"""
+    results = [None] * len(chunks)
+    if not chunks:
+        return results
+    if on_progress: on_progress(0, len(chunks))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        futures = {executor.submit(cancellable(func, cancelled), chunk): chunk['index'] for chunk in chunks}
+        for done, future in enumerate(as_completed(futures), start=1):
+            raise_if_cancelled(cancelled)
+            results[futures[future]] = future.result()
+            if on_progress: on_progress(done, len(chunks))
+    return results
+
+def recheck_summary(diff: Dict, chunks: list, results: list, reused: int, text: str) -> Dict:
+    """再チェックの規模・使用量・キャッシュの集計"""
+    hits = sum(1 for result in results if result['cache_hit'])
+    return {'failed_chunks': [chunks[i]['index'] for i, result in enumerate(results) if result['failed']], 'chunk_count': len(chunks),
+            **add_usage(*(result['usage'] for result in results)), 'cache_hits': hits, 'cache_misses': len(results) - hits,
+            'changed_paragraphs': diff['changed_paragraphs'], 'paragraphs': diff['paragraphs'],
+            'checked_chars': sum(len(chunk['text']) for chunk in chunks), 'total_chars': len(text), 'reused': reused}
+
+def recheck_note(result: Dict) -> str:
+    """再チェックの範囲の説明"""
+    if not result['chunk_count']:
+        return f"※ 前回チェックした版から変更がないため、AIを呼ばずに前回の指摘{result['reused']}件をそのまま表示しています。"
+    return (f"※ 前回チェックした版から変更された{result['changed_paragraphs']}/{result['paragraphs']}段落（{result['checked_chars']:,}/{result['total_chars']:,}文字）"
+            f"だけを再チェックし、変更のない段落の前回の指摘{result['reused']}件を引き継ぎました。")
+
+# ===============================================================================
+# 校正の再チェック
+# ===============================================================================
+def proofread_base(text: str, level: str, corrections: list) -> Dict:
+    """次回の再チェックのために保持する校正結果"""
+    return {'kind': '校正', 'text': text, 'level': level, 'corrections': corrections}
+
+def apply_corrections(text: str, corrections: list, start: int, end: int) -> str:
+    """原文のstart～endに、位置付きの修正を適用する（原文が一致しない・重なる修正は適用しない）"""
+    pieces, cursor = [], start
+    for c in corrections:
+        offset = c['offset']
+        if offset < cursor or offset + len(c['original']) > end or not text.startswith(c['original'], offset):
+            continue
+        pieces += [text[cursor:offset], c['corrected']]
+        cursor = offset + len(c['original'])
+    pieces.append(text[cursor:end])
+    return "".join(pieces)
+
+def recheck_proofread(model, base: Dict, text: str, level: str = 'basic', cache=None, read_cache: bool = True,
+                      max_workers: int = MAX_WORKERS, on_progress: Optional[Callable[[int, int], None]] = None,
+                      cancelled: Optional[threading.Event] = None, bible: Optional[str] = None) -> Dict:
+    """前回の校正結果（base）と比べて変更された段落だけを並列に校正し、変更のない段落の修正箇所と合わせて返す
+
+    変更のない段落の修正済みテキストは、前回の修正箇所を原文に適用して作る。
+    """
+    diff = diff_paragraphs(base['text'], text)
+    chunks = changed_chunks(text, diff['changed'])
+    results = run_chunks(lambda chunk: proofread_chunk(model, chunk, level, cache, read_cache, bible), chunks, max_workers, on_progress, cancelled)
+    carried = sorted(carry_over(base['corrections'], diff['unchanged'], 'original'), key=offset_order)
+    pieces, cursor = [], 0
+    for chunk, result in zip(chunks, results):
+        pieces += [apply_corrections(text, carried, cursor, chunk['start']), result['corrected']]
+        cursor = chunk['end']
+    pieces.append(apply_corrections(text, carried, cursor, len(text)))
+    corrections = sorted(carried + [c for result in results for c in result['corrections']], key=offset_order)
+    return {'corrected': "".join(pieces), 'corrections': corrections, **recheck_summary(diff, chunks, results, len(carried), text)}
+
+def format_proofread_recheck_report(result: Dict) -> str:
+    """校正の再チェック結果を通常の分割校正と同じ見出しのテキストにまとめる"""
+    return format_proofread_report(result) + "\n\n" + recheck_note(result)
+
+# ===============================================================================
+# 二次チェックの再チェック
+# ===============================================================================
+def parse_secondary_findings(report: str, text: str) -> list:
+    """二次チェック結果から「(引用) → (指摘) → (改善案)」の行を取り出し、引用を原文で探して位置を付ける（見つからない場合はNone）"""
+    findings = []
+    for m in SECONDARY_FINDING_PATTERN.finditer(report):
+        quote = m.group(1).strip(QUOTE_TRIM)
+        offset = text.find(quote) if quote else -1
+        findings.append({'quote': quote, 'problem': m.group(2).strip(), 'suggestion': (m.group(3) or '').strip(),
+                         'offset': offset if offset >= 0 else None})
+    return findings
+
+def secondary_base(text: str, check_type: str, summary: str, findings: list) -> Dict:
+    """次回の再チェックのために保持する二次チェック結果"""
+    return {'kind': '二次チェック', 'text': text, 'check_type': check_type, 'summary': summary, 'findings': findings}
+
+def secondary_base_from_report(text: str, check_type: str, report: str) -> Dict:
+    """通常の二次チェック結果のテキストから、総評と位置付きの指摘を取り出して保持する"""
+    summary = SUMMARY_PATTERN.search(report)
+    return secondary_base(text, check_type, summary.group(1).strip() if summary else '', parse_secondary_findings(report, text))
+
+def parse_secondary_chunk_result(raw: str) -> Optional[list]:
+    """変更部分の二次チェック結果のJSONを読み取る（読めない場合はNone）"""
+    cleaned = JSON_FENCE_PATTERN.sub('', raw.strip())
+    match = re.search(r'\{.*\}', cleaned, re.S)
+    try:
+        data = json.loads(match.group(0) if match else cleaned)
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('findings'), list):
+        return None
+    return [f for f in data['findings'] if isinstance(f, dict) and (f.get('problem') or f.get('quote'))]
+
+def secondary_check_chunk(model, chunk: Dict, check_type: str, cache, read_cache: bool, bible: Optional[str] = None) -> Dict:
+    """変更された1チャンクを二次チェックする（ワーカースレッドで実行。bibleは設定資料の要約）"""
+    params = {'text': chunk['text'], 'context_before': chunk['context_before'], 'context_after': chunk['context_after'], 'check_type': check_type, 'bible': bible}
+    raw, usage, hit = cached_generate(model, create_chunk_secondary_check_prompt(params), cache, read_cache)
+    parsed = parse_secondary_chunk_result(raw)
+    if parsed is None:
+        return {'findings': [], 'usage': usage, 'cache_hit': hit, 'failed': True}
+    findings = []
+    for f in parsed:
+        quote = str(f.get('quote') or '').strip(QUOTE_TRIM)
+        position = chunk['text'].find(quote) if quote else -1
+        findings.append({'quote': quote, 'problem': str(f.get('problem') or ''), 'suggestion': str(f.get('suggestion') or ''),
+                         'offset': chunk['start'] + position if position >= 0 else None})
+    return {'findings': findings, 'usage': usage, 'cache_hit': hit, 'failed': False}
+
+def recheck_secondary(model, base: Dict, text: str, check_type: str, cache=None, read_cache: bool = True,
+                      max_workers: int = MAX_WORKERS, on_progress: Optional[Callable[[int, int], None]] = None,
+                      cancelled: Optional[threading.Event] = None, bible: Optional[str] = None) -> Dict:
+    """前回の二次チェック結果（base）と比べて変更された段落だけを並列にチェックし、変更のない段落の指摘と合わせて返す（総評は前回のもの）"""
+    diff = diff_paragraphs(base['text'], text)
+    chunks = changed_chunks(text, diff['changed'])
+    results = run_chunks(lambda chunk: secondary_check_chunk(model, chunk, check_type, cache, read_cache, bible), chunks, max_workers, on_progress, cancelled)
+    carried = carry_over(base['findings'], diff['unchanged'], 'quote')
+    findings = sorted(carried + [f for result in results for f in result['findings']], key=offset_order)
+    return {'summary': base['summary'], 'findings': findings, **recheck_summary(diff, chunks, results, len(carried), text)}
+
+def format_secondary_recheck_report(result: Dict) -> str:
+    """二次チェックの再チェック結果を通常の二次チェックと同じ見出しのテキストにまとめる"""
+    lines = ["1. **総評**（前回チェックした版に対する総評です）", result['summary'] or "（前回の総評はありません）", "", "2. **具体的な問題点の指摘と改善案**:"]
+    if not result['findings']:
+        lines.append("   - 指摘はありません。")
+    for f in result['findings']:
+        position = f"（{f['offset'] + 1:,}文字目）" if f['offset'] is not None else ""
+        lines.append(f"   - 「{f['quote']}」{position} → {f['problem']}" + (f" → {f['suggestion']}" if f['suggestion'] else ""))
+    if result['failed_chunks']:
+        lines += ["", f"※ {len(result['failed_chunks'])}/{result['chunk_count']}個の変更部分はチェック結果を読み取れませんでした。"]
+    return "\n".join(lines + ["", recheck_note(result)])
@@ -0,0 +1,225 @@
+"""タスクに応じたモデルの振り分けと、429/5xx時のフォールバック（指数バックオフ・サーキットブレーカー付き）"""
+import os
+import time
+import random
+import sqlite3
+import threading
+from typing import Callable, Dict, Optional
+
+from .client import create_model
+
+# タスクの種類ごとのモデル候補（先頭から順に使い、失敗したら次のモデルへ）
+DEFAULT_ROUTES = {
+    'fast': ['gemini-2.0-flash-lite', 'gemini-2.0-flash-exp', 'gemini-2.0-flash'],
+    'standard': ['gemini-2.0-flash-exp', 'gemini-2.0-flash', 'gemini-2.0-flash-lite'],
+    'long': ['gemini-1.5-pro', 'gemini-2.0-flash-exp', 'gemini-2.0-flash'],
+}
+TASK_LABELS = {'fast': '⚡ 短いタスク', 'standard': '📝 標準', 'long': '📚 長文'}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded', 'BadGateway', 'GatewayTimeout'}
+MAX_RETRIES = 2
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+CALL_LOG_PATH = os.environ.get("STORY_CALL_LOG_PATH", os.path.join(".story_cache", "calls.sqlite3"))
+
+def classify_task(prompt_func, params: Dict) -> str:
+    """プロンプト関数とパラメータからタスクの種類（fast / standard / long）を決める"""
+    name = getattr(prompt_func, '__name__', '')
+    if name == 'create_theme_generation_prompt':
+        return 'fast'
+    if name in ('create_error_check_prompt', 'create_chunk_error_check_prompt', 'create_region_error_check_prompt'):
+        return 'fast' if params.get('level', 'basic') == 'basic' else 'standard'
+    if params.get('length') in ('long', 'super_long') or int(params.get('pages') or 0) > 20:
+        return 'long'
+    return 'standard'
+
+def is_retryable(error: Exception) -> bool:
+    """レート制限（429）やサーバーエラー（5xx）など、別のモデルや時間をおいた再試行で回復しうるエラーか"""
+    code = getattr(error, 'code', None)
+    try:
+        if code is not None and int(code) in RETRYABLE_STATUS_CODES:
+            return True
+    except (TypeError, ValueError):
+        pass
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+def backoff_delay(attempt: int) -> float:
+    """指数バックオフ（フルジッター）の待ち時間"""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+class CircuitBreaker:
+    """モデルごとのサーキットブレーカー（連続失敗で一定時間そのモデルを使わない）
+
+    遮断から一定時間が過ぎると、試行のリクエストを1件だけ通し、その結果が出るまで他のリクエストは遮断したままにする。
+    試行の結果が記録されないまま同じ時間が過ぎた場合は、次の1件を新しい試行として通す。
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_seconds: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_at = None
+
+    @property
+    def state(self) -> str:
+        """closed（通常）/ open（遮断中）/ half-open（試行可）"""
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'half-open' if self._clock() - self._opened_at >= self.reset_seconds else 'open'
+
+    def allow(self) -> bool:
+        """このモデルにリクエストを送ってよいか（half-openでは試行の1件だけTrue）"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = self._clock()
+            if now - self._opened_at < self.reset_seconds:
+                return False
+            if self._trial_at is not None and now - self._trial_at < self.reset_seconds:
+                return False
+            self._trial_at = now
+            return True
+
+    def record_success(self):
+        """成功を記録して遮断を解除"""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_at = None
+
+    def record_failure(self):
+        """失敗を記録し、しきい値に達したら遮断（試行が失敗した場合は遮断し直す）"""
+        with self._lock:
+            self._failures += 1
+            self._trial_at = None
+            if self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+
+class CallLog:
+    """モデル呼び出しの実績（どのモデルが応答したか・レイテンシ・トークン数）をSQLiteに記録する"""
+
+    def __init__(self, path: str = CALL_LOG_PATH):
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, task TEXT NOT NULL, model TEXT NOT NULL,
+            latency_sec REAL NOT NULL, input_tokens INTEGER, output_tokens INTEGER, ok INTEGER NOT NULL, error TEXT)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_calls_model ON calls (model, created_at)")
+        self._conn.commit()
+
+    def record(self, task: str, model: str, latency_sec: float, input_tokens: Optional[int], output_tokens: Optional[int], error: Optional[str] = None):
+        """呼び出し1回分を記録"""
+        with self._lock:
+            self._conn.execute("INSERT INTO calls (created_at, task, model, latency_sec, input_tokens, output_tokens, ok, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (time.time(), task, model, latency_sec, input_tokens, output_tokens, int(error is None), error))
+            self._conn.commit()
+
+    def summary(self, since_seconds: float = 7 * 24 * 60 * 60) -> list:
+        """タスク・モデル別の呼び出し回数・失敗数・平均レイテンシ・平均トークン数"""
+        with self._lock:
+            rows = self._conn.execute("""SELECT task, model, COUNT(*), SUM(1 - ok), AVG(CASE WHEN ok THEN latency_sec END),
+                AVG(input_tokens), AVG(output_tokens) FROM calls WHERE created_at >= ? GROUP BY task, model ORDER BY task, COUNT(*) DESC""",
+                                      (time.time() - since_seconds,)).fetchall()
+        return [{'task': r[0], 'model': r[1], 'calls': r[2], 'failures': r[3], 'avg_latency_sec': round(r[4] or 0, 2),
+                 'avg_input_tokens': int(r[5] or 0), 'avg_output_tokens': int(r[6] or 0)} for r in rows]
+
+class ModelRouter:
+    """タスクの種類に応じてモデルを選び、失敗時は再試行と次のモデルへのフォールバックを行う（プロセス全体で共有）"""
+
+    def __init__(self, api_key: str, routes: Optional[Dict] = None, call_log: Optional[CallLog] = None,
+                 model_factory: Optional[Callable] = None, sleep: Callable[[float], None] = time.sleep):
+        self.api_key = api_key
+        self.routes = routes or DEFAULT_ROUTES
+        self.call_log = call_log
+        self._model_factory = model_factory or create_model
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._models = {}
+        self._breakers = {}
+
+    def model(self, name: str):
+        """モデル名からGenerativeModelを取得（作成済みなら再利用）"""
+        with self._lock:
+            if name not in self._models:
+                self._models[name] = self._model_factory(self.api_key, name)
+            return self._models[name]
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        """モデルのサーキットブレーカーを取得"""
+        with self._lock:
+            return self._breakers.setdefault(name, CircuitBreaker())
+
+    def breaker_states(self) -> Dict:
+        """モデルごとのサーキットブレーカーの状態"""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.state for name, breaker in breakers.items()}
+
+    def for_task(self, task: str) -> 'RoutedModel':
+        """タスクに振り分けるモデルとして使えるオブジェクトを取得"""
+        return RoutedModel(self, task)
+
+    def generate(self, task: str, prompt, **kwargs):
+        """候補モデルを順に試して生成し、応答したモデル名をレスポンスのserved_modelに付ける"""
+        candidates = self.routes.get(task) or self.routes['standard']
+        last_error = None
+        for name in candidates:
+            breaker = self.breaker(name)
+            if not breaker.allow():
+                continue
+            for attempt in range(MAX_RETRIES + 1):
+                started = time.monotonic()
+                try:
+                    response = self.model(name).generate_content(prompt, **kwargs)
+                except Exception as e:
+                    self._log(task, name, time.monotonic() - started, None, None, type(e).__name__)
+                    if not is_retryable(e):
+                        raise
+                    last_error = e
+                    if attempt < MAX_RETRIES:
+                        self._sleep(backoff_delay(attempt))
+                    continue
+                breaker.record_success()
+                metadata = None if kwargs.get('stream') else getattr(response, 'usage_metadata', None)
+                self._log(task, name, time.monotonic() - started,
+                          getattr(metadata, 'prompt_token_count', None), getattr(metadata, 'candidates_token_count', None), None)
+                try:
+                    response.served_model = name
+                except AttributeError:
+                    pass
+                return response
+            breaker.record_failure()
+        if last_error is not None:
+            raise last_error
+        raise RuntimeError(f"利用可能なモデルがありません（すべて一時停止中）: {', '.join(candidates)}")
+
+    def _log(self, task, model, latency_sec, input_tokens, output_tokens, error):
+        if self.call_log is not None:
+            self.call_log.record(task, model, round(latency_sec, 3), input_tokens, output_tokens, error)
+
+class RoutedModel:
+    """ModelRouterをGenerativeModelと同じように使うためのラッパー（タスクの種類を固定）"""
+
+    def __init__(self, router: ModelRouter, task: str):
+        self.router = router
+        self.task = task
+        self._generation_config = None
+
+    @property
+    def model_name(self) -> str:
+        """第一候補のモデル名（キャッシュキー・料金計算に使う）"""
+        return (self.router.routes.get(self.task) or self.router.routes['standard'])[0]
+
+    def generate_content(self, prompt, **kwargs):
+        """振り分け・フォールバック付きで生成"""
+        return self.router.generate(self.task, prompt, **kwargs)
+
+    def count_tokens(self, prompt):
+        """第一候補のモデルでトークン数を数える"""
+        return self.router.model(self.model_name).count_tokens(prompt)
@@ -0,0 +1,147 @@
+"""同じ依頼から温度を変えた候補を並列に生成し、ローカルの簡易評価（と任意でAIの審査）で順位を付けるbest-of-N生成"""
+import re
+import json
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional
+
+from .budget import EXPECTED_OUTPUT_CHARS
+from .client import add_usage, make_usage, response_usage
+from .jobqueue import cancellable, raise_if_cancelled
+from .metrics import finish_reason_name
+from .prompts import create_2ch_video_prompt, create_judge_prompt, create_kaigai_hanno_prompt, create_sukatto_prompt
+
+MIN_TEMPERATURE = 0.6
+MAX_TEMPERATURE = 1.2
+# 種類ごとの構成（いずれかの語が本文にあれば、その部分があるとみなす）
+SECTION_KEYWORDS = {
+    create_sukatto_prompt.__name__: [('プロローグ', '発端'), ('葛藤', '我慢', '展開'), ('転機', '反撃'), ('クライマックス', 'スカッと'), ('エピローグ', '末路', '結末')],
+    create_kaigai_hanno_prompt.__name__: [('オープニング',), ('概要',), ('海外の反応', '反応'), ('エンディング',)],
+}
+LONG_SECTION_KEYWORDS = [('発端',), ('展開',), ('転機',), ('クライマックス',), ('結末',)]
+SPEAKER_LINE_PATTERN = re.compile(r'^(スレ主|住民[A-Za-zＡ-Ｚａ-ｚ0-9０-９]+|語り手[^:：]*|【テロップ】)\s*[:：]')
+JUDGE_JSON_PATTERN = re.compile(r'\[.*\]', re.S)
+HEURISTIC_WEIGHT = 0.5
+HEURISTIC_LABELS = {'length': '長さ', 'sections': '構成', 'speaker_format': '話者形式'}
+
+def sample_temperatures(n: int) -> list:
+    """候補ごとの温度（MIN～MAXを等間隔に分ける）"""
+    if n <= 1:
+        return [(MIN_TEMPERATURE + MAX_TEMPERATURE) / 2]
+    step = (MAX_TEMPERATURE - MIN_TEMPERATURE) / (n - 1)
+    return [round(MIN_TEMPERATURE + step * i, 2) for i in range(n)]
+
+def length_score(text: str, params: Dict) -> Optional[float]:
+    """動画の長さに対する想定文字数との近さ（半分・倍で0、長さの指定がなければNone）"""
+    target = EXPECTED_OUTPUT_CHARS.get(params.get('length'))
+    if not target:
+        return None
+    if not text:
+        return 0.0
+    return max(0.0, 1 - abs(math.log2(len(text) / target)))
+
+def section_score(text: str, prompt_func, params: Dict) -> Optional[float]:
+    """構成の各部分が本文にある割合（長編は5章、構成の決まりがない種類はNone）"""
+    sections = LONG_SECTION_KEYWORDS if params.get('length') in ['long', 'super_long'] else SECTION_KEYWORDS.get(prompt_func.__name__)
+    if not sections:
+        return None
+    return sum(1 for words in sections if any(word in text for word in words)) / len(sections)
+
+def speaker_format_score(text: str, prompt_func) -> Optional[float]:
+    """2ch風の「スレ主: 」「住民A: 」形式に従っている行の割合（スレ主・住民がいなければ減点、2ch風以外はNone）"""
+    if prompt_func.__name__ != create_2ch_video_prompt.__name__:
+        return None
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return 0.0
+    speakers = [SPEAKER_LINE_PATTERN.match(line) for line in lines]
+    ratio = sum(1 for m in speakers if m) / len(lines)
+    names = {m.group(1) for m in speakers if m}
+    if 'スレ主' not in names or not any(name.startswith('住民') for name in names):
+        ratio *= 0.5
+    return ratio
+
+def heuristic_scores(text: str, prompt_func, params: Dict, finish_reason: Optional[str] = None) -> Dict:
+    """ローカルの簡易評価（各項目0～1、該当しない項目は含めない）と合計（0～100）"""
+    scores = {'length': length_score(text, params), 'sections': section_score(text, prompt_func, params),
+              'speaker_format': speaker_format_score(text, prompt_func)}
+    scores = {key: round(value, 3) for key, value in scores.items() if value is not None}
+    total = sum(scores.values()) / len(scores) if scores else 0.5
+    # 出力上限で途中切れした候補は大きく減点する
+    if finish_reason == 'MAX_TOKENS':
+        total *= 0.5
+    return {'components': scores, 'score': round(total * 100, 1)}
+
+def generate_candidate(model, prompt, temperature: float) -> Dict:
+    """1候補を生成（ワーカースレッドで実行）"""
+    response = model.generate_content(prompt, generation_config={'temperature': temperature})
+    return {'text': response.text, 'finish_reason': finish_reason_name(response), **response_usage(response, getattr(model, 'model_name', ''))}
+
+def parse_judge_scores(text: str, count: int) -> Dict[int, Dict]:
+    """審査結果のJSONから候補番号（1始まり）ごとの点数と理由を取り出す（読み取れない場合は空）"""
+    match = JUDGE_JSON_PATTERN.search(text)
+    if not match:
+        return {}
+    try:
+        items = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    scores = {}
+    for item in items if isinstance(items, list) else []:
+        try:
+            index, score = int(item['index']), float(item['score'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 1 <= index <= count:
+            scores[index] = {'score': max(0.0, min(10.0, score)), 'reason': str(item.get('reason', ''))}
+    return scores
+
+def judge_candidates(model, candidates: list, params: Dict, content_type: str) -> tuple:
+    """AIに候補を採点させ、(候補番号ごとの点数, 使用量)を返す"""
+    prompt = create_judge_prompt({'candidates': [c['text'] for c in candidates], 'theme': params.get('theme'), 'content_type': content_type})
+    response = model.generate_content(prompt, generation_config={'temperature': 0.0})
+    return parse_judge_scores(response.text, len(candidates)), response_usage(response, getattr(model, 'model_name', ''))
+
+def run_best_of_n(model, prompt_func, params: Dict, n: int = 3, judge: bool = False, content_type: str = '台本',
+                  on_progress: Optional[Callable[[int, int], None]] = None, cancelled: Optional[threading.Event] = None) -> Dict:
+    """n個の候補を温度を変えて並列に生成し、点数の高い順に並べて返す
+
+    点数はローカルの簡易評価（0～100）。judge=Trueなら生成後にAIで採点し、簡易評価と半々で合算する。
+    on_progress(完了数, 全体数)は候補の完了時に呼び出し元スレッドで呼ばれる。
+    cancelledがセットされると、まだ始まっていない候補と採点は行わずにJobCancelledを送出する。
+    """
+    prompt = prompt_func(params)
+    temperatures = sample_temperatures(n)
+    candidates = [{'index': i, 'temperature': t, 'text': '', 'finish_reason': None, **make_usage(), 'heuristics': {}, 'heuristic_score': None,
+                   'judge_score': None, 'judge_reason': '', 'score': None, 'error': ''} for i, t in enumerate(temperatures, start=1)]
+    total = n + (1 if judge else 0)
+    if on_progress: on_progress(0, total)
+    with ThreadPoolExecutor(max_workers=n) as executor:
+        futures = {executor.submit(cancellable(generate_candidate, cancelled), model, prompt, c['temperature']): c for c in candidates}
+        for done, future in enumerate(as_completed(futures), start=1):
+            raise_if_cancelled(cancelled)
+            try:
+                futures[future].update(future.result())
+            except Exception as e:
+                futures[future]['error'] = str(e)
+            if on_progress: on_progress(done, total)
+
+    succeeded = [c for c in candidates if not c['error']]
+    if not succeeded:
+        raise RuntimeError(f"すべての候補の生成に失敗しました: {candidates[0]['error']}")
+    usage = add_usage(*candidates)
+    for c in succeeded:
+        heuristics = heuristic_scores(c['text'], prompt_func, params, c['finish_reason'])
+        c.update(heuristics=heuristics['components'], heuristic_score=heuristics['score'], score=heuristics['score'])
+    if judge and len(succeeded) > 1:
+        raise_if_cancelled(cancelled)
+        judged, judge_usage = judge_candidates(model, succeeded, params, content_type)
+        usage = add_usage(usage, judge_usage)
+        for number, c in enumerate(succeeded, start=1):
+            if number in judged:
+                c.update(judge_score=judged[number]['score'], judge_reason=judged[number]['reason'],
+                         score=round(HEURISTIC_WEIGHT * c['heuristic_score'] + (1 - HEURISTIC_WEIGHT) * judged[number]['score'] * 10, 1))
+        if on_progress: on_progress(total, total)
+    ranked = sorted(succeeded, key=lambda c: -c['score']) + [c for c in candidates if c['error']]
+    return {'text': ranked[0]['text'], 'candidates': ranked, **usage}
@@ -0,0 +1,97 @@
+"""生成結果の統計（行数・段落数・ナレーション時間の目安・セリフとト書きの割合・話者ごとの行数・漢字とルビの密度）"""
+import re
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict
+
+# 日本語の読み上げ（TTS）の速さの目安（1分あたりの文字数）
+NARRATION_CHARS_PER_MINUTE = 300
+MAX_CACHED_STATS = 64
+# 「スレ主: 」「住民A：」「【テロップ】: 」のような話者付きの行
+SPEAKER_PATTERN = re.compile(r'^\s*([^\s:：「」『』（）()]{1,20})\s*[:：]\s*(.*)$')
+# 「……」『……』だけの行・名前「……」の行
+QUOTE_PATTERN = re.compile(r'^\s*([^\s「」『』（）()]{0,20})[「『](.*)[」』]\s*$')
+HEADING_PATTERN = re.compile(r'^\s*(#+\s|【[^】]*】\s*$|■|━|={3,}|-{3,})')
+RUBY_PATTERN = re.compile(r'[｜|]?[一-龯々〆ヶ]+《[^》]+》')
+KANJI_PATTERN = re.compile(r'[一-龯々〆ヶ]')
+# 読み上げない記号（空白・括弧・見出し記号など）
+SILENT_PATTERN = re.compile(r'[\s#*＊■━=\-【】「」『』（）()｜|《》]')
+# 見出しとして使われやすく、話者ではない項目名
+NON_SPEAKER_LABELS = {'タイトル', 'テーマ', '概要', 'サムネ', 'サムネイル', 'タグ', '説明', '注意', '備考', 'URL'}
+
+def content_hash(text: str) -> str:
+    """内容ごとのキャッシュキー"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class ContentMemo:
+    """テキストから計算した結果を内容のハッシュごとに保持する（古いものから捨てる）"""
+
+    def __init__(self, max_entries: int = MAX_CACHED_STATS):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+
+    def get(self, text: str, compute):
+        """保持していればその結果を、なければcompute(text)を計算して返す"""
+        key = content_hash(text)
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key]
+        value = compute(text)
+        with self._lock:
+            self._values[key] = value
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+        return value
+
+_stats_memo = ContentMemo()
+
+def compute_stats(text: str) -> Dict:
+    """行を1回走査して統計を計算する（キャッシュなし）"""
+    lines = text.split('\n')
+    paragraphs = dialogue_chars = direction_chars = spoken_chars = kanji = visible_chars = ruby = 0
+    speakers = Counter()
+    in_paragraph = False
+    for line in lines:
+        if not line.strip():
+            in_paragraph = False
+            continue
+        if not in_paragraph:
+            paragraphs += 1
+            in_paragraph = True
+        kanji += len(KANJI_PATTERN.findall(line))
+        visible_chars += len(''.join(line.split()))
+        ruby += len(RUBY_PATTERN.findall(line))
+        if HEADING_PATTERN.match(line):
+            continue
+        match = SPEAKER_PATTERN.match(line)
+        if match and match.group(1) not in NON_SPEAKER_LABELS:
+            speaker, body = match.group(1), match.group(2)
+        else:
+            match = QUOTE_PATTERN.match(line)
+            speaker, body = (match.group(1) or '（名前なし）', match.group(2)) if match else (None, line)
+        chars = len(SILENT_PATTERN.sub('', RUBY_PATTERN.sub(lambda m: m.group(0).split('《')[0].lstrip('｜|'), body)))
+        spoken_chars += chars
+        if speaker is None:
+            direction_chars += chars
+        else:
+            dialogue_chars += chars
+            speakers[speaker] += 1
+    return {
+        'chars': len(text), 'lines': text.count('\n') + 1 if text else 0, 'newlines': text.count('\n'), 'paragraphs': paragraphs,
+        'spoken_chars': spoken_chars, 'narration_seconds': round(spoken_chars / NARRATION_CHARS_PER_MINUTE * 60),
+        'dialogue_chars': dialogue_chars, 'direction_chars': direction_chars,
+        'dialogue_ratio': round(dialogue_chars / (dialogue_chars + direction_chars), 3) if dialogue_chars + direction_chars else 0.0,
+        'speakers': dict(speakers.most_common()), 'kanji_ratio': round(kanji / visible_chars, 3) if visible_chars else 0.0,
+        'ruby_count': ruby,
+    }
+
+def text_stats(text: str) -> Dict:
+    """統計を取得（内容のハッシュごとにキャッシュし、同じ内容の再計算を省く）"""
+    return _stats_memo.get(text, compute_stats)
+
+def format_duration(seconds: int) -> str:
+    """秒数を「m分ss秒」にする"""
+    return f"{seconds // 60}分{seconds % 60:02d}秒"
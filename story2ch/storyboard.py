@@ -0,0 +1,130 @@
+"""長編ネーム・絵コンテのページ分割並列生成（ページごとのビートシートを作ってから、ページ範囲ごとに並列に生成し、通し番号のコマで結合する）"""
+import re
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional
+
+from .client import add_usage, cached_generate
+from .jobqueue import cancellable, raise_if_cancelled
+from .proofread import JSON_FENCE_PATTERN
+from .prompts import create_beat_sheet_prompt, create_name_pages_prompt
+
+PAGES_PER_SHARD = 10
+# これより多いページ数は1回の生成では途中で切れやすいため、ページ分割生成を既定にする
+SHARDED_NAME_MIN_PAGES = 20
+MAX_WORKERS = 8
+PANEL_FIELDS = {'layout': 'コマ割り', 'characters': '配置', 'dialogue': 'セリフ', 'action': '動作・表情', 'background': '背景・効果音'}
+
+BEAT_LINE_PATTERN = re.compile(r'^\s*(\d+)\s*(?:ページ|P|p)\s*(?:目)?\s*[:：]\s*(.+)$', re.M)
+CHARACTERS_PATTERN = re.compile(r'^\s*登場人物\s*[:：]\s*(.+)$', re.M)
+SETTING_PATTERN = re.compile(r'^\s*舞台\s*[:：]\s*(.+)$', re.M)
+
+def page_ranges(pages: int, pages_per_shard: int = PAGES_PER_SHARD) -> list:
+    """1始まりのページ範囲(開始, 終了)の一覧"""
+    return [(start, min(start + pages_per_shard - 1, pages)) for start in range(1, pages + 1, pages_per_shard)]
+
+def parse_beat_sheet(text: str, pages: int) -> Dict:
+    """ビートシートから登場人物・舞台・ページごとの出来事を取り出す（見つからないページは空文字）"""
+    beats = [""] * pages
+    for m in BEAT_LINE_PATTERN.finditer(text):
+        page = int(m.group(1))
+        if 1 <= page <= pages and not beats[page - 1]:
+            beats[page - 1] = m.group(2).strip()
+    characters, setting = CHARACTERS_PATTERN.search(text), SETTING_PATTERN.search(text)
+    return {'characters': characters.group(1).strip() if characters else '', 'setting': setting.group(1).strip() if setting else '', 'beats': beats}
+
+def build_shard_params(params: Dict, sheet: Dict, start: int, end: int) -> Dict:
+    """1範囲分の生成パラメータを作成"""
+    beats = sheet['beats']
+    beat_sheet = "\n".join(f"{page}ページ: {beat or '（未定）'}" for page, beat in enumerate(beats, start=1))
+    shard = {'start': start, 'end': end, 'characters': sheet['characters'], 'setting': sheet['setting'], 'beat_sheet': beat_sheet,
+             'previous_beat': f"{start - 1}ページ: {beats[start - 2]}" if start > 1 else '', 'next_beat': f"{end + 1}ページ: {beats[end]}" if end < len(beats) else ''}
+    return dict(params, shard=shard)
+
+def parse_shard_pages(raw: str, start: int, end: int) -> Optional[Dict[int, list]]:
+    """範囲の生成結果のJSONから、ページ番号ごとのコマの一覧を取り出す（読めない場合はNone）"""
+    cleaned = JSON_FENCE_PATTERN.sub('', raw.strip())
+    match = re.search(r'\{.*\}', cleaned, re.S)
+    try:
+        data = json.loads(match.group(0) if match else cleaned)
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('pages'), list):
+        return None
+    pages = {}
+    for position, page in enumerate(data['pages']):
+        if not isinstance(page, dict):
+            continue
+        try:
+            number = int(page.get('page', start + position))
+        except (TypeError, ValueError):
+            number = start + position
+        if start <= number <= end and number not in pages:
+            pages[number] = [{key: str(panel.get(key) or '') for key in PANEL_FIELDS} for panel in page.get('panels') or [] if isinstance(panel, dict)]
+    return pages
+
+def generate_shard(model, params: Dict, cache, read_cache: bool) -> Dict:
+    """1範囲分のネームを生成（ワーカースレッドで実行）"""
+    shard = params['shard']
+    raw, usage, hit = cached_generate(model, create_name_pages_prompt(params), cache, read_cache)
+    pages = parse_shard_pages(raw, shard['start'], shard['end'])
+    return {'pages': pages or {}, 'raw': raw if pages is None else '', 'usage': usage, 'cache_hit': hit, 'failed': pages is None}
+
+def merge_pages(sheet: Dict, ranges: list, results: list) -> list:
+    """範囲ごとの結果をページ順に並べ、コマに通し番号を付けたページごとの記録にする"""
+    records, number = [], 0
+    for (start, end), result in zip(ranges, results):
+        for page in range(start, end + 1):
+            panels = []
+            for index, panel in enumerate(result['pages'].get(page, []), start=1):
+                number += 1
+                panels.append({'number': number, 'index_in_page': index, **panel})
+            records.append({'page': page, 'beat': sheet['beats'][page - 1], 'panels': panels,
+                            # JSONを読み取れなかった範囲は、生成結果をそのまま範囲の先頭ページに残す
+                            'raw': result['raw'] if page == start else ''})
+    return records
+
+def format_name_text(records: list, sheet: Dict) -> str:
+    """ページごとの記録をテキストのネームにする"""
+    lines = [f"登場人物: {sheet['characters']}", f"舞台: {sheet['setting']}"] if sheet['characters'] or sheet['setting'] else []
+    for record in records:
+        lines += ["", f"■ {record['page']}ページ" + (f"（{record['beat']}）" if record['beat'] else "")]
+        for panel in record['panels']:
+            lines.append(f"コマ{panel['number']}（{record['page']}ページ{panel['index_in_page']}コマ目）")
+            lines += [f"  - {label}: {panel[key]}" for key, label in PANEL_FIELDS.items() if panel[key]]
+        if record['raw']:
+            lines.append(record['raw'].strip())
+        elif not record['panels']:
+            lines.append("（このページのネームは生成されませんでした）")
+    return "\n".join(lines).strip()
+
+def generate_name_sharded(model, params: Dict, cache=None, read_cache: bool = True, pages_per_shard: int = PAGES_PER_SHARD,
+                          max_workers: int = MAX_WORKERS, on_progress: Optional[Callable[[int, int], None]] = None,
+                          cancelled: Optional[threading.Event] = None) -> Dict:
+    """ページごとのビートシートを作成してから、ページ範囲ごとにネームを並列に生成して結合する
+
+    on_progress(完了範囲数, 全範囲数)はビートシート完了時と各範囲の完了時に呼び出し元スレッドで呼ばれる。
+    cancelledがセットされると、まだ始まっていない範囲は生成せずにJobCancelledを送出する。
+    """
+    raise_if_cancelled(cancelled)
+    pages = int(params.get('pages', 20))
+    beat_text, total_usage, hit = cached_generate(model, create_beat_sheet_prompt(params), cache, read_cache)
+    hits = [hit]
+    sheet = parse_beat_sheet(beat_text, pages)
+    ranges = page_ranges(pages, pages_per_shard)
+    results = [None] * len(ranges)
+    if on_progress: on_progress(0, len(ranges))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+        futures = {executor.submit(cancellable(generate_shard, cancelled), model, build_shard_params(params, sheet, start, end), cache, read_cache): i
+                   for i, (start, end) in enumerate(ranges)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            raise_if_cancelled(cancelled)
+            results[futures[future]] = future.result()
+            if on_progress: on_progress(done, len(ranges))
+
+    records = merge_pages(sheet, ranges, results)
+    hits += [result['cache_hit'] for result in results]
+    return {'text': format_name_text(records, sheet), 'pages': records, 'characters': sheet['characters'], 'setting': sheet['setting'],
+            'failed_ranges': [ranges[i] for i, result in enumerate(results) if result['failed']],
+            **add_usage(total_usage, *(result['usage'] for result in results)), 'cache_hits': sum(hits), 'cache_misses': len(hits) - sum(hits)}
@@ -0,0 +1,34 @@
+import pytest
+
+from story2ch.batch import build_batch_params
+from story2ch.prompts import VIDEO_PROMPT_FUNCS
+
+def test_row_is_normalized():
+    job = build_batch_params({' theme ': ' 義母の話 ', 'type': 'スカッと系', 'style': 'in_laws', 'length': 'long'}, '2ch', bible='設定')
+    assert job['type'] == 'sukatto'
+    params = job['params']
+    assert (params['theme'], params['style'], params['length'], params['bible']) == ('義母の話', 'in_laws', 'long', '設定')
+    assert params['pov_character'] == '第三者ナレーター' and not params['use_advanced_settings']
+
+def test_defaults_to_first_style_of_type():
+    assert build_batch_params({'theme': 'x'}, '2ch')['params']['style'] == 'love-story'
+    assert build_batch_params({'theme': 'x', 'style': ''}, 'kaigai')['params']['style'] == 'praise'
+
+def test_prompt_has_no_unfilled_style():
+    for video_type, prompt_func in VIDEO_PROMPT_FUNCS.items():
+        job = build_batch_params({'theme': 'x'}, video_type)
+        assert 'None' not in str(prompt_func(job['params']))
+
+def test_outline_fields_enable_advanced_settings():
+    assert build_batch_params({'theme': 'x', 'story_turn': '逆転'}, 'sukatto')['params']['use_advanced_settings']
+
+@pytest.mark.parametrize('row, message', [
+    ({'theme': ''}, 'theme'),
+    ({'theme': 'x', 'type': 'drama'}, '動画の種類'),
+    ({'theme': 'x', 'length': 'forever'}, '長さ'),
+    ({'theme': 'x', 'style': 'bogus'}, 'スタイル'),
+    ({'theme': 'x', 'type': '2ch', 'style': 'in_laws'}, 'スタイル'),
+])
+def test_invalid_rows_raise(row, message):
+    with pytest.raises(ValueError, match=message):
+        build_batch_params(row, 'sukatto')
@@ -0,0 +1,32 @@
+from story2ch.bible import MIN_SHORTENED_TOKENS, BibleStore, fit_summary
+from story2ch.budget import approximate_tokens
+
+def test_fit_summary_keeps_everything_within_budget():
+    sections = {'work': ["作品: 『テスト』"], 'characters': ["- 花子（主人公）", "- 太郎（夫）"]}
+    result = fit_summary(sections, 600)
+    assert result['text'].splitlines() == ["作品: 『テスト』", "- 花子（主人公）", "- 太郎（夫）"]
+    assert result['omitted_lines'] == 0
+    assert result['tokens'] == sum(approximate_tokens(line) + 1 for line in result['text'].splitlines())
+
+def test_fit_summary_shortens_then_omits_lines_over_budget():
+    sections = {'work': ["作品: 『テスト』"], 'plot': ["あらすじ: " + "あ" * 200], 'notes': ["メモ: 口調は丁寧語"]}
+    budget = approximate_tokens("作品: 『テスト』") + 1 + MIN_SHORTENED_TOKENS + 5
+    result = fit_summary(sections, budget)
+    lines = result['text'].splitlines()
+    # 長いあらすじは残りに収まるように縮め、後ろの項目は省く
+    assert lines[0] == "作品: 『テスト』" and lines[1].startswith("あらすじ: あ") and lines[1].endswith("…")
+    assert len(lines) == 2 and result['omitted_lines'] == 1
+    assert result['tokens'] <= budget
+
+def test_fit_summary_omits_line_when_remaining_is_too_small():
+    result = fit_summary({'work': ["作品: " + "あ" * 50]}, MIN_SHORTENED_TOKENS)
+    assert result == {'text': '', 'tokens': 0, 'omitted_lines': 1}
+
+def test_summary_is_cached_per_budget(tmp_path):
+    store = BibleStore(str(tmp_path / 'bible.sqlite3'))
+    bible_id = store.create("シリーズ", title="テスト", plot="あらすじです。" * 100)
+    small, large = store.summary(bible_id, 100), store.summary(bible_id, 600)
+    assert small['tokens'] <= 100 < large['tokens']
+    assert store.summary(bible_id, 100) == small and store.summary(bible_id, 600) == large
+    store.update(bible_id, title="改題")
+    assert "改題" in store.summary(bible_id, 100)['text']
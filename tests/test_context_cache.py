@@ -0,0 +1,54 @@
+from story2ch.context_cache import ContextCache
+
+class InvalidArgument(Exception):
+    code = 400
+
+class MethodNotImplemented(Exception):
+    code = 501
+
+class ResourceExhausted(Exception):
+    code = 429
+
+PREFIX_A = "あ" * 5000
+PREFIX_B = "い" * 5000
+
+def make_cache(errors):
+    calls = []
+    def factory(model_name, prefix, ttl_seconds):
+        calls.append(prefix)
+        error = errors.get(prefix)
+        if error is not None:
+            raise error
+        return f"cached:{model_name}:{len(calls)}"
+    return ContextCache(model_factory=factory, clock=lambda: 0.0), calls
+
+def test_short_prefix_is_not_cached():
+    cache, calls = make_cache({})
+    assert cache.model_for('m', "短い") is None
+    assert calls == []
+
+def test_rejected_prefix_only_skips_that_prefix():
+    cache, calls = make_cache({PREFIX_A: InvalidArgument("cached content is too small")})
+    assert cache.model_for('m', PREFIX_A) is None
+    assert cache.model_for('m', PREFIX_A) is None
+    assert cache.model_for('m', PREFIX_B) is not None
+    assert calls == [PREFIX_A, PREFIX_B]
+
+def test_not_implemented_disables_model():
+    cache, calls = make_cache({PREFIX_A: MethodNotImplemented("not supported")})
+    assert cache.model_for('m', PREFIX_A) is None
+    assert cache.model_for('m', PREFIX_B) is None
+    assert cache.model_for('other', PREFIX_B) is not None
+    assert calls == [PREFIX_A, PREFIX_B]
+
+def test_transient_error_pauses_model_briefly():
+    cache, calls = make_cache({PREFIX_A: ResourceExhausted("quota")})
+    assert cache.model_for('m', PREFIX_A) is None
+    assert cache.model_for('m', PREFIX_B) is None
+    assert calls == [PREFIX_A]
+
+def test_registered_prefix_is_reused():
+    cache, calls = make_cache({})
+    first = cache.model_for('m', PREFIX_A)
+    assert cache.model_for('m', PREFIX_A) == first
+    assert len(calls) == 1 and cache.stats()['hits'] == 1
@@ -0,0 +1,34 @@
+from story2ch.export import CAPTION_LINE_CHARS, CAPTION_MAX_CHARS, UNKNOWN_SPEAKER, parse_line, segment_cues
+
+def make_segment(text, start=10.0, end=20.0):
+    return {'text': text, 'start': start, 'end': end}
+
+def test_short_line_is_one_cue():
+    assert list(segment_cues(make_segment("こんにちは。"))) == [(10.0, 20.0, "こんにちは。")]
+
+def test_long_line_splits_at_sentences_and_keeps_timing_contiguous():
+    sentence = "あ" * 30 + "。"
+    cues = list(segment_cues(make_segment(sentence * 3)))
+    assert len(cues) == 3
+    assert cues[0][0] == 10.0 and abs(cues[-1][1] - 20.0) < 1e-9
+    for (_, end, _), (start, _, _) in zip(cues, cues[1:]):
+        assert end == start
+    assert all(len(text.replace("\n", "")) <= CAPTION_MAX_CHARS for _, _, text in cues)
+
+def test_cue_duration_is_proportional_to_length():
+    cues = list(segment_cues(make_segment("あ" * 39 + "。" + "い" * 19 + "。", 0.0, 6.0)))
+    assert [round(end - start, 3) for start, end, _ in cues] == [4.0, 2.0]
+
+def test_sentence_longer_than_caption_is_cut_by_chars():
+    cues = list(segment_cues(make_segment("あ" * (CAPTION_MAX_CHARS * 2 + 5))))
+    assert [len(text.replace("\n", "")) for _, _, text in cues] == [CAPTION_MAX_CHARS, CAPTION_MAX_CHARS, 5]
+
+def test_wrapped_line_does_not_start_with_punctuation():
+    text = "あ" * (CAPTION_LINE_CHARS - 1) + "い。、" + "う" * 10
+    (_, _, caption), = segment_cues(make_segment(text))
+    first, second = caption.split("\n")
+    assert first + second == text
+    assert second[0] not in "。、"
+
+def test_bare_quote_has_unknown_speaker():
+    assert parse_line("「誰かの声」") == {'speaker': UNKNOWN_SPEAKER, 'role': '', 'kind': 'dialogue', 'body': '誰かの声'}
@@ -0,0 +1,111 @@
+from story2ch.jobqueue import BATCH, INTERACTIVE, JobQueue, JobStore, TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def make_bucket(rpm=0, tpm=0):
+    clock = FakeClock()
+    return TokenBucket(rpm, tpm, clock=clock, sleep=clock.sleep), clock
+
+def make_queue(bucket=None):
+    # ワーカーなしで作り、_takeを直接呼んで順番を確かめる
+    return JobQueue(workers=0, bucket=bucket or TokenBucket(0, 0))
+
+def take(queue):
+    with queue._lock:
+        return queue._take()
+
+def test_acquire_consumes_and_waits_for_refill():
+    bucket, clock = make_bucket(rpm=60, tpm=600)
+    assert bucket.acquire(1, 600)
+    assert clock.now == 0
+    assert bucket.acquire(1, 300)
+    # 600トークン/分なので300トークン分の補充に30秒待つ
+    assert clock.now >= 30
+
+def test_acquire_caps_requests_larger_than_capacity():
+    bucket, clock = make_bucket(tpm=100)
+    assert bucket.acquire(1, 10_000)
+    assert bucket.levels()['tokens'] == 0
+
+def test_acquire_returns_false_when_cancelled():
+    class Cancelled:
+        def is_set(self):
+            return True
+    bucket, _ = make_bucket(rpm=1)
+    assert bucket.acquire()
+    assert not bucket.acquire(cancelled=Cancelled())
+
+def test_try_acquire_does_not_consume_when_waiting():
+    bucket, _ = make_bucket(tpm=600)
+    assert bucket.try_acquire(0, 500) == 0
+    assert bucket.try_acquire(0, 200) == 10
+    assert bucket.levels()['tokens'] == 100
+
+def test_adjust_charges_and_refunds_within_capacity():
+    bucket, _ = make_bucket(tpm=1000)
+    bucket.acquire(0, 400)
+    bucket.adjust(300)
+    assert bucket.levels()['tokens'] == 300
+    bucket.adjust(-5000)
+    assert bucket.levels()['tokens'] == 1000
+
+def test_unlimited_bucket_never_waits():
+    bucket, clock = make_bucket()
+    for _ in range(100):
+        assert bucket.acquire(1, 1_000_000)
+    assert clock.now == 0
+
+def test_take_prefers_interactive_and_round_robins_users():
+    queue = make_queue()
+    a1 = queue.submit(lambda job: None, 'a', BATCH)
+    a2 = queue.submit(lambda job: None, 'a', BATCH)
+    b1 = queue.submit(lambda job: None, 'b', BATCH)
+    i1 = queue.submit(lambda job: None, 'c', INTERACTIVE)
+    assert [take(queue)[0] for _ in range(4)] == [i1, a1, b1, a2]
+    assert take(queue) == (None, None)
+
+def test_take_keeps_order_while_rate_limited():
+    bucket, clock = make_bucket(rpm=60)
+    bucket.acquire(60)
+    queue = make_queue(bucket)
+    batch = queue.submit(lambda job: None, 'a', BATCH)
+    job, wait = take(queue)
+    assert job is None and wait == 1
+    assert batch.status == 'レート制限待ち'
+    # レート制限中に投入された対話のジョブが先頭になる
+    interactive = queue.submit(lambda job: None, 'b', INTERACTIVE)
+    clock.now += 1
+    assert take(queue)[0] is interactive
+    clock.now += 1
+    assert take(queue)[0] is batch
+
+def test_cancelled_job_leaves_queue():
+    queue = make_queue()
+    first = queue.submit(lambda job: None, 'a', BATCH)
+    second = queue.submit(lambda job: None, 'a', BATCH)
+    queue.cancel(first.id)
+    assert first.status == '中止'
+    assert take(queue)[0] is second
+
+def test_store_prunes_old_finished_jobs(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'), retention_seconds=60)
+    queue = make_queue()
+    old_done = queue.submit(lambda job: None, 'a', persist=False)
+    old_waiting = queue.submit(lambda job: None, 'a', persist=False)
+    recent = queue.submit(lambda job: None, 'a', persist=False)
+    old_done.status, old_waiting.status, recent.status = '完了', '待機中', '完了'
+    for job in (old_done, old_waiting, recent):
+        store.save(job)
+    store._conn.execute("UPDATE jobs SET updated_at = updated_at - 3600 WHERE id IN (?, ?)", (old_done.id, old_waiting.id))
+    assert store.prune() == 1
+    assert store.load(old_done.id) is None
+    assert store.load(old_waiting.id) is not None
+    assert store.load(recent.id) is not None
@@ -0,0 +1,58 @@
+from story2ch.metrics import InstrumentedModel, MetricsStore
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text]
+
+class FakeStream:
+    usage_metadata = None
+    candidates = []
+
+    def __init__(self, texts, error=None):
+        self.texts = texts
+        self.error = error
+
+    def __iter__(self):
+        for text in self.texts:
+            yield FakeChunk(text)
+        if self.error:
+            raise self.error
+
+class FakeModel:
+    model_name = 'gemini-2.0-flash'
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def generate_content(self, prompt, **kwargs):
+        return self.stream
+
+def stream_model(tmp_path, stream):
+    store = MetricsStore(str(tmp_path / 'metrics.sqlite3'))
+    return InstrumentedModel(FakeModel(stream), store, tab='テスト'), store
+
+def test_cancelled_stream_records_partial_usage(tmp_path):
+    model, store = stream_model(tmp_path, FakeStream(["あいう", "えお", "かき"]))
+    for chunk in model.generate_content("プロンプト" * 10, stream=True):
+        if chunk.text == "えお":
+            break
+    (row,) = store.rows()
+    assert row['finish_reason'] == 'CANCELLED' and not row['error']
+    assert row['input_tokens'] > 0 and row['output_tokens'] > 0
+
+def test_failed_stream_records_error(tmp_path):
+    model, store = stream_model(tmp_path, FakeStream(["あいう"], error=RuntimeError("切断")))
+    try:
+        for _ in model.generate_content("プロンプト", stream=True):
+            pass
+    except RuntimeError:
+        pass
+    (row,) = store.rows()
+    assert row['error'] == 'RuntimeError' and row['output_tokens'] > 0
+
+def test_completed_stream_is_recorded_once(tmp_path):
+    model, store = stream_model(tmp_path, FakeStream(["あいう", "えお"]))
+    assert [chunk.text for chunk in model.generate_content("プロンプト", stream=True)] == ["あいう", "えお"]
+    (row,) = store.rows()
+    assert row['finish_reason'] is None and not row['error'] and row['ttft_ms'] is not None
@@ -0,0 +1,32 @@
+from story2ch.client import create_model
+from story2ch.pipeline import build_pipeline, pipeline_stage_params, run_stage
+
+class FakeRouter:
+    """for_taskで振り分けられたタスクの種類を記録する"""
+
+    def __init__(self):
+        self.model = create_model('', backend='mock')
+        self.tasks = []
+
+    def for_task(self, task):
+        self.tasks.append(task)
+        return self.model
+
+def stage(config, name):
+    return next(s for s in build_pipeline(config) if s['name'] == name)
+
+def test_run_stage_routes_on_stage_params():
+    # 段階のパラメータにない設定（length）では振り分けを変えない
+    config = {'theme': 'テーマ', 'length': 'long', 'level': 'basic', 'check_types': []}
+    router = FakeRouter()
+    run_stage(router, stage(config, 'script'), config, {'plot': 'プロット'}, None, True)
+    run_stage(router, stage(config, 'proofread'), config, {'script': '台本です。'}, None, True)
+    assert router.tasks == ['standard', 'fast']
+
+def test_stage_params_cover_every_stage_before_running():
+    config = {'genre': 'ホラー', 'check_types': ['plot_holes', 'pacing_improvement']}
+    pairs = pipeline_stage_params(config)
+    assert [s['name'] for s, _ in pairs] == [s['name'] for s in build_pipeline(config)]
+    params = dict((s['name'], p) for s, p in pairs)
+    # 後の段階のパラメータには前の段階の仮の本文が入る
+    assert params['script']['plot'] and params['check:plot_holes']['text_to_check']
@@ -0,0 +1,12 @@
+import pytest
+
+from story2ch.precheck import check_doubled_particles
+
+@pytest.mark.parametrize('text', ["彼とと一緒に行った。", "行こうとと思った。", "駅のの前で待つ。", "本をを読む。"])
+def test_doubled_particle_is_flagged(text):
+    (item,) = check_doubled_particles(text)
+    assert text[item['offset']:item['offset'] + 2] in ('とと', 'のの', 'をを')
+
+@pytest.mark.parametrize('text', ["準備がととのった。", "もっとと思った。", "出発することとなった。", "おとといの話。", "楽しいひとときだった。", "相手をののしる。"])
+def test_words_with_doubled_kana_are_not_flagged(text):
+    assert check_doubled_particles(text) == []
@@ -0,0 +1,36 @@
+from story2ch.proofread import locate_corrections, split_into_chunks
+
+TEXT = "一文目です。二文目です。\n\n三文目です。四文目です。\n\n五文目です。"
+
+def test_chunks_cover_text_without_overlap():
+    chunks = split_into_chunks(TEXT, chunk_size=14, overlap=3)
+    assert "".join(c['text'] for c in chunks) == TEXT
+    assert all(a['end'] == b['start'] for a, b in zip(chunks, chunks[1:]))
+    assert [c['index'] for c in chunks] == list(range(len(chunks)))
+
+def test_chunks_cut_at_paragraph_then_sentence():
+    chunks = split_into_chunks(TEXT, chunk_size=16, overlap=3)
+    # 上限の半分以上なら段落の区切り、そうでなければ文末で切る
+    assert chunks[0]['text'] == "一文目です。二文目です。\n\n"
+    assert all(c['text'].endswith(("。", "\n")) for c in chunks)
+    assert chunks[1]['context_before'] == TEXT[chunks[1]['start'] - 3:chunks[1]['start']]
+    assert chunks[0]['context_after'] == TEXT[chunks[0]['end']:chunks[0]['end'] + 3]
+
+def test_text_without_breaks_is_cut_by_chars():
+    chunks = split_into_chunks("あ" * 25, chunk_size=10, overlap=0)
+    assert [len(c['text']) for c in chunks] == [10, 10, 5]
+
+def test_short_text_is_one_chunk():
+    (chunk,) = split_into_chunks("短い文。")
+    assert chunk['start'] == 0 and chunk['end'] == 4 and chunk['context_before'] == ''
+
+def test_locate_corrections_gives_offsets_in_whole_text():
+    chunk = split_into_chunks(TEXT, chunk_size=16, overlap=3)[1]
+    (item,) = locate_corrections(chunk, [{'original': '四文目', 'corrected': '4文目', 'reason': '表記'}])
+    assert TEXT[item['offset']:item['offset'] + 3] == '四文目'
+    assert item['corrected'] == '4文目' and item['reason'] == '表記'
+
+def test_locate_corrections_follows_order_of_repeated_text():
+    chunk = {'start': 100, 'text': "です。です。です。"}
+    items = locate_corrections(chunk, [{'original': 'です'}, {'original': 'です'}, {'original': 'ない'}])
+    assert [item['offset'] for item in items] == [100, 103, None]
@@ -0,0 +1,30 @@
+from story2ch.recheck import carry_over, diff_paragraphs
+
+OLD = "第一段落です。誤字があるる。\n\n第二段落です。\n\n第三段落の誤植をなおす。\n"
+
+def correction(text, original):
+    return {'offset': text.index(original), 'original': original, 'corrected': original[:-1], 'reason': '誤字'}
+
+def test_carry_over_moves_items_in_unchanged_paragraphs():
+    new = "追加した段落です。\n\n" + OLD
+    item = correction(OLD, 'あるる')
+    carried = carry_over([item], diff_paragraphs(OLD, new)['unchanged'], 'original')
+    assert len(carried) == 1
+    assert new[carried[0]['offset']:].startswith('あるる')
+    # 元の指摘は書き換えない
+    assert item['offset'] == OLD.index('あるる')
+
+def test_carry_over_drops_items_in_changed_paragraphs():
+    new = OLD.replace('第三段落の誤植をなおす。', '第三段落を書き直した。')
+    items = [correction(OLD, 'あるる'), correction(OLD, '誤植を')]
+    carried = carry_over(items, diff_paragraphs(OLD, new)['unchanged'], 'original')
+    assert [c['original'] for c in carried] == ['あるる']
+
+def test_carry_over_skips_items_without_offset():
+    items = [{'offset': None, 'quote': '不明'}]
+    assert carry_over(items, diff_paragraphs(OLD, OLD)['unchanged'], 'quote') == []
+
+def test_carry_over_drops_items_spanning_paragraphs():
+    start = OLD.index('あるる')
+    item = {'offset': start, 'quote': OLD[start:OLD.index('第二段落') + 3]}
+    assert carry_over([item], diff_paragraphs(OLD, OLD)['unchanged'], 'quote') == []
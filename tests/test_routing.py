@@ -0,0 +1,68 @@
+from story2ch.routing import CircuitBreaker
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def make_breaker():
+    clock = FakeClock()
+    return CircuitBreaker(failure_threshold=2, reset_seconds=60, clock=clock), clock
+
+def test_opens_after_threshold_failures():
+    breaker, _ = make_breaker()
+    breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+def test_success_resets_failure_count():
+    breaker, _ = make_breaker()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+def test_half_open_allows_single_trial():
+    breaker, clock = make_breaker()
+    breaker.record_failure(); breaker.record_failure()
+    clock.now = 60
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    # 試行の結果が出るまで他のリクエストは遮断したまま
+    assert not breaker.allow()
+    assert not breaker.allow()
+
+def test_trial_success_closes():
+    breaker, clock = make_breaker()
+    breaker.record_failure(); breaker.record_failure()
+    clock.now = 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow() and breaker.allow()
+
+def test_trial_failure_reopens():
+    breaker, clock = make_breaker()
+    breaker.record_failure(); breaker.record_failure()
+    clock.now = 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    clock.now = 119
+    assert not breaker.allow()
+    clock.now = 120
+    assert breaker.allow()
+
+def test_unrecorded_trial_expires():
+    breaker, clock = make_breaker()
+    breaker.record_failure(); breaker.record_failure()
+    clock.now = 60
+    assert breaker.allow()
+    clock.now = 100
+    assert not breaker.allow()
+    clock.now = 120
+    assert breaker.allow()
@@ -0,0 +1,40 @@
+import json
+
+from story2ch.storyboard import PANEL_FIELDS, merge_pages, page_ranges, parse_shard_pages
+
+def panel(dialogue):
+    return {key: (dialogue if key == 'dialogue' else '') for key in PANEL_FIELDS}
+
+def test_parse_shard_pages_reads_fenced_json():
+    raw = "```json\n" + json.dumps({'pages': [{'page': 3, 'panels': [{'dialogue': 'おはよう', 'layout': '大ゴマ'}]}]}, ensure_ascii=False) + "\n```"
+    pages = parse_shard_pages(raw, 3, 4)
+    assert list(pages) == [3]
+    assert pages[3] == [dict(panel('おはよう'), layout='大ゴマ')]
+
+def test_parse_shard_pages_numbers_pages_by_position_and_drops_out_of_range():
+    raw = json.dumps({'pages': [{'panels': [{'dialogue': 'a'}]}, {'page': 'x', 'panels': []}, {'page': 9, 'panels': [{'dialogue': 'b'}]},
+                                {'page': 1, 'panels': [{'dialogue': '重複'}]}]})
+    pages = parse_shard_pages(raw, 1, 2)
+    # ページ番号がない・読めない場合は並び順から決め、範囲外と重複は捨てる
+    assert pages == {1: [panel('a')], 2: []}
+
+def test_parse_shard_pages_returns_none_for_unreadable_output():
+    assert parse_shard_pages("ネームです", 1, 2) is None
+    assert parse_shard_pages('{"pages": "1ページ"}', 1, 2) is None
+
+def test_merge_pages_numbers_panels_across_shards():
+    sheet = {'characters': '', 'setting': '', 'beats': ["出会い", "", "別れ"]}
+    ranges = page_ranges(3, 2)
+    results = [{'pages': {1: [panel('a'), panel('b')], 2: [panel('c')]}, 'raw': ''},
+               {'pages': {3: [panel('d')]}, 'raw': ''}]
+    records = merge_pages(sheet, ranges, results)
+    assert [r['page'] for r in records] == [1, 2, 3]
+    assert [[(p['number'], p['index_in_page']) for p in r['panels']] for r in records] == [[(1, 1), (2, 2)], [(3, 1)], [(4, 1)]]
+    assert records[0]['beat'] == "出会い" and records[2]['panels'][0]['dialogue'] == 'd'
+
+def test_merge_pages_keeps_raw_output_of_failed_shard_on_first_page():
+    sheet = {'characters': '', 'setting': '', 'beats': ["", "", ""]}
+    results = [{'pages': {1: [panel('a')]}, 'raw': ''}, {'pages': {}, 'raw': "読めない出力"}]
+    records = merge_pages(sheet, [(1, 1), (2, 3)], results)
+    assert [r['raw'] for r in records] == ['', "読めない出力", '']
+    assert records[1]['panels'] == [] and records[2]['panels'] == []